@@ -0,0 +1,238 @@
+import asyncio
+import bisect
+import collections
+import logging
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .models import AlertRule
+from .candles import candle_aggregator
+from .groups import FEED_CONTROL_GROUP, user_group
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class SymbolAlerts:
+    """
+    Active rules of one symbol, each kind in parallel sorted lists
+    (thresholds ascending, rule ids alongside) so a tick finds the rules it
+    fires with a binary search.
+    """
+    __slots__ = (
+        'above', 'above_ids', 'below', 'below_ids',
+        'volume', 'volume_ids', 'volumes', 'volume_sum', 'last_price',
+    )
+
+    def __init__(self):
+        self.above, self.above_ids = [], []
+        self.below, self.below_ids = [], []
+        self.volume, self.volume_ids = [], []
+        self.volumes = None  # deque of recent candle volumes, with volume rules only
+        self.volume_sum = 0.0
+        self.last_price = None
+
+    def lists(self, kind):
+        if kind == AlertRule.PRICE_ABOVE:
+            return self.above, self.above_ids
+        if kind == AlertRule.PRICE_BELOW:
+            return self.below, self.below_ids
+        return self.volume, self.volume_ids
+
+    def __len__(self):
+        return len(self.above) + len(self.below) + len(self.volume)
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules against the live feed.
+
+    Price rules fire when the last traded price crosses their threshold:
+    a tick moving the price from prev to ltp fires the 'above' rules in
+    (prev, ltp] or the 'below' rules in [ltp, prev), found with bisect, so
+    a tick costs O(log n + fired) whatever the number of rules. Volume rules
+    fire when a closed 1m candle's volume exceeds threshold times the
+    average of the previous ALERT_VOLUME_WINDOW candles.
+
+    Rules are one-shot: a fired rule leaves the index and is marked
+    triggered in the database in batches. Fired alerts go to the owner's
+    user group. The engine runs in the process that owns the feed; rule
+    changes reach it over the feed.control group.
+    """
+
+    def __init__(self, volume_window=20):
+        self.volume_window = volume_window
+        self.notify = self.push
+        self._symbols = {}  # symbol -> SymbolAlerts
+        self._rules = {}  # rule id -> (user id, symbol, kind, threshold)
+        self._fired = []  # rule ids to mark triggered
+        self.fired_total = 0
+        self.symbols_changed = False  # set when a symbol gains its first or loses its last rule
+
+    def __len__(self):
+        return len(self._rules)
+
+    def symbols(self):
+        return list(self._symbols)
+
+    def add(self, rule_id, user_id, symbol, kind, threshold):
+        if rule_id in self._rules:
+            self.remove(rule_id)
+        alerts = self._symbols.get(symbol)
+        if alerts is None:
+            alerts = self._symbols[symbol] = SymbolAlerts()
+            self.symbols_changed = True
+        thresholds, ids = alerts.lists(kind)
+        pos = bisect.bisect_right(thresholds, threshold)
+        thresholds.insert(pos, threshold)
+        ids.insert(pos, rule_id)
+        if kind == AlertRule.VOLUME_MULTIPLE and alerts.volumes is None:
+            alerts.volumes = collections.deque(maxlen=self.volume_window)
+        self._rules[rule_id] = (user_id, symbol, kind, threshold)
+
+    def remove(self, rule_id):
+        rule = self._rules.pop(rule_id, None)
+        if rule is None:
+            return
+        _, symbol, kind, threshold = rule
+        alerts = self._symbols[symbol]
+        thresholds, ids = alerts.lists(kind)
+        lo = bisect.bisect_left(thresholds, threshold)
+        hi = bisect.bisect_right(thresholds, threshold)
+        pos = ids.index(rule_id, lo, hi)
+        del thresholds[pos]
+        del ids[pos]
+        if not alerts:
+            del self._symbols[symbol]
+            self.symbols_changed = True
+
+    def apply(self, rule):
+        """Add, replace or drop a rule from its dict form"""
+        if rule.get('active'):
+            self.add(rule['id'], rule['user_id'], rule['symbol'], rule['kind'], rule['threshold'])
+        else:
+            self.remove(rule['id'])
+
+    def load(self, rules):
+        """Replace every rule with (id, user id, symbol, kind, threshold) rows"""
+        self._symbols = {}
+        self._rules = {}
+        self.symbols_changed = True
+        for rule in rules:
+            self.add(*rule)
+        logger.info(f"Alert engine loaded {len(self._rules)} rules")
+
+    def on_tick(self, message):
+        alerts = self._symbols.get(message['symbol'])
+        if alerts is None:
+            return
+        price = message.get('ltp')
+        if price is None:
+            return
+        previous = alerts.last_price
+        alerts.last_price = price
+        if previous is None or price == previous:
+            return
+
+        if price > previous:
+            thresholds, ids = alerts.above, alerts.above_ids
+            lo = bisect.bisect_right(thresholds, previous)
+            hi = bisect.bisect_right(thresholds, price)
+        else:
+            thresholds, ids = alerts.below, alerts.below_ids
+            lo = bisect.bisect_left(thresholds, price)
+            hi = bisect.bisect_left(thresholds, previous)
+        if lo < hi:
+            fired = ids[lo:hi]
+            del thresholds[lo:hi]
+            del ids[lo:hi]
+            self._fire(message['symbol'], fired, price)
+
+    def on_candle(self, symbol, timeframe, candle):
+        """Candle aggregator listener for volume rules"""
+        if timeframe != '1m':
+            return
+        alerts = self._symbols.get(symbol)
+        if alerts is None or alerts.volumes is None:
+            return
+
+        volume = candle[5]
+        volumes = alerts.volumes
+        if len(volumes) == volumes.maxlen and alerts.volume_sum > 0 and alerts.volume:
+            ratio = volume / (alerts.volume_sum / len(volumes))
+            hi = bisect.bisect_left(alerts.volume, ratio)
+            if hi:
+                fired = alerts.volume_ids[:hi]
+                del alerts.volume[:hi]
+                del alerts.volume_ids[:hi]
+                self._fire(symbol, fired, ratio)
+                self.flush()
+
+        if len(volumes) == volumes.maxlen:
+            alerts.volume_sum -= volumes[0]
+        volumes.append(volume)
+        alerts.volume_sum += volume
+
+    def _fire(self, symbol, rule_ids, value):
+        now = time.time()
+        for rule_id in rule_ids:
+            user_id, _, kind, threshold = self._rules.pop(rule_id)
+            self._fired.append(rule_id)
+            self.notify(user_id, {
+                'rule': rule_id,
+                'symbol': symbol,
+                'kind': kind,
+                'threshold': threshold,
+                'value': value,
+                'ts': now,
+            })
+        self.fired_total += len(rule_ids)
+        alerts = self._symbols.get(symbol)
+        if alerts is not None and not alerts:
+            del self._symbols[symbol]
+            self.symbols_changed = True
+
+    def push(self, user_id, alert):
+        channel_layer = get_channel_layer()
+        asyncio.ensure_future(channel_layer.group_send(user_group(user_id), dict(alert, type='alert.fired')))
+
+    def flush(self):
+        """Mark the rules fired since the last flush as triggered"""
+        if self._fired:
+            fired, self._fired = self._fired, []
+            asyncio.ensure_future(sync_to_async(AlertRule.mark_triggered)(fired))
+
+    def stats(self):
+        return {'rules': len(self._rules), 'symbols': len(self._symbols), 'fired': self.fired_total}
+
+
+def active_rules():
+    """Rows for AlertEngine.load; blocking, run it off the event loop"""
+    return list(AlertRule.objects.filter(active=True).values_list(
+        'id', 'user_id', 'symbol', 'kind', 'threshold'
+    ))
+
+
+def rule_changed(rule):
+    """
+    Tell the feed owner about a created, updated or deleted rule.
+    Called from request handlers; `rule.active` is False for deletions.
+    """
+    async_to_sync(get_channel_layer().group_send)(FEED_CONTROL_GROUP, {
+        'type': 'alerts.rule',
+        'rule': {
+            'id': rule.pk,
+            'user_id': rule.user_id,
+            'symbol': rule.symbol,
+            'kind': rule.kind,
+            'threshold': rule.threshold,
+            'active': rule.active,
+        },
+    })
+
+
+alert_engine = AlertEngine(volume_window=settings.ALERT_VOLUME_WINDOW)
+candle_aggregator.owner_listeners.append(alert_engine.on_candle)
+registry.collect('vtrade_alert_rules', 'Alert rules indexed by the alert engine', 'gauge', lambda: len(alert_engine))
+registry.collect('vtrade_alerts_fired_total', 'Alerts fired', 'counter', lambda: alert_engine.fired_total)
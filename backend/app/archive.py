@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+from .groups import escape_symbol
+
+logger = logging.getLogger(__name__)
+
+# One fixed-width record per candle; files are plain arrays of these
+CANDLE_DTYPE = np.dtype([
+    ('t', '<i8'),
+    ('o', '<f8'),
+    ('h', '<f8'),
+    ('l', '<f8'),
+    ('c', '<f8'),
+    ('v', '<f8'),
+])
+
+_EMPTY = np.zeros(0, dtype=CANDLE_DTYPE)
+
+
+class CandleArchive:
+    """
+    Append-only on-disk candle archive, one file per symbol and timeframe.
+
+    Files hold CANDLE_DTYPE records sorted by start time. Reads map the file
+    with numpy.memmap, so a range query is a binary search on the 't' column
+    and returns a view into the mapping without copying.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._last_start = {}  # path -> start of the last record on disk
+        self._maps = {}  # path -> (record count, memmap)
+
+    def path(self, symbol, timeframe):
+        return self.root / timeframe / f'{escape_symbol(symbol)}.bin'
+
+    def _last_written(self, path):
+        if path not in self._last_start:
+            last = None
+            size = path.stat().st_size if path.exists() else 0
+            if size >= CANDLE_DTYPE.itemsize:
+                count = size // CANDLE_DTYPE.itemsize
+                record = np.fromfile(path, dtype=CANDLE_DTYPE, count=1,
+                                     offset=(count - 1) * CANDLE_DTYPE.itemsize)
+                last = int(record['t'][0])
+            self._last_start[path] = last
+        return self._last_start[path]
+
+    def append(self, symbol, timeframe, candles):
+        """
+        Append (start, open, high, low, close, volume) tuples.
+        Candles that do not start after the last stored one are skipped, so
+        the file stays sorted. Returns the number of records written.
+        """
+        path = self.path(symbol, timeframe)
+        last = self._last_written(path)
+        rows = []
+        for candle in candles:
+            start = int(candle[0])
+            if last is not None and start <= last:
+                continue
+            rows.append((start,) + tuple(candle[1:]))
+            last = start
+        if not rows:
+            return 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(np.array(rows, dtype=CANDLE_DTYPE).tobytes())
+        self._last_start[path] = last
+        return len(rows)
+
+    def forget_tails(self):
+        """
+        Drop the cached last starts, so the next append re-reads each file's
+        tail. Needed once another process may have appended to the files.
+        """
+        self._last_start = {}
+
+    def load(self, symbol, timeframe):
+        """Map the whole file read-only; returns an empty array if there is none"""
+        path = self.path(symbol, timeframe)
+        try:
+            count = os.path.getsize(path) // CANDLE_DTYPE.itemsize
+        except OSError:
+            return _EMPTY
+        if count == 0:
+            return _EMPTY
+
+        # Remap only when the writer has appended since the last read;
+        # a partially written trailing record is left out
+        cached = self._maps.get(path)
+        if cached is None or cached[0] != count:
+            cached = (count, np.memmap(path, dtype=CANDLE_DTYPE, mode='r', shape=(count,)))
+            self._maps[path] = cached
+        return cached[1]
+
+    def range(self, symbol, timeframe, start=None, end=None):
+        """Candles with start <= t <= end, as a zero-copy slice of the mapping"""
+        candles = self.load(symbol, timeframe)
+        times = candles['t']
+        lo = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        hi = len(candles) if end is None else int(np.searchsorted(times, end, side='right'))
+        return candles[lo:hi]
+
+
+class ArchiveWriter:
+    """
+    Candle aggregator listener that appends closed candles to the archive.
+
+    Candles are buffered per file and appended every flush_interval seconds
+    on a dedicated thread, so the event loop never waits on disk. stop()
+    appends whatever is still pending.
+    """
+
+    def __init__(self, archive, timeframes, flush_interval=5.0):
+        self.archive = archive
+        self.timeframes = set(timeframes)
+        self.flush_interval = flush_interval
+        self._pending = {}  # (symbol, timeframe) -> list of candles
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='candle-archive')
+        self._task = None
+        self.written = 0
+
+    def add(self, symbol, timeframe, candle):
+        if timeframe in self.timeframes:
+            self._pending.setdefault((symbol, timeframe), []).append(candle)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the periodic flush and append the pending candles"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def reopen(self):
+        """
+        Append the pending candles, then have the archive re-read file tails
+        on the writer thread, after any append still queued there
+        """
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.archive.forget_tails)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if pending:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._write, pending)
+
+    def _write(self, pending):
+        for (symbol, timeframe), candles in pending.items():
+            try:
+                self.written += self.archive.append(symbol, timeframe, candles)
+            except Exception as e:
+                logger.exception(f"Error archiving {timeframe} candles for {symbol}: {e}")
+
+
+candle_archive = CandleArchive(settings.CANDLE_ARCHIVE_DIR)
+archive_writer = ArchiveWriter(
+    candle_archive,
+    settings.CANDLE_ARCHIVE_TIMEFRAMES,
+    flush_interval=settings.CANDLE_ARCHIVE_FLUSH_INTERVAL,
+)
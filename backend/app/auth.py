@@ -0,0 +1,28 @@
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from rest_framework.authtoken.models import Token
+
+
+@database_sync_to_async
+def get_token_user(key):
+    try:
+        return Token.objects.select_related('user').get(key=key).user
+    except Token.DoesNotExist:
+        return None
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates websocket connections with a DRF token, passed as
+    ?token=<key> since browsers cannot set headers on websockets.
+    Connections without a valid token keep the session user, if any.
+    """
+
+    async def __call__(self, scope, receive, send):
+        values = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        if values:
+            user = await get_token_user(values[0])
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
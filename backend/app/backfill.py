@@ -0,0 +1,73 @@
+"""
+Fills the candles a feed outage left out, from the Fyers history API.
+"""
+import asyncio
+import logging
+import time
+from django.conf import settings
+from .services import FyersClientService
+from .quotes import RateLimiter
+from .candles import candle_aggregator, TIMEFRAME_SECONDS
+from .metrics import fyers_request_seconds, fyers_request_errors
+
+logger = logging.getLogger(__name__)
+
+
+async def fetch_history(fyers, symbol, start, end):
+    """1m candles of one symbol between two epoch times, or None on failure"""
+    data = {
+        'symbol': symbol,
+        'resolution': '1',
+        'date_format': '0',
+        'range_from': str(int(start)),
+        'range_to': str(int(end)),
+        'cont_flag': '1',
+    }
+    started = time.perf_counter()
+    try:
+        response = await fyers.history(data=data)
+    except Exception as e:
+        fyers_request_errors.labels('history').inc()
+        logger.warning(f"History request for {symbol} failed: {e}")
+        return None
+    finally:
+        fyers_request_seconds.labels('history').observe(time.perf_counter() - started)
+    if response.get('s') != 'ok':
+        fyers_request_errors.labels('history').inc()
+        logger.warning(f"History request for {symbol} failed: {response.get('message')}")
+        return None
+    return response.get('candles') or []
+
+
+async def backfill_gap(symbols, start, end):
+    """
+    Fetch the 1m candles of [start, end) for every symbol, one history
+    request each, and insert them into the candle aggregator. Requests run
+    at most FEED_BACKFILL_CONCURRENCY at a time and FEED_BACKFILL_RATE_LIMIT
+    per second. Returns {symbol: candles inserted} for the symbols that
+    were fetched.
+    """
+    fyers = await FyersClientService.get_client()
+    if fyers is None or not symbols:
+        return {}
+
+    size = TIMEFRAME_SECONDS['1m']
+    start -= start % size
+    semaphore = asyncio.Semaphore(settings.FEED_BACKFILL_CONCURRENCY)
+    limiter = RateLimiter(settings.FEED_BACKFILL_RATE_LIMIT)
+
+    async def one(symbol):
+        async with semaphore:
+            await limiter.acquire()
+            candles = await fetch_history(fyers, symbol, start, end)
+        if candles is None:
+            return symbol, None
+        return symbol, candle_aggregator.backfill(symbol, candles)
+
+    results = await asyncio.gather(*[one(symbol) for symbol in symbols])
+    filled = {symbol: count for symbol, count in results if count is not None}
+    logger.info(
+        f"Backfilled {sum(filled.values())} candles for {len(filled)} of {len(symbols)} symbols "
+        f"over a {end - start:.0f}s gap"
+    )
+    return filled
@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class TickBridge:
+    """
+    Bounded hand-off of raw messages from the Fyers callback thread to the
+    asyncio loop.
+
+    The Fyers thread only appends to a deque under a lock; a single drainer
+    task on the loop takes messages off in batches and passes each batch to
+    the handler coroutine. The loop is only woken (one call_soon_threadsafe)
+    when the drainer is idle, so a steady stream of ticks costs one deque
+    append each and no Future or Task.
+
+    When the queue is full the overflow policy decides what happens:
+    drop-oldest discards the stalest message, drop-newest discards the
+    incoming one, and block makes the Fyers thread wait for room.
+    """
+
+    def __init__(self, handler, maxsize=10000, policy=DROP_OLDEST, batch_size=500):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{policy}'")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._loop = None
+        self._wakeup = None
+        self._idle = False
+        self._closed = False
+        self._task = None
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def start(self):
+        """Start the drainer on the running loop"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._task = self._loop.create_task(self._drain())
+        return self._task
+
+    def stop(self):
+        with self._lock:
+            self._closed = True
+            self._not_full.notify_all()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def put(self, message):
+        """
+        Enqueue a message; called from the Fyers thread.
+        Returns False when the message was dropped.
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            queue = self._queue
+            if len(queue) >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.policy == DROP_OLDEST:
+                    queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(queue) >= self.maxsize and not self._closed:
+                        self._not_full.wait()
+                    if self._closed:
+                        return False
+            queue.append(message)
+            self.enqueued += 1
+            if len(queue) > self.high_water:
+                self.high_water = len(queue)
+            wake = self._idle
+            self._idle = False
+
+        if wake:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    async def _drain(self):
+        queue = self._queue
+        while True:
+            with self._lock:
+                count = min(len(queue), self.batch_size)
+                batch = [queue.popleft() for _ in range(count)]
+                if batch:
+                    if self.policy == BLOCK:
+                        self._not_full.notify_all()
+                else:
+                    self._idle = True
+
+            if not batch:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                logger.exception(f"Error handling tick batch: {e}")
+
+    def stats(self):
+        return {
+            'depth': len(self._queue),
+            'maxsize': self.maxsize,
+            'policy': self.policy,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'high_water': self.high_water,
+        }
@@ -0,0 +1,314 @@
+import asyncio
+import collections
+import logging
+import math
+import time
+from array import array
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .groups import candle_group
+from .ingest import candle_ingestor
+from .models import Candle
+from .archive import archive_writer
+
+logger = logging.getLogger(__name__)
+
+# Supported timeframes, smallest first. Each one divides the next, so every
+# timeframe is rolled up from closed candles of the one before it.
+TIMEFRAMES = (('1s', 1), ('1m', 60), ('5m', 300), ('15m', 900), ('1h', 3600))
+TIMEFRAME_SECONDS = dict(TIMEFRAMES)
+TIMEFRAME_INDEX = {name: i for i, (name, _) in enumerate(TIMEFRAMES)}
+
+# Layout of one candle inside a symbol's state array
+START, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+WIDTH = 6
+
+_EMPTY_STATE = array('d', [math.nan] * (WIDTH * len(TIMEFRAMES)))
+
+# Seconds to wait past the end of a window before the sweep closes it, so
+# late ticks still land in the right candle
+CLOSE_GRACE_SECONDS = 1.0
+
+
+def candle_to_dict(candle):
+    start, open_, high, low, close, volume = candle
+    return {'t': int(start), 'o': open_, 'h': high, 'l': low, 'c': close, 'v': volume}
+
+
+class CandleAggregator:
+    """
+    Builds OHLCV candles incrementally from SymbolUpdate ticks.
+
+    Each symbol has one flat array('d') holding the open candle of every
+    timeframe (start, open, high, low, close, volume). A tick only touches
+    the 1s candle. When a candle closes it is emitted and folded into the
+    next larger timeframe, so larger timeframes are derived from closed
+    smaller candles and never reprocess ticks.
+
+    Closed candles are kept in a bounded deque per (symbol, timeframe) for
+    the REST endpoint and passed to every listener as
+    listener(symbol, timeframe, candle) with candle a 6-tuple.
+
+    Every process builds candles: the feed owner from the whole feed, the
+    other hubs from the ticks they follow. owner_listeners, which publish
+    or store candles, only run while `owner` is set, so a candle is never
+    broadcast or written twice.
+
+    Symbols that stop streaming are released: once the sweep has closed
+    their last open candle, their state and recent candles are dropped.
+    """
+
+    def __init__(self, history=500):
+        self.history = history
+        self.listeners = []
+        self.owner_listeners = []
+        self.owner = False
+        self._state = {}  # symbol -> array('d')
+        self._last_volume = {}  # symbol -> cumulative volume of the last tick
+        self._recent = {}  # (symbol, timeframe) -> deque of closed candles
+        self._released = set()  # symbols to drop once their candles have closed
+        self._skew = 0.0  # wall clock minus exchange time of the last tick
+        self._task = None
+
+    def symbols(self):
+        return list(self._state)
+
+    def on_tick(self, message):
+        ltp = message.get('ltp')
+        ts = message.get('exch_feed_time') or message.get('last_traded_time')
+        if ltp is None or not ts:
+            return
+
+        symbol = message['symbol']
+        state = self._state.get(symbol)
+        if state is None:
+            state = self._state[symbol] = array('d', _EMPTY_STATE)
+        elif symbol in self._released:
+            # Streaming again before its candles closed
+            self._released.discard(symbol)
+
+        # vol_traded_today is cumulative; a candle gets the difference
+        cumulative = message.get('vol_traded_today')
+        previous = self._last_volume.get(symbol)
+        if cumulative is None:
+            volume = 0
+        elif previous is None or cumulative < previous:
+            volume = message.get('last_traded_qty') or 0
+        else:
+            volume = cumulative - previous
+        if cumulative is not None:
+            self._last_volume[symbol] = cumulative
+
+        self._skew = time.time() - ts
+        bucket = float(int(ts))
+        start = state[START]
+        if start == start and bucket > start:
+            self._close(symbol, state, 0)
+            start = math.nan
+
+        if start != start:
+            state[START] = bucket
+            state[OPEN] = state[HIGH] = state[LOW] = state[CLOSE] = ltp
+            state[VOLUME] = volume
+        else:
+            # Same second, or a late tick that is folded into the open candle
+            if ltp > state[HIGH]:
+                state[HIGH] = ltp
+            if ltp < state[LOW]:
+                state[LOW] = ltp
+            state[CLOSE] = ltp
+            state[VOLUME] += volume
+
+    def _close(self, symbol, state, index):
+        offset = index * WIDTH
+        candle = tuple(state[offset:offset + WIDTH])
+        state[offset + START] = math.nan
+        self._emit(symbol, TIMEFRAMES[index][0], candle)
+        if index + 1 < len(TIMEFRAMES):
+            self._roll_up(symbol, state, index + 1, candle)
+
+    def _roll_up(self, symbol, state, index, candle):
+        offset = index * WIDTH
+        size = TIMEFRAMES[index][1]
+        bucket = candle[START] - candle[START] % size
+        start = state[offset + START]
+
+        if start == bucket:
+            if candle[HIGH] > state[offset + HIGH]:
+                state[offset + HIGH] = candle[HIGH]
+            if candle[LOW] < state[offset + LOW]:
+                state[offset + LOW] = candle[LOW]
+            state[offset + CLOSE] = candle[CLOSE]
+            state[offset + VOLUME] += candle[VOLUME]
+            return
+
+        if start == start:
+            self._close(symbol, state, index)
+        state[offset + START] = bucket
+        state[offset + OPEN] = candle[OPEN]
+        state[offset + HIGH] = candle[HIGH]
+        state[offset + LOW] = candle[LOW]
+        state[offset + CLOSE] = candle[CLOSE]
+        state[offset + VOLUME] = candle[VOLUME]
+
+    def _emit(self, symbol, timeframe, candle):
+        key = (symbol, timeframe)
+        recent = self._recent.get(key)
+        if recent is None:
+            recent = self._recent[key] = collections.deque(maxlen=self.history)
+        recent.append(candle)
+        listeners = self.listeners + self.owner_listeners if self.owner else self.listeners
+        for listener in listeners:
+            try:
+                listener(symbol, timeframe, candle)
+            except Exception as e:
+                logger.exception(f"Candle listener failed: {e}")
+
+    def backfill(self, symbol, candles, now=None):
+        """
+        Insert 1m candles missed during a feed outage, as [t, o, h, l, c, v]
+        rows from the history API. Only finished candles between the last
+        closed 1m candle and the open one are taken; they reach the
+        listeners like any closed candle but are not rolled up into larger
+        timeframes. Returns how many were inserted.
+        """
+        size = TIMEFRAME_SECONDS['1m']
+        recent = self._recent.get((symbol, '1m'))
+        after = recent[-1][START] if recent else -math.inf
+        before = (time.time() - self._skew) if now is None else now
+        state = self._state.get(symbol)
+        if state is not None:
+            # The open 1m candle, or the 1s candle the next one starts from
+            for index in (TIMEFRAME_INDEX['1m'], TIMEFRAME_INDEX['1s']):
+                start = state[index * WIDTH + START]
+                if start == start:
+                    before = min(before, start - start % size)
+
+        inserted = 0
+        for row in sorted(candles):
+            candle = tuple(float(value) for value in row[:WIDTH])
+            if after < candle[START] and candle[START] + size <= before:
+                self._emit(symbol, '1m', candle)
+                after = candle[START]
+                inserted += 1
+        return inserted
+
+    def sweep(self, now=None):
+        """Close every candle whose window has ended, in exchange time"""
+        if now is None:
+            now = time.time() - self._skew - CLOSE_GRACE_SECONDS
+        for symbol, state in self._state.items():
+            for index, (_, size) in enumerate(TIMEFRAMES):
+                start = state[index * WIDTH + START]
+                if start == start and start + size <= now:
+                    self._close(symbol, state, index)
+        for symbol in list(self._released):
+            if not self._has_open(symbol):
+                self._forget(symbol)
+
+    def release(self, symbols):
+        """Drop symbols that no longer stream once their open candles have closed"""
+        for symbol in symbols:
+            if symbol not in self._state:
+                continue
+            if self._has_open(symbol):
+                self._released.add(symbol)
+            else:
+                self._forget(symbol)
+
+    def _has_open(self, symbol):
+        state = self._state[symbol]
+        return any(state[index * WIDTH + START] == state[index * WIDTH + START] for index in range(len(TIMEFRAMES)))
+
+    def _forget(self, symbol):
+        self._released.discard(symbol)
+        self._state.pop(symbol, None)
+        self._last_volume.pop(symbol, None)
+        for timeframe, _ in TIMEFRAMES:
+            self._recent.pop((symbol, timeframe), None)
+
+    async def run(self, interval=1.0):
+        """Sweep once per interval until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def current(self, symbol, timeframe):
+        """
+        The open candle of a timeframe including the not yet rolled up
+        smaller candles, or None
+        """
+        state = self._state.get(symbol)
+        if state is None:
+            return None
+
+        size = TIMEFRAME_SECONDS[timeframe]
+        top = TIMEFRAME_INDEX[timeframe]
+
+        # The smallest open candle is the newest one and decides the window
+        window = None
+        for index in range(top + 1):
+            start = state[index * WIDTH + START]
+            if start == start:
+                window = start - start % size
+                break
+        if window is None:
+            return None
+
+        # Largest first, so open comes from the oldest part of the window
+        merged = None
+        for index in range(top, -1, -1):
+            offset = index * WIDTH
+            start = state[offset + START]
+            if start != start or start < window:
+                continue
+            candle = state[offset:offset + WIDTH]
+            if merged is None:
+                merged = list(candle)
+                merged[START] = window
+            else:
+                merged[HIGH] = max(merged[HIGH], candle[HIGH])
+                merged[LOW] = min(merged[LOW], candle[LOW])
+                merged[CLOSE] = candle[CLOSE]
+                merged[VOLUME] += candle[VOLUME]
+        return tuple(merged)
+
+    def recent(self, symbol, timeframe, limit=None):
+        """Closed candles, oldest first"""
+        candles = list(self._recent.get((symbol, timeframe), ()))
+        if limit:
+            candles = candles[-limit:]
+        return candles
+
+
+def stored_candles(symbol, timeframe, limit):
+    """The latest closed candles from the market_candle table, oldest first"""
+    rows = (
+        Candle.objects.filter(symbol=symbol, timeframe=timeframe)
+        .order_by('-start')
+        .values_list('start', 'open', 'high', 'low', 'close', 'volume')[:limit]
+    )
+    return [(row[0].timestamp(),) + tuple(row[1:]) for row in reversed(rows)]
+
+
+def broadcast_candle(symbol, timeframe, candle):
+    """Aggregator listener pushing closed candles to ws/candles/ subscribers"""
+    channel_layer = get_channel_layer()
+    asyncio.ensure_future(channel_layer.group_send(candle_group(symbol, timeframe), {
+        'type': 'candle.closed',
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'candle': candle_to_dict(candle),
+    }))
+
+
+candle_aggregator = CandleAggregator(history=settings.CANDLE_HISTORY_SIZE)
+candle_aggregator.owner_listeners.append(broadcast_candle)
+if settings.CANDLE_STORE_ENABLED:
+    candle_aggregator.owner_listeners.append(candle_ingestor.add)
+if settings.CANDLE_ARCHIVE_ENABLED:
+    candle_aggregator.owner_listeners.append(archive_writer.add)
@@ -0,0 +1,56 @@
+import os
+import socket
+import time
+import uuid
+
+# Short random tag unique to this process, for process-local group names
+PROCESS_TAG = uuid.uuid4().hex[:6]
+
+# Identifies this process in the feed lease and in demand announcements
+WORKER_ID = f'{socket.gethostname()}-{os.getpid()}-{PROCESS_TAG}'
+
+
+class FeedDemand:
+    """
+    Which symbols each worker process wants from the upstream feed.
+
+    Workers announce subscription transitions as they happen and their full
+    symbol set on every heartbeat; a worker that stops sending heartbeats is
+    dropped after a timeout. Every hub keeps this table, so whichever one
+    takes over the feed already knows what to subscribe to.
+    """
+
+    def __init__(self):
+        self._workers = {}  # worker id -> set of symbols
+        self._seen = {}  # worker id -> monotonic time of the last message
+
+    def touch(self, worker):
+        self._seen[worker] = time.monotonic()
+        return self._workers.setdefault(worker, set())
+
+    def add(self, worker, symbols):
+        self.touch(worker).update(symbols)
+
+    def remove(self, worker, symbols):
+        self.touch(worker).difference_update(symbols)
+
+    def replace(self, worker, symbols):
+        self.touch(worker)
+        self._workers[worker] = set(symbols)
+
+    def expire(self, timeout):
+        """Forget workers not heard from in timeout seconds"""
+        cutoff = time.monotonic() - timeout
+        for worker in [w for w, seen in self._seen.items() if seen < cutoff]:
+            del self._seen[worker]
+            del self._workers[worker]
+
+    def workers(self):
+        return list(self._workers)
+
+    def symbols(self):
+        """Union of every worker's symbols"""
+        wanted = set()
+        for symbols in self._workers.values():
+            wanted |= symbols
+        return wanted
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from .metrics import registry, ws_send_failures
+
+logger = logging.getLogger(__name__)
+
+
+class TickConflator:
+    """
+    Holds the latest tick per symbol for one connection between flushes.
+
+    A tick that arrives for a symbol that is already pending replaces it
+    (conflated). The number of pending symbols is bounded; when it is full
+    the stalest pending tick is dropped to make room. Nothing is ever
+    queued behind a slow client: whatever is pending at flush time is sent
+    as a single frame.
+    """
+
+    # Process-wide totals across all connections
+    totals = {'conflated': 0, 'dropped': 0, 'flushed': 0, 'frames': 0}
+
+    def __init__(self, interval_ms, max_pending):
+        self.interval = interval_ms / 1000.0
+        self.max_pending = max_pending
+        self._pending = {}  # symbol -> latest tick, oldest first
+        self.conflated = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.frames = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, symbol, message):
+        pending = self._pending
+        if symbol in pending:
+            # Re-insert so the dict stays ordered by staleness
+            del pending[symbol]
+            self.conflated += 1
+            self.totals['conflated'] += 1
+        elif len(pending) >= self.max_pending:
+            del pending[next(iter(pending))]
+            self.dropped += 1
+            self.totals['dropped'] += 1
+        pending[symbol] = message
+
+    def drain(self):
+        """Take everything pending, oldest first"""
+        batch = list(self._pending.values())
+        self._pending = {}
+        if batch:
+            self.flushed += len(batch)
+            self.frames += 1
+            self.totals['flushed'] += len(batch)
+            self.totals['frames'] += 1
+        return batch
+
+    async def run(self, send_batch):
+        """Flush pending ticks through send_batch every interval until cancelled"""
+        while True:
+            await asyncio.sleep(self.interval)
+            batch = self.drain()
+            if batch:
+                try:
+                    await send_batch(batch)
+                except Exception as e:
+                    ws_send_failures.inc()
+                    logger.warning("Error flushing conflated ticks: %s", e)
+
+    def stats(self):
+        return {
+            'interval_ms': int(self.interval * 1000),
+            'pending': len(self._pending),
+            'conflated': self.conflated,
+            'dropped': self.dropped,
+            'flushed': self.flushed,
+            'frames': self.frames,
+        }
+
+
+class DepthConflator(TickConflator):
+    """
+    Conflates market depth for one connection, separately from quotes.
+
+    Pending entries are (book, changed levels) per symbol; a newer book
+    replaces the pending one and its changed levels are merged in, so a
+    flush sends every level that changed since the last one, at its
+    latest value.
+    """
+
+    totals = {'conflated': 0, 'dropped': 0, 'flushed': 0, 'frames': 0}
+
+    def add(self, symbol, message):
+        pending = self._pending.get(symbol)
+        if pending is not None:
+            book, changed = message
+            message = (book, changed | pending[1])
+        super().add(symbol, message)
+
+    def discard(self, symbols):
+        for symbol in symbols:
+            self._pending.pop(symbol, None)
+
+    def drain(self):
+        """Take everything pending as {symbol: (book, changed)}, oldest first"""
+        pending = self._pending
+        super().drain()
+        return pending
+
+
+registry.collect('vtrade_conflation_ticks_total', 'Ticks through per-connection conflation, by outcome',
+                 'counter', lambda: {
+                     (outcome,): TickConflator.totals[outcome] for outcome in ('conflated', 'dropped', 'flushed')
+                 }, labelnames=('outcome',))
+registry.collect('vtrade_conflation_frames_total', 'Conflated batch frames sent', 'counter',
+                 lambda: TickConflator.totals['frames'])
+registry.collect('vtrade_depth_conflation_updates_total', 'Depth updates through per-connection conflation, by outcome',
+                 'counter', lambda: {
+                     (outcome,): DepthConflator.totals[outcome] for outcome in ('conflated', 'dropped', 'flushed')
+                 }, labelnames=('outcome',))
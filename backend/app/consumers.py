@@ -1,205 +1,798 @@
-import json
 import asyncio
+import json
+import logging
+import time
 from datetime import datetime
+from urllib.parse import parse_qs
+from django.conf import settings
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from fyers_apiv3.FyersWebsocket import data_ws
-from .services import FyersTokenService
+from .feed import market_data_hub, depth_key, DEFAULT_DATA_TYPE, DEPTH_DATA_TYPE
+from .conflation import DepthConflator, TickConflator
+from .depth import depth_books, levels
+from .wire import DeltaEncoder, epoch_ms, get_codec
+from .candles import TIMEFRAME_SECONDS
+from .groups import candle_group, indicator_group, portfolio_group, symbol_group, user_group
+from .indicators import indicator_engine, parse_params
+from .symbols import symbol_master
+from .models import Portfolio, Watchlist
+from .portfolio import portfolio_engine, portfolio_positions
+from .lastvalue import last_values
+from .metrics import tick_to_send_seconds, ws_send_failures, ws_connections
+
+logger = logging.getLogger(__name__)
+
+# Symbols every client receives until it asks for something else
+DEFAULT_SYMBOLS = ['NSE:ADANIENT-EQ']
+
 
 class StockPriceConsumer(AsyncWebsocketConsumer):
+    """
+    Streams live quotes to a browser.
+
+    The upstream Fyers socket is owned by the process-wide market data hub;
+    this consumer only registers interest in symbols and relays the ticks
+    the hub fans out to its Channels groups.
+
+    With conflation enabled (?conflate_ms=N or the 'configure' action) the
+    consumer keeps only the latest tick per symbol and sends them as one
+    'data_batch' frame every N milliseconds.
+
+    Clients that connect with ?format=compact or ?format=msgpack get the
+    delta-encoded wire format from app.wire instead of full JSON ticks.
+
+    Authenticated clients can connect with ?watchlist=<id or name>, or send
+    'subscribe_watchlist', to follow a saved watchlist. They immediately get
+    a 'watchlist_snapshot' with the latest tick of every symbol the hub has
+    seen, then the usual stream.
+
+    Authenticated connections also receive an 'alert' message whenever one
+    of the user's alert rules fires, and an 'order' message whenever one of
+    the user's paper orders is triggered, filled or cancelled.
+
+    While the hub restores a dropped upstream feed the connection stays
+    open and gets 'reconnecting' messages, then one 'resynced' message with
+    the gap once subscriptions and missed candles are back.
+
+    The 'subscribe_indicator' action streams a live indicator (see
+    app.indicators) for a symbol alongside its quotes; the symbol is kept
+    flowing upstream for as long as the connection has indicators on it.
+
+    Subscribing with 'data_type': 'DepthUpdate' streams the 5-level market
+    depth of the symbols instead: a 'depth_snapshot' of the books the hub
+    already holds, then 'depth' messages carrying only the levels that
+    changed, as [level, price, size, orders] rows per side. Depth is
+    conflated on its own interval (?depth_conflate_ms= or 'configure',
+    DEPTH_CONFLATE_MS by default) into 'depth_batch' frames.
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fyers_socket = None
-        self.access_token = None
-        self.connected = False
-        self._loop = None  
+        self.hub = market_data_hub
+        self.conflator = None
+        self._flush_task = None
+        self.depth_conflator = None
+        self._depth_flush_task = None
+        self.codec = None
+        self.encoder = None
+        self.indicators = set()  # (symbol, timeframe, name, params)
+        self.tick_symbols = set()  # symbols the client asked ticks for directly
+        self.depth_symbols = set()  # symbols the client asked depth for
+        self.watchlists = {}  # watchlist id -> symbols
+
+    def query_param(self, name, default=None):
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get(name)
+        return values[0] if values else default
+
+    def configure_conflation(self, interval_ms):
+        """Switch conflation on (interval_ms > 0) or off for this connection"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        pending = self.conflator.drain() if self.conflator is not None else []
+
+        if interval_ms > 0:
+            self.conflator = TickConflator(interval_ms, settings.STREAM_MAX_PENDING_SYMBOLS)
+            for message in pending:
+                self.conflator.add(message['symbol'], message)
+            self._flush_task = asyncio.ensure_future(self.conflator.run(self.send_batch))
+        else:
+            self.conflator = None
+
+    def configure_depth_conflation(self, interval_ms):
+        """Same as configure_conflation, for market depth"""
+        if self._depth_flush_task:
+            self._depth_flush_task.cancel()
+            self._depth_flush_task = None
+        pending = self.depth_conflator.drain() if self.depth_conflator is not None else {}
+
+        if interval_ms > 0:
+            self.depth_conflator = DepthConflator(interval_ms, settings.STREAM_MAX_PENDING_SYMBOLS)
+            for symbol, entry in pending.items():
+                self.depth_conflator.add(symbol, entry)
+            self._depth_flush_task = asyncio.ensure_future(self.depth_conflator.run(self.send_depth_batch))
+        else:
+            self.depth_conflator = None
 
     async def connect(self):
-        print("Connecting to WebSocket")
+        logger.debug("WebSocket connecting: %s", self.channel_name)
         await self.accept()
-        self._loop = asyncio.get_running_loop()  # Store the event loop
-        
+        ws_connections.inc()
+        self.configure_conflation(int(self.query_param('conflate_ms', settings.STREAM_CONFLATE_MS)))
+        self.configure_depth_conflation(int(self.query_param('depth_conflate_ms', settings.DEPTH_CONFLATE_MS)))
+
         try:
-            # Get the access token
-            self.access_token = await FyersTokenService.get_access_token()
-            print("Access token obtained:", self.access_token)
-            
-            if not self.access_token:
-                print("No access token received")
+            stream_format = self.query_param('format', 'json')
+            if stream_format != 'json':
+                self.codec = get_codec(stream_format)
+                self.encoder = DeltaEncoder()
+                await self.send_payload(self.encoder.header())
+
+            if not await self.hub.start():
+                logger.warning("Closing WebSocket, the market data hub did not start")
                 await self.send_error('Failed to obtain access token')
                 await self.close()
                 return
-                
-            # Initialize Fyers WebSocket with SYNCHRONOUS callbacks
-            self.fyers_socket = data_ws.FyersDataSocket(
-                access_token=self.access_token,
-                log_path="",
-                litemode=False,
-                write_to_file=False,
-                reconnect=True,
-                on_connect=self.on_open_sync,  # Synchronous callback
-                on_close=self.on_close_sync,   # Synchronous callback
-                on_error=self.on_error_sync,   # Synchronous callback
-                on_message=self.on_message_sync # Synchronous callback
-            )
-            
-            print("Connecting to Fyers WebSocket")
-            # Run the blocking connect in a separate thread
-            await self.run_in_thread(self.fyers_socket.connect)
-            print("Connection request sent to Fyers WebSocket")
-            
+
+            await self.hub.add_channel(self.channel_name)
+            user = self.scope.get('user')
+            if user is not None and user.is_authenticated:
+                await self.channel_layer.group_add(user_group(user.pk), self.channel_name)
+
+            watchlist = self.query_param('watchlist')
+            if watchlist:
+                await self.subscribe_watchlist(watchlist)
+            else:
+                await self.subscribe(DEFAULT_SYMBOLS, DEFAULT_DATA_TYPE)
+
         except Exception as e:
-            print(f"Error during connection: {e}")
+            logger.exception("Error during connection: %s", e)
             await self.send_error(f'Connection error: {str(e)}')
             await self.close()
 
     async def disconnect(self, close_code):
-        print(f"WebSocket disconnecting with code {close_code}")
-        if self.fyers_socket:
+        logger.debug("WebSocket disconnecting with code %s", close_code)
+        ws_connections.dec()
+        self.configure_conflation(0)
+        self.configure_depth_conflation(0)
+        for key in self.indicators:
+            indicator_engine.unsubscribe(*key)
+            await self.channel_layer.group_discard(indicator_group(*key), self.channel_name)
+        self.indicators = set()
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            await self.channel_layer.group_discard(user_group(user.pk), self.channel_name)
+        if self.hub.started:
             try:
-                # Run the blocking close in a separate thread
-                await self.run_in_thread(self.fyers_socket.close_connection)
+                await self.hub.remove_channel(self.channel_name)
             except Exception as e:
-                print(f"Error during disconnect: {e}")
-
-    async def run_in_thread(self, func, *args):
-        """Run blocking functions in a separate thread"""
-        return await self._loop.run_in_executor(None, lambda: func(*args))
-
-    # Synchronous callbacks for Fyers WebSocket
-    def on_message_sync(self, message):
-        """Called from Fyers thread - must schedule async work"""
-        print(f"Message received from Fyers: {message}")
-        asyncio.run_coroutine_threadsafe(self.on_message_async(message), self._loop)
-
-    def on_error_sync(self, error):
-        """Called from Fyers thread - must schedule async work"""
-        print(f"Error from Fyers: {error}")
-        asyncio.run_coroutine_threadsafe(self.on_error_async(error), self._loop)
-    
-    def on_close_sync(self):
-        """Called from Fyers thread - must schedule async work"""
-        print("Fyers WebSocket connection closed")
-        self.connected = False
-        asyncio.run_coroutine_threadsafe(self.on_close_async(), self._loop)
-    
-    def on_open_sync(self):
-        """Called from Fyers thread - must schedule async work"""
-        print("Fyers WebSocket connection opened")
-        self.connected = True
-        asyncio.run_coroutine_threadsafe(self.on_open_async(), self._loop)
-
-    # Async methods to handle WebSocket communication
-    async def on_message_async(self, message):
-        print(f"Sending message to client: {message}")
+                logger.warning("Error during disconnect: %s", e)
+
+    async def send_payload(self, payload):
+        """Send a message with the codec this connection asked for"""
+        if self.codec is None:
+            await self.send(text_data=json.dumps(payload))
+        elif self.codec.binary:
+            await self.send(bytes_data=self.codec.dumps(payload))
+        else:
+            await self.send(text_data=self.codec.dumps(payload))
+
+    async def send_frames(self, frames):
+        """Send encoder frames, announcing any newly seen fields first"""
+        new_fields = self.encoder.take_new_fields()
+        if new_fields:
+            await self.send_payload(new_fields)
+        if len(frames) == 1:
+            await self.send_payload(frames[0])
+        elif frames:
+            await self.send_payload(['b', epoch_ms(), frames])
+
+    def indicator_symbols(self):
+        return {key[0] for key in self.indicators}
+
+    def streamed_symbols(self):
+        """Symbols a direct subscription or a followed watchlist wants ticks for"""
+        symbols = set(self.tick_symbols)
+        for watchlist_symbols in self.watchlists.values():
+            symbols.update(watchlist_symbols)
+        return symbols
+
+    async def drop_ticks(self, symbols):
+        """Stop the ticks of symbols nothing on this connection streams any more"""
+        # Symbols still feeding an indicator only stop sending ticks
+        held = self.indicator_symbols()
+        for symbol in symbols:
+            if symbol in held:
+                await self.channel_layer.group_discard(symbol_group(symbol), self.channel_name)
+        await self.hub.unsubscribe(self.channel_name, [s for s in symbols if s not in held])
+        if self.encoder:
+            self.encoder.forget(symbols)
+
+    async def subscribe(self, symbols, data_type):
+        if data_type == DEPTH_DATA_TYPE:
+            await self.subscribe_depth(symbols)
+            return
+        await self.hub.subscribe(self.channel_name, symbols)
+        self.tick_symbols.update(symbols)
+        await self.send_payload({
+            'type': 'subscribed',
+            'symbols': symbols,
+            'data_type': data_type
+        })
+
+    async def unsubscribe(self, symbols, data_type):
+        if data_type == DEPTH_DATA_TYPE:
+            await self.unsubscribe_depth(symbols)
+            return
+        self.tick_symbols.difference_update(symbols)
+        # A followed watchlist keeps its symbols streaming
+        streamed = self.streamed_symbols()
+        await self.drop_ticks([s for s in symbols if s not in streamed])
+        await self.send_payload({
+            'type': 'unsubscribed',
+            'symbols': symbols,
+            'data_type': data_type
+        })
+
+    async def subscribe_depth(self, symbols):
+        # Fyers has no market depth for indices
+        indices = [symbol for symbol in symbols if symbol.endswith('-INDEX')]
+        if indices:
+            await self.send_error(f"No market depth for indices: {', '.join(indices)}")
+            symbols = [symbol for symbol in symbols if symbol not in indices]
+            if not symbols:
+                return
+
+        await self.hub.subscribe(self.channel_name, [depth_key(symbol) for symbol in symbols])
+        self.depth_symbols.update(symbols)
+        await self.send_payload({
+            'type': 'subscribed',
+            'symbols': symbols,
+            'data_type': DEPTH_DATA_TYPE
+        })
+        books = []
+        for symbol in symbols:
+            book = depth_books.get(symbol)
+            # Books the feed has not filled in yet are all zeros
+            if book is not None and any(book):
+                books.append(dict(levels(book), symbol=symbol))
+        await self.send_payload({
+            'type': 'depth_snapshot',
+            'books': books,
+        })
+
+    async def unsubscribe_depth(self, symbols):
+        await self.hub.unsubscribe(self.channel_name, [depth_key(symbol) for symbol in symbols])
+        self.depth_symbols.difference_update(symbols)
+        if self.depth_conflator is not None:
+            self.depth_conflator.discard(symbols)
+        await self.send_payload({
+            'type': 'unsubscribed',
+            'symbols': symbols,
+            'data_type': DEPTH_DATA_TYPE
+        })
+
+    @database_sync_to_async
+    def get_watchlist(self, user, ref):
+        watchlists = Watchlist.objects.filter(user=user)
+        ref = str(ref)
+        if ref.isdigit():
+            return watchlists.filter(pk=int(ref)).first()
+        return watchlists.filter(name=ref).first()
+
+    async def subscribe_watchlist(self, ref):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.send_error('Watchlists need an authenticated connection')
+            return
+        watchlist = await self.get_watchlist(user, ref)
+        if watchlist is None:
+            await self.send_error(f'Unknown watchlist {ref}')
+            return
+
+        # Messages for the new groups are only handled after this returns,
+        # so the snapshot always goes out before the first delta
+        symbols = watchlist.symbols
+        await self.hub.subscribe(self.channel_name, symbols)
+        self.watchlists[watchlist.pk] = symbols
+
+        header = {
+            'type': 'watchlist_snapshot',
+            'watchlist': {'id': watchlist.pk, 'name': watchlist.name},
+            'symbols': symbols,
+        }
+        if self.encoder:
+            await self.send_payload(header)
+            frames = [self.encoder.encode(message) for message in last_values.snapshot(symbols)]
+            await self.send_frames([frame for frame in frames if frame is not None])
+            return
+
+        # Splice in the ticks' cached JSON rather than serializing them again
+        header['timestamp'] = datetime.now().isoformat()
+        text = json.dumps(header)
+        await self.send(text_data=text[:-1] + ', "messages": ' + last_values.snapshot_json(symbols) + '}')
+
+    async def unsubscribe_watchlist(self, ref):
+        watchlist_id = int(ref) if str(ref).isdigit() else None
+        symbols = self.watchlists.pop(watchlist_id, None)
+        if symbols is None:
+            await self.send_error(f'Not subscribed to watchlist {ref}')
+            return
+        # Keep symbols subscribed directly or through another watchlist
+        streamed = self.streamed_symbols()
+        dropped = [s for s in symbols if s not in streamed]
+        await self.drop_ticks(dropped)
+        await self.send_payload({
+            'type': 'unsubscribed',
+            'symbols': dropped,
+            'data_type': DEFAULT_DATA_TYPE
+        })
+
+    async def subscribe_indicator(self, data):
+        symbol = symbol_master.resolve(data['symbol'])
+        if symbol is None:
+            await self.send_error(f"Unknown symbols: {data['symbol']}")
+            return
+        timeframe = data.get('timeframe', '1m')
+        name = data.get('indicator')
+        if timeframe not in TIMEFRAME_SECONDS:
+            await self.send_error(f'Unknown timeframe {timeframe}')
+            return
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'data_update',
-                'message': message,
-                'timestamp': datetime.now().isoformat()
-            }))
-        except Exception as e:
-            print(f"Error sending message to client: {e}")
-            await self.send_error(f"Failed to process market data: {str(e)}")
+            params = parse_params(name, data.get('params') or {})
+        except ValueError as e:
+            await self.send_error(str(e))
+            return
+
+        key = (symbol, timeframe, name, params)
+        if key in self.indicators:
+            values = indicator_engine.latest(*key)
+        else:
+            await self.hub.subscribe(self.channel_name, [symbol], tick_group=False)
+            values = indicator_engine.subscribe(*key)
+            self.indicators.add(key)
+            await self.channel_layer.group_add(indicator_group(*key), self.channel_name)
 
-    async def on_error_async(self, error):
-        print(f"Sending error to client: {error}")
-        await self.send_error(str(error))
+        await self.send_payload({
+            'type': 'indicator_subscribed',
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'indicator': name,
+            'params': dict(params),
+            'values': values,
+        })
 
-    async def on_close_async(self):
-        print("Sending close notification to client")
+    async def unsubscribe_indicator(self, data):
+        symbol = symbol_master.resolve(data['symbol']) or data['symbol']
+        timeframe = data.get('timeframe', '1m')
+        name = data.get('indicator')
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'connection_closed',
-                'message': 'Fyers WebSocket connection closed'
-            }))
+            params = parse_params(name, data.get('params') or {})
+        except ValueError as e:
+            await self.send_error(str(e))
+            return
+
+        key = (symbol, timeframe, name, params)
+        if key in self.indicators:
+            self.indicators.discard(key)
+            indicator_engine.unsubscribe(*key)
+            await self.channel_layer.group_discard(indicator_group(*key), self.channel_name)
+            if symbol not in self.streamed_symbols() and symbol not in self.indicator_symbols():
+                await self.hub.unsubscribe(self.channel_name, [symbol])
+
+        await self.send_payload({
+            'type': 'indicator_unsubscribed',
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'indicator': name,
+            'params': dict(params),
+        })
+
+    # Channel layer handlers, fed by the market data hub
+    async def market_tick(self, event):
+        message = event['message']
+        if self.conflator is not None:
+            self.conflator.add(message['symbol'], message)
+            return
+
+        try:
+            if self.encoder:
+                frame = self.encoder.encode(message)
+                if frame is None:
+                    return
+                await self.send_frames([frame])
+            else:
+                await self.send(text_data=json.dumps({
+                    'type': 'data_update',
+                    'message': message,
+                    'timestamp': datetime.now().isoformat()
+                }))
+            received = event.get('received')
+            if received is not None:
+                tick_to_send_seconds.observe(time.time() - received)
         except Exception as e:
-            print(f"Error sending close notification: {e}")
+            ws_send_failures.inc()
+            logger.warning("Error sending message to client: %s", e)
+            await self.send_error(f"Failed to process market data: {str(e)}")
+
+    async def send_batch(self, messages):
+        if self.encoder:
+            ts = epoch_ms()
+            frames = [self.encoder.encode(message, ts) for message in messages]
+            await self.send_frames([frame for frame in frames if frame is not None])
+            return
+
+        await self.send(text_data=json.dumps({
+            'type': 'data_batch',
+            'messages': messages,
+            'timestamp': datetime.now().isoformat()
+        }))
+
+    async def market_depth(self, event):
+        symbol = event['symbol']
+        if symbol not in self.depth_symbols:
+            return
+        if self.depth_conflator is not None:
+            self.depth_conflator.add(symbol, (event['book'], event['changed']))
+            return
 
-    async def on_open_async(self):
-        print("Fyers connection open, subscribing to symbols")
         try:
-            data_type = "SymbolUpdate"
-            symbols = ['NSE:ADANIENT-EQ']
-            
-            # Create a lambda function to properly pass arguments
-            subscribe_fn = lambda: self.fyers_socket.subscribe(
-                symbols=symbols,
-                data_type=data_type
-            )
-            
-            await self.run_in_thread(subscribe_fn)
-            
-            await self.send(text_data=json.dumps({
-                'type': 'subscribed',
-                'symbols': symbols,
-                'data_type': data_type
-            }))
-            
+            await self.send_payload(dict(levels(event['book'], event['changed']), type='depth', symbol=symbol))
+            received = event.get('received')
+            if received is not None:
+                tick_to_send_seconds.observe(time.time() - received)
         except Exception as e:
-            print(f"Error during subscription: {e}")
-            await self.send_error(f'Subscription error: {str(e)}')
+            ws_send_failures.inc()
+            logger.warning("Error sending market depth to client: %s", e)
+
+    async def send_depth_batch(self, pending):
+        await self.send_payload({
+            'type': 'depth_batch',
+            'books': [dict(levels(book, changed), symbol=symbol) for symbol, (book, changed) in pending.items()],
+        })
+
+    async def market_status(self, event):
+        status = event['status']
+        if status == 'closed':
+            await self.send_payload({
+                'type': 'connection_closed',
+                'message': event['message']
+            })
+        elif status in ('reconnecting', 'resynced'):
+            # The upstream feed is being restored; this socket stays open
+            await self.send_payload(dict(event.get('details', {}), type=status, message=event['message']))
+        elif status == 'error':
+            await self.send_error(event['message'])
+
+    async def indicator_update(self, event):
+        await self.send_payload({
+            'type': 'indicator',
+            'symbol': event['symbol'],
+            'timeframe': event['timeframe'],
+            'indicator': event['indicator'],
+            'params': event['params'],
+            't': event['t'],
+            'values': event['values'],
+        })
+
+    async def alert_fired(self, event):
+        await self.send_payload({
+            'type': 'alert',
+            'rule': event['rule'],
+            'symbol': event['symbol'],
+            'kind': event['kind'],
+            'threshold': event['threshold'],
+            'value': event['value'],
+            'ts': event['ts'],
+        })
+
+    async def order_update(self, event):
+        await self.send_payload({
+            'type': 'order',
+            'order': event['order'],
+            'symbol': event['symbol'],
+            'side': event['side'],
+            'order_type': event['order_type'],
+            'quantity': event['quantity'],
+            'status': event['status'],
+            'filled_price': event['filled_price'],
+            'ts': event['ts'],
+        })
+
+    async def send_stats(self):
+        await self.send_payload({
+            'type': 'stats',
+            'conflation': self.conflator.stats() if self.conflator is not None else None,
+            'depth_conflation': self.depth_conflator.stats() if self.depth_conflator is not None else None,
+        })
 
     async def send_error(self, message):
         """Helper to send error messages"""
         try:
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'error',
                 'message': message
-            }))
+            })
         except Exception as e:
-            print(f"Failed to send error message: {e}")
+            ws_send_failures.inc()
+            logger.warning("Failed to send error message: %s", e)
 
     async def receive(self, text_data):
-        print(f"Received message from client: {text_data}")
+        logger.debug("Received message from client: %s", text_data)
         try:
             data = json.loads(text_data)
-            
-            if not self.fyers_socket or not self.connected:
+
+            if not self.hub.started:
                 await self.send_error('Not connected to Fyers WebSocket')
                 return
-                
+
             action = data.get('action')
-            
-            if action == 'subscribe' and 'symbols' in data:
-                symbols = data['symbols']
-                data_type = data.get('data_type', 'SymbolUpdate')
-
-                print("-------------data type =========",data_type)
-
-                data_type = 'SymbolUpdate'
-                
-                # Create a lambda function to properly pass arguments
-                subscribe_fn = lambda: self.fyers_socket.subscribe(
-                    symbols=symbols,
-                    data_type=data_type
-                )
-                
-                await self.run_in_thread(subscribe_fn)
-                
-                await self.send(text_data=json.dumps({
-                    'type': 'subscribed',
-                    'symbols': symbols,
-                    'data_type': data_type
-                }))
-                
-            elif action == 'unsubscribe' and 'symbols' in data:
-                symbols = data['symbols']
-                data_type = data.get('data_type', 'SymbolUpdate')
-                
-                # Create a lambda function to properly pass arguments
-                unsubscribe_fn = lambda: self.fyers_socket.unsubscribe(
-                    symbols=symbols,
-                    data_type=data_type
-                )
-                
-                await self.run_in_thread(unsubscribe_fn)
-                
-                await self.send(text_data=json.dumps({
-                    'type': 'unsubscribed',
-                    'symbols': symbols,
-                    'data_type': data_type
-                }))
-                
+
+            if action in ('subscribe', 'unsubscribe') and 'symbols' in data:
+                data_type = data.get('data_type', DEFAULT_DATA_TYPE)
+                if data_type not in (DEFAULT_DATA_TYPE, DEPTH_DATA_TYPE):
+                    await self.send_error(f'Unknown data type {data_type}')
+                    return
+                symbols, invalid = symbol_master.resolve_all(data['symbols'])
+                if invalid:
+                    await self.send_error(f"Unknown symbols: {', '.join(invalid)}")
+                if not symbols:
+                    return
+                if action == 'subscribe':
+                    await self.subscribe(symbols, data_type)
+                else:
+                    await self.unsubscribe(symbols, data_type)
+
+            elif action == 'configure' and ('conflate_ms' in data or 'depth_conflate_ms' in data):
+                if 'conflate_ms' in data:
+                    self.configure_conflation(int(data['conflate_ms']))
+                if 'depth_conflate_ms' in data:
+                    self.configure_depth_conflation(int(data['depth_conflate_ms']))
+                await self.send_stats()
+
+            elif action == 'stats':
+                await self.send_stats()
+
+            elif action == 'subscribe_watchlist' and 'watchlist' in data:
+                await self.subscribe_watchlist(data['watchlist'])
+
+            elif action == 'unsubscribe_watchlist' and 'watchlist' in data:
+                await self.unsubscribe_watchlist(data['watchlist'])
+
+            elif action == 'subscribe_indicator' and 'symbol' in data:
+                await self.subscribe_indicator(data)
+
+            elif action == 'unsubscribe_indicator' and 'symbol' in data:
+                await self.unsubscribe_indicator(data)
+
+        except Exception as e:
+            logger.exception("Error processing client message: %s", e)
+            await self.send_error(f'Error processing request: {str(e)}')
+
+
+class CandleConsumer(AsyncWebsocketConsumer):
+    """
+    Streams closed OHLCV candles built by the candle aggregator.
+
+    Clients send {'action': 'subscribe', 'symbols': [...], 'timeframe': '1m'}
+    and receive a 'candle' message whenever a candle of that timeframe closes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hub = market_data_hub
+        self.subscriptions = {}  # symbol -> set of timeframes
+
+    async def connect(self):
+        await self.accept()
+        try:
+            if not await self.hub.start():
+                await self.send_error('Failed to obtain access token')
+                await self.close()
+        except Exception as e:
+            await self.send_error(f'Connection error: {str(e)}')
+            await self.close()
+
+    async def disconnect(self, close_code):
+        for symbol, timeframes in self.subscriptions.items():
+            for timeframe in timeframes:
+                await self.channel_layer.group_discard(candle_group(symbol, timeframe), self.channel_name)
+        self.subscriptions = {}
+        if self.hub.started:
+            await self.hub.remove_channel(self.channel_name)
+
+    async def send_error(self, message):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'message': message
+        }))
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+            action = data.get('action')
+            timeframe = data.get('timeframe', '1m')
+
+            if timeframe not in TIMEFRAME_SECONDS:
+                await self.send_error(f'Unknown timeframe {timeframe}')
+                return
+
+            symbols, invalid = symbol_master.resolve_all(data.get('symbols') or [])
+            if invalid:
+                await self.send_error(f"Unknown symbols: {', '.join(invalid)}")
+
+            if action == 'subscribe':
+                await self.hub.subscribe(self.channel_name, symbols, tick_group=False)
+                for symbol in symbols:
+                    self.subscriptions.setdefault(symbol, set()).add(timeframe)
+                    await self.channel_layer.group_add(candle_group(symbol, timeframe), self.channel_name)
+
+            elif action == 'unsubscribe':
+                released = []
+                for symbol in symbols:
+                    timeframes = self.subscriptions.get(symbol, set())
+                    timeframes.discard(timeframe)
+                    await self.channel_layer.group_discard(candle_group(symbol, timeframe), self.channel_name)
+                    if not timeframes:
+                        self.subscriptions.pop(symbol, None)
+                        released.append(symbol)
+                await self.hub.unsubscribe(self.channel_name, released)
+
+            else:
+                return
+
+            await self.send(text_data=json.dumps({
+                'type': f'{action}d',
+                'symbols': symbols,
+                'timeframe': timeframe
+            }))
+
         except Exception as e:
-            print(f"Error processing client message: {e}")
-            await self.send_error(f'Error processing request: {str(e)}')
\ No newline at end of file
+            await self.send_error(f'Error processing request: {str(e)}')
+
+    async def candle_closed(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'candle',
+            'symbol': event['symbol'],
+            'timeframe': event['timeframe'],
+            'candle': event['candle']
+        }))
+
+
+class PortfolioConsumer(AsyncWebsocketConsumer):
+    """
+    Streams the live P&L of the user's portfolios, computed server-side.
+
+    Connecting with ?portfolio=<id> follows that portfolio, otherwise every
+    portfolio of the user. Each one starts with a 'portfolio_snapshot' of
+    its totals and holdings, followed by a 'portfolio' message at most once
+    per PORTFOLIO_PUSH_INTERVAL_MS with the new totals and the holdings
+    that were repriced, as [symbol, ltp, pnl, day_pnl] rows. Clients can
+    send {'action': 'subscribe' or 'unsubscribe', 'portfolio': <id>}.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hub = market_data_hub
+        self.portfolios = {}  # id -> name
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        await self.accept()
+        try:
+            if not await self.hub.start():
+                await self.send_error('Failed to obtain access token')
+                await self.close()
+                return
+
+            ref = self.query_param('portfolio')
+            if ref is not None:
+                await self.follow(ref)
+            else:
+                for portfolio_id in await self.get_portfolio_ids(user):
+                    await self.follow(portfolio_id)
+
+        except Exception as e:
+            logger.exception("Error during portfolio connection: %s", e)
+            await self.send_error(f'Connection error: {str(e)}')
+            await self.close()
+
+    async def disconnect(self, close_code):
+        for portfolio_id in list(self.portfolios):
+            await self.channel_layer.group_discard(portfolio_group(portfolio_id), self.channel_name)
+            portfolio_engine.unwatch(portfolio_id, self.channel_name)
+        self.portfolios = {}
+        if self.hub.started:
+            await self.hub.remove_channel(self.channel_name)
+
+    def query_param(self, name, default=None):
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get(name)
+        return values[0] if values else default
+
+    async def send_error(self, message):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'message': message
+        }))
+
+    @database_sync_to_async
+    def get_portfolio_ids(self, user):
+        return list(Portfolio.objects.filter(user=user).values_list('pk', flat=True))
+
+    @database_sync_to_async
+    def get_portfolio(self, user, ref):
+        ref = str(ref)
+        if not ref.isdigit():
+            return None
+        return Portfolio.objects.filter(user=user, pk=int(ref)).first()
+
+    async def sync_symbols(self):
+        """Hold exactly the symbols of the followed portfolios in the hub"""
+        wanted = set()
+        for portfolio_id in self.portfolios:
+            wanted.update(portfolio_engine.symbols(portfolio_id))
+        held = self.hub.channel_symbols(self.channel_name)
+        if wanted - held:
+            await self.hub.subscribe(self.channel_name, list(wanted - held), tick_group=False)
+        if held - wanted:
+            await self.hub.unsubscribe(self.channel_name, list(held - wanted))
+
+    async def follow(self, ref):
+        portfolio = await self.get_portfolio(self.scope['user'], ref)
+        if portfolio is None:
+            await self.send_error(f'Unknown portfolio {ref}')
+            return
+        if portfolio.pk in self.portfolios:
+            return
+
+        self.portfolios[portfolio.pk] = portfolio.name
+        await self.channel_layer.group_add(portfolio_group(portfolio.pk), self.channel_name)
+        positions = await database_sync_to_async(portfolio_positions)(portfolio.pk)
+        snapshot = portfolio_engine.watch(portfolio.pk, self.channel_name, positions)
+        await self.sync_symbols()
+        await self.send_snapshot(snapshot)
+
+    async def unfollow(self, portfolio_id):
+        if portfolio_id not in self.portfolios:
+            return
+        del self.portfolios[portfolio_id]
+        await self.channel_layer.group_discard(portfolio_group(portfolio_id), self.channel_name)
+        portfolio_engine.unwatch(portfolio_id, self.channel_name)
+        await self.sync_symbols()
+
+    async def send_snapshot(self, snapshot):
+        snapshot['name'] = self.portfolios.get(snapshot['portfolio'])
+        await self.send(text_data=json.dumps(dict(snapshot, type='portfolio_snapshot')))
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+            action = data.get('action')
+            ref = data.get('portfolio')
+            if action == 'subscribe':
+                await self.follow(ref)
+            elif action == 'unsubscribe':
+                await self.unfollow(int(ref) if str(ref).isdigit() else ref)
+        except Exception as e:
+            await self.send_error(f'Error processing request: {str(e)}')
+
+    async def portfolio_update(self, event):
+        message = dict(event, type='portfolio')
+        await self.send(text_data=json.dumps(message))
+
+    async def portfolio_changed(self, event):
+        """The portfolio was edited through the API: reload and start over"""
+        portfolio_id = event['portfolio']
+        if portfolio_id not in self.portfolios:
+            return
+        if event.get('deleted'):
+            await self.unfollow(portfolio_id)
+            await self.send(text_data=json.dumps({'type': 'portfolio_deleted', 'portfolio': portfolio_id}))
+            return
+        positions = await database_sync_to_async(portfolio_positions)(portfolio_id)
+        portfolio_engine.set_positions(portfolio_id, positions)
+        await self.sync_symbols()
+        await self.send_snapshot(portfolio_engine.snapshot(portfolio_id))
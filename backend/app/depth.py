@@ -0,0 +1,113 @@
+"""
+Five-level market depth per symbol, maintained from DepthUpdate messages.
+"""
+from array import array
+from .metrics import registry
+
+LEVELS = 5
+SIDES = ('bids', 'asks')
+
+# A book is one flat array('d') of 2 * LEVELS slots, bids best first then
+# asks best first, each slot holding (price, size, orders)
+PRICE, SIZE, ORDERS = range(3)
+WIDTH = 3
+SLOTS = len(SIDES) * LEVELS
+ALL_SLOTS = (1 << SLOTS) - 1
+
+_EMPTY_BOOK = array('d', [0.0] * (SLOTS * WIDTH))
+
+# DepthUpdate fields as (field, index in the book array, slot bit)
+_FIELDS = []
+for _side_index, _prefix in enumerate(('bid', 'ask')):
+    for _level in range(LEVELS):
+        _slot = _side_index * LEVELS + _level
+        for _offset, _name in ((PRICE, 'price'), (SIZE, 'size'), (ORDERS, 'order')):
+            _FIELDS.append((f'{_prefix}_{_name}{_level + 1}', _slot * WIDTH + _offset, 1 << _slot))
+_FIELDS = tuple(_FIELDS)
+
+
+def levels(book, changed=ALL_SLOTS):
+    """
+    The levels of a book whose slot bit is set in `changed`, as
+    {'bids': [[level, price, size, orders], ...], 'asks': [...]}, with
+    level 1 the best
+    """
+    sides = {'bids': [], 'asks': []}
+    for slot in range(SLOTS):
+        if changed >> slot & 1:
+            offset = slot * WIDTH
+            side, level = divmod(slot, LEVELS)
+            sides[SIDES[side]].append(
+                [level + 1, book[offset + PRICE], int(book[offset + SIZE]), int(book[offset + ORDERS])]
+            )
+    return sides
+
+
+class DepthBooks:
+    """
+    Latest 5-level book of every symbol with depth subscribers.
+
+    Fyers sends DepthUpdate messages with any subset of the bid/ask
+    price, size and order count fields of the five levels. An update
+    writes the fields it carries into the symbol's fixed-size array and
+    returns a bitmask of the level slots whose values changed, so only
+    those levels need to reach clients. Only tracked symbols are updated,
+    so messages still in flight after an unsubscribe are ignored.
+    """
+
+    def __init__(self):
+        self._books = {}  # symbol -> array('d')
+        self.updates = 0
+        self.unchanged = 0
+
+    def __len__(self):
+        return len(self._books)
+
+    def symbols(self):
+        return list(self._books)
+
+    def get(self, symbol):
+        return self._books.get(symbol)
+
+    def track(self, symbols):
+        """Start an empty book for symbols that have none"""
+        for symbol in symbols:
+            if symbol not in self._books:
+                self._books[symbol] = array('d', _EMPTY_BOOK)
+
+    def update(self, message):
+        """Apply a DepthUpdate message; returns the changed slots as a bitmask"""
+        book = self._books.get(message['symbol'])
+        if book is None:
+            return 0
+        changed = 0
+        get = message.get
+        for field, index, bit in _FIELDS:
+            value = get(field)
+            if value is not None and book[index] != value:
+                book[index] = value
+                changed |= bit
+        self.updates += 1
+        if not changed:
+            self.unchanged += 1
+        return changed
+
+    def replace(self, symbol, values):
+        """Take a whole book from the feed owner, as a list of floats"""
+        self._books[symbol] = array('d', values)
+
+    def remove(self, symbols):
+        for symbol in symbols:
+            self._books.pop(symbol, None)
+
+    def stats(self):
+        return {'symbols': len(self._books), 'updates': self.updates, 'unchanged': self.unchanged}
+
+
+depth_books = DepthBooks()
+registry.collect('vtrade_depth_books', 'Symbols with a market depth book', 'gauge', lambda: len(depth_books))
+registry.collect('vtrade_depth_updates_total', 'DepthUpdate messages applied, by whether they changed the book',
+                 'counter', lambda: {
+                     ('changed',): depth_books.updates - depth_books.unchanged,
+                     ('unchanged',): depth_books.unchanged,
+                 }, labelnames=('outcome',))
@@ -0,0 +1,768 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from channels.layers import get_channel_layer
+from .services import FyersTokenService
+from .models import FeedLease
+from .cluster import WORKER_ID, FeedDemand
+from .lastvalue import last_values
+from .alerts import alert_engine, active_rules
+from .portfolio import portfolio_engine
+from .paper import paper_exchange, working_orders, order_store, fill_store
+from .sources import FEED_SOURCES, TickRecorder
+from .bridge import TickBridge
+from .ingest import tick_ingestor, candle_ingestor
+from .candles import candle_aggregator
+from .archive import archive_writer
+from .backfill import backfill_gap
+from .depth import depth_books
+from .groups import STATUS_GROUP, FEED_CONTROL_GROUP, depth_group, symbol_group
+from .metrics import registry, feed_batch_size, feed_dispatch_seconds
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_TYPE = 'SymbolUpdate'
+DEPTH_DATA_TYPE = 'DepthUpdate'
+
+# Depth subscriptions are held in the hub as prefixed keys, so one demand
+# set carries both data types across processes
+DEPTH_PREFIX = 'depth:'
+
+FEED_LEASE_NAME = 'fyers-data-socket'
+
+
+def depth_key(symbol):
+    return DEPTH_PREFIX + symbol
+
+
+def split_key(key):
+    """A subscription key as (symbol, data type)"""
+    if key.startswith(DEPTH_PREFIX):
+        return key[len(DEPTH_PREFIX):], DEPTH_DATA_TYPE
+    return key, DEFAULT_DATA_TYPE
+
+
+def key_group(key):
+    """The group a subscription key's updates are fanned out on"""
+    symbol, data_type = split_key(key)
+    return depth_group(symbol) if data_type == DEPTH_DATA_TYPE else symbol_group(symbol)
+
+
+class MarketDataHub:
+    """
+    Process-wide owner of the upstream Fyers data socket.
+
+    Consumers register interest in symbols through the hub, which keeps a
+    reference count per symbol and only talks to Fyers when a symbol gains
+    its first subscriber or loses its last one. Ticks are fanned out to the
+    interested consumers through one Channels group per symbol.
+
+    Ticks cross from the Fyers thread to the event loop through a bounded
+    TickBridge and are dispatched in batches. The socket comes from the
+    FEED_SOURCE registered in app.sources, so a recorded file can stand in
+    for Fyers; FEED_RECORD_FILE captures the ticks that pass through.
+
+    With FEED_LEASE_ENABLED several processes share one upstream socket over
+    a cross-process channel layer. Only the holder of the feed lease opens
+    it; every hub announces its symbols on the feed.control group and the
+    owner subscribes upstream to the union. Hubs that do not own the feed
+    follow their symbols' tick groups to keep their last values, candles
+    and live indicators current. If the owner stops renewing the lease,
+    another hub takes over the feed.
+
+    The feed owner also runs the alert engine and keeps the symbols of
+    active alert rules subscribed upstream.
+
+    Market depth is subscribed per symbol under depth_key(symbol) and sent
+    upstream as DepthUpdate. The owner keeps a 5-level book per symbol in
+    app.depth and fans out only the levels an update changed, on one
+    depth group per symbol.
+
+    When the upstream socket drops, the owner reconnects it with jittered
+    exponential backoff while consumers keep their sockets. Once it is back,
+    the current symbol set is re-subscribed in batches, the 1m candles of
+    the gap are backfilled from the history API and every consumer gets a
+    'resynced' status.
+
+    With FEED_MODE='remote' the web process never contends for the lease;
+    the feed is owned by a separate `manage.py run_feed` process.
+    """
+
+    def __init__(self, data_type=DEFAULT_DATA_TYPE):
+        self.data_type = data_type
+        self.fyers_socket = None
+        self.access_token = None
+        self.connected = False
+        self.channel_layer = None
+        self.bridge = None
+        self.recorder = None
+        self.worker_id = WORKER_ID
+        self.alerts_worker = f'{WORKER_ID}:alerts'
+        self.orders_worker = f'{WORKER_ID}:orders'
+        self.clustered = settings.FEED_LEASE_ENABLED or settings.FEED_MODE == 'remote'
+        self.can_own = settings.FEED_MODE != 'remote'
+        self.owner = False
+        self.control_channel = None
+        self.demand = FeedDemand()
+        self._started = False
+        self._loop = None
+        self._lock = None
+        self._tasks = []
+        self._upstream = set()  # symbols subscribed on the Fyers socket
+        self._generation = 0  # bumped per socket; callbacks of older sockets are ignored
+        self._settled = None  # set once the current socket has connected or closed
+        self._opened_at = None
+        self._outage_started = None  # when the feed dropped, until it is resynced
+        self._supervisor = None
+        self.reconnect_attempts = 0
+        self._subscribers = {}  # symbol -> set of channel names
+        self._channels = {}  # channel name -> set of symbols
+
+    @property
+    def started(self):
+        return self._started
+
+    def symbols(self):
+        """Symbols that currently have at least one subscriber"""
+        return list(self._subscribers)
+
+    def subscriber_count(self, symbol):
+        return len(self._subscribers.get(symbol, ()))
+
+    def channel_symbols(self, channel_name):
+        """Symbols a consumer currently holds"""
+        return set(self._channels.get(channel_name, ()))
+
+    async def start(self):
+        """
+        Start the hub once per process, taking over the feed unless another
+        process holds the lease. Returns True when the hub is (or already
+        was) started.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._started:
+                return True
+
+            self._loop = asyncio.get_running_loop()
+            self.channel_layer = get_channel_layer()
+
+            # Followers build candles too, from the ticks they follow
+            candle_aggregator.start()
+
+            self.control_channel = await self.channel_layer.new_channel('feed.')
+            await self.channel_layer.group_add(FEED_CONTROL_GROUP, self.control_channel)
+            if self.clustered:
+                if self.can_own and await self.acquire_lease() and not await self.become_owner():
+                    await sync_to_async(FeedLease.release)(FEED_LEASE_NAME, self.worker_id)
+                    return False
+                self._tasks.append(self._loop.create_task(self.keep_lease()))
+            elif not await self.become_owner():
+                return False
+            self._tasks.append(self._loop.create_task(self.receive_control()))
+
+            self._started = True
+            return True
+
+    async def stop(self):
+        """Stop following the feed and hand the lease over"""
+        if self._lock is None:
+            # Never started
+            return
+        async with self._lock:
+            for task in self._tasks:
+                task.cancel()
+            self._tasks = []
+            self.stop_supervisor()
+            # No more ticks are matched once the stores have been flushed
+            if self.bridge is not None:
+                self.bridge.stop()
+                self.bridge = None
+            owned = self.owner
+            if owned:
+                await self.resign()
+            # Everything the feed produced is written before another hub takes over
+            await self.flush_stores()
+            if owned and self.clustered:
+                await sync_to_async(FeedLease.release)(FEED_LEASE_NAME, self.worker_id)
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
+            self._started = False
+
+    async def flush_stores(self):
+        """Stop the batched writers, writing what they still buffer"""
+        # Order state goes first: a fill the client was told about must not
+        # reload as a working order
+        for store in (order_store, fill_store, tick_ingestor, candle_ingestor, archive_writer):
+            try:
+                await store.stop()
+            except Exception as e:
+                logger.exception(f"Error flushing {type(store).__name__} on stop: {e}")
+
+    async def become_owner(self):
+        """Open the upstream socket; called with the hub lock held"""
+        source, needs_token = FEED_SOURCES[settings.FEED_SOURCE]
+        if needs_token:
+            self.access_token = await FyersTokenService.get_access_token()
+            if not self.access_token:
+                logger.error("Market data hub could not obtain an access token")
+                return False
+
+        if self.bridge is None:
+            self.bridge = TickBridge(
+                self.dispatch_batch,
+                maxsize=settings.FEED_QUEUE_SIZE,
+                policy=settings.FEED_OVERFLOW_POLICY,
+                batch_size=settings.FEED_DRAIN_BATCH_SIZE,
+            )
+            self.bridge.start()
+            if settings.TICK_STORE_ENABLED:
+                tick_ingestor.start()
+            if settings.CANDLE_STORE_ENABLED:
+                candle_ingestor.start()
+            if settings.CANDLE_ARCHIVE_ENABLED:
+                archive_writer.start()
+            order_store.start()
+            fill_store.start()
+            if settings.FEED_RECORD_FILE:
+                self.recorder = TickRecorder(settings.FEED_RECORD_FILE)
+
+        if settings.CANDLE_ARCHIVE_ENABLED:
+            # Another worker may have appended while it held the lease
+            await archive_writer.reopen()
+
+        alert_engine.load(await sync_to_async(active_rules)())
+        alert_engine.symbols_changed = False
+        self.demand.replace(self.alerts_worker, alert_engine.symbols())
+
+        # State changes from an earlier ownership go out before reloading
+        await order_store.flush()
+        paper_exchange.load(await sync_to_async(working_orders)())
+        paper_exchange.symbols_changed = False
+        self.demand.replace(self.orders_worker, paper_exchange.symbols())
+
+        await self.open_socket()
+
+        # Ticks now arrive directly, not through the tick groups, and the
+        # other hubs are asked for their symbols rather than waiting for
+        # their next heartbeat
+        if self.clustered:
+            for symbol in self.symbols():
+                await self.channel_layer.group_discard(key_group(symbol), self.control_channel)
+            await self.channel_layer.group_send(FEED_CONTROL_GROUP, {
+                'type': 'feed.sync',
+                'worker': self.worker_id,
+            })
+
+        self.owner = True
+        candle_aggregator.owner = True
+        logger.info("Market data hub %s owns the Fyers feed", self.worker_id)
+        return True
+
+    async def open_socket(self):
+        """Build and connect a socket from FEED_SOURCE; lock held"""
+        source, _ = FEED_SOURCES[settings.FEED_SOURCE]
+        self._generation += 1
+        generation = self._generation
+        self._settled = asyncio.Event()
+
+        # Callbacks run on the source's thread and hand work back to the loop
+        self.fyers_socket = source(
+            self.access_token,
+            on_connect=functools.partial(self.on_open_sync, generation),
+            on_close=functools.partial(self.on_close_sync, generation),
+            on_error=self.on_error_sync,
+            on_message=self.on_message_sync
+        )
+
+        try:
+            await self.run_in_thread(self.fyers_socket.connect)
+        except Exception:
+            self.fyers_socket = None
+            raise
+
+    async def close_socket(self):
+        """Close the current socket without treating it as an outage; lock held"""
+        self._generation += 1
+        self.connected = False
+        socket, self.fyers_socket = self.fyers_socket, None
+        if socket is not None:
+            try:
+                await self.run_in_thread(socket.close_connection)
+            except Exception as e:
+                logger.warning(f"Error closing the upstream socket: {e}")
+
+    def backoff_delay(self):
+        """Exponential in the attempt number, with the upper half jittered"""
+        delay = min(
+            settings.FEED_RECONNECT_MAX_SECONDS,
+            settings.FEED_RECONNECT_BASE_SECONDS * 2 ** self.reconnect_attempts,
+        )
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def start_supervisor(self):
+        if self._supervisor is None or self._supervisor.done():
+            self._supervisor = self._loop.create_task(self.supervise())
+
+    def stop_supervisor(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+
+    async def supervise(self):
+        """Reconnect the upstream socket until it is back or the feed is given up"""
+        while self.owner and not self.connected:
+            delay = self.backoff_delay()
+            self.reconnect_attempts += 1
+            logger.warning(
+                f"Upstream feed down, reconnect attempt {self.reconnect_attempts} in {delay:.1f}s"
+            )
+            await self.broadcast_status(
+                'reconnecting', 'Reconnecting to the market data feed',
+                attempt=self.reconnect_attempts, delay=round(delay, 2),
+            )
+            await asyncio.sleep(delay)
+
+            async with self._lock:
+                if not self.owner or self.connected:
+                    return
+                try:
+                    await self.close_socket()
+                    _, needs_token = FEED_SOURCES[settings.FEED_SOURCE]
+                    if needs_token:
+                        # The token may have been refreshed during the outage
+                        self.access_token = await FyersTokenService.get_access_token() or self.access_token
+                    await self.open_socket()
+                except Exception as e:
+                    logger.exception(f"Reconnect attempt {self.reconnect_attempts} failed: {e}")
+                    continue
+                settled = self._settled
+
+            try:
+                await asyncio.wait_for(settled.wait(), settings.FEED_CONNECT_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.warning(f"Reconnect attempt {self.reconnect_attempts} timed out")
+
+    async def resync(self, gap_start, gap_end):
+        """Backfill the outage and tell consumers the stream is whole again"""
+        backfilled = {}
+        _, needs_token = FEED_SOURCES[settings.FEED_SOURCE]
+        if needs_token and settings.FEED_BACKFILL_ENABLED:
+            symbols = sorted(key for key in self._upstream if not key.startswith(DEPTH_PREFIX))
+            try:
+                backfilled = await backfill_gap(symbols, gap_start, gap_end)
+            except Exception as e:
+                logger.exception(f"Backfill of the feed gap failed: {e}")
+        await self.broadcast_status(
+            'resynced', 'Market data feed restored',
+            gap_start=gap_start, gap_end=gap_end,
+            symbols=len(self._upstream), backfilled=sum(backfilled.values()),
+        )
+
+    async def resign(self):
+        """Close the upstream socket after losing the lease; lock held"""
+        logger.warning("Market data hub %s is giving up the feed", self.worker_id)
+        self.owner = False
+        candle_aggregator.owner = False
+        self.connected = False
+        self.stop_supervisor()
+        self._outage_started = None
+        self._upstream = set()
+        alert_engine.load([])
+        self.demand.replace(self.alerts_worker, [])
+        paper_exchange.load([])
+        self.demand.replace(self.orders_worker, [])
+        await self.close_socket()
+        last_values.mark_stale()
+        candle_aggregator.release([symbol for symbol in candle_aggregator.symbols() if symbol not in self._subscribers])
+        depth_books.remove([
+            symbol for symbol in depth_books.symbols() if depth_key(symbol) not in self._subscribers
+        ])
+        if self.clustered:
+            for symbol in self.symbols():
+                await self.channel_layer.group_add(key_group(symbol), self.control_channel)
+
+    async def acquire_lease(self):
+        try:
+            return await sync_to_async(FeedLease.acquire)(
+                FEED_LEASE_NAME, self.worker_id, settings.FEED_LEASE_SECONDS
+            )
+        except Exception as e:
+            logger.exception(f"Could not renew the feed lease: {e}")
+            return False
+
+    async def keep_lease(self):
+        """Send heartbeats and renew, take over or give up the lease"""
+        while True:
+            await asyncio.sleep(settings.FEED_HEARTBEAT_SECONDS)
+            try:
+                self.demand.touch(self.worker_id)
+                self.demand.expire(3 * settings.FEED_HEARTBEAT_SECONDS)
+                await self.send_heartbeat()
+                if self.owner:
+                    self.demand.touch(self.alerts_worker)
+                if not self.can_own:
+                    continue
+
+                holds = await self.acquire_lease()
+                async with self._lock:
+                    if holds and not self.owner:
+                        await self.become_owner()
+                    elif not holds and self.owner:
+                        await self.resign()
+                    elif self.owner:
+                        # Drops symbols of workers that went away
+                        await self.reconcile()
+            except Exception as e:
+                logger.exception(f"Feed lease keeper failed: {e}")
+
+    async def send_heartbeat(self):
+        await self.channel_layer.group_send(FEED_CONTROL_GROUP, {
+            'type': 'feed.heartbeat',
+            'worker': self.worker_id,
+            'symbols': self.symbols(),
+        })
+
+    async def receive_control(self):
+        """Handle demand announcements from other hubs and followed ticks"""
+        while True:
+            message = await self.channel_layer.receive(self.control_channel)
+            try:
+                await self.handle_control(message)
+            except Exception as e:
+                logger.exception(f"Error handling feed control message: {e}")
+
+    async def handle_control(self, message):
+        kind = message.get('type')
+        if kind == 'market.tick':
+            tick = message['message']
+            if not self.owner and tick['symbol'] in self._subscribers:
+                last_values.update(tick)
+                portfolio_engine.on_tick(tick)
+                candle_aggregator.on_tick(tick)
+            return
+
+        if kind == 'market.depth':
+            if not self.owner and depth_key(message['symbol']) in self._subscribers:
+                depth_books.replace(message['symbol'], message['book'])
+            return
+
+        if kind == 'alerts.rule':
+            if self.owner:
+                alert_engine.apply(message['rule'])
+                if alert_engine.symbols_changed:
+                    await self.sync_alert_symbols()
+            return
+
+        if kind == 'paper.order':
+            if self.owner:
+                paper_exchange.apply(message)
+                if paper_exchange.symbols_changed:
+                    await self.sync_order_symbols()
+            return
+
+        if message.get('worker') == self.worker_id:
+            return
+        if kind == 'feed.demand':
+            if message['action'] == 'add':
+                self.demand.add(message['worker'], message['symbols'])
+            else:
+                self.demand.remove(message['worker'], message['symbols'])
+        elif kind == 'feed.heartbeat':
+            self.demand.replace(message['worker'], message['symbols'])
+        elif kind == 'feed.sync':
+            await self.send_heartbeat()
+            return
+        else:
+            return
+
+        if self.owner:
+            async with self._lock:
+                await self.reconcile()
+
+    async def sync_alert_symbols(self):
+        """Keep the symbols of active alert rules subscribed upstream"""
+        async with self._lock:
+            alert_engine.symbols_changed = False
+            self.demand.replace(self.alerts_worker, alert_engine.symbols())
+            await self.reconcile()
+
+    async def sync_order_symbols(self):
+        """Keep the symbols of working paper orders subscribed upstream"""
+        async with self._lock:
+            paper_exchange.symbols_changed = False
+            self.demand.replace(self.orders_worker, paper_exchange.symbols())
+            await self.reconcile()
+
+    async def demand_changed(self, action, symbols):
+        """Publish this process's subscription transitions; lock held"""
+        if action == 'add':
+            self.demand.add(self.worker_id, symbols)
+        else:
+            self.demand.remove(self.worker_id, symbols)
+
+        if self.clustered:
+            await self.channel_layer.group_send(FEED_CONTROL_GROUP, {
+                'type': 'feed.demand',
+                'worker': self.worker_id,
+                'action': action,
+                'symbols': symbols,
+            })
+            if not self.owner:
+                for symbol in symbols:
+                    if action == 'add':
+                        await self.channel_layer.group_add(key_group(symbol), self.control_channel)
+                    else:
+                        await self.channel_layer.group_discard(key_group(symbol), self.control_channel)
+
+        if self.owner:
+            await self.reconcile()
+
+    async def reconcile(self):
+        """Bring the upstream subscriptions in line with the demand; lock held"""
+        if not self.connected:
+            return
+        wanted = self.demand.symbols()
+        size = settings.FEED_SUBSCRIBE_BATCH_SIZE
+        for action, keys in (('subscribe', wanted - self._upstream), ('unsubscribe', self._upstream - wanted)):
+            # Fyers takes one data type per call
+            by_type = {}
+            for key in keys:
+                symbol, data_type = split_key(key)
+                by_type.setdefault(data_type, []).append(symbol)
+            for data_type, symbols in by_type.items():
+                upstream_type = self.data_type if data_type == DEFAULT_DATA_TYPE else data_type
+                if data_type == DEPTH_DATA_TYPE:
+                    # Books exist before the first update can arrive
+                    if action == 'subscribe':
+                        depth_books.track(symbols)
+                    else:
+                        depth_books.remove(symbols)
+                elif action == 'unsubscribe':
+                    candle_aggregator.release(symbols)
+                for i in range(0, len(symbols), size):
+                    await self.run_in_thread(
+                        getattr(self.fyers_socket, action), symbols=symbols[i:i + size], data_type=upstream_type
+                    )
+        self._upstream = wanted
+
+    async def run_in_thread(self, func, *args, **kwargs):
+        """Run blocking Fyers calls in the default executor"""
+        return await self._loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def add_channel(self, channel_name):
+        await self.channel_layer.group_add(STATUS_GROUP, channel_name)
+        self._channels.setdefault(channel_name, set())
+
+    async def remove_channel(self, channel_name):
+        """Drop every subscription held by a consumer that went away"""
+        symbols = self._channels.get(channel_name, set())
+        if symbols:
+            await self.unsubscribe(channel_name, list(symbols))
+        self._channels.pop(channel_name, None)
+        await self.channel_layer.group_discard(STATUS_GROUP, channel_name)
+
+    async def subscribe(self, channel_name, symbols, tick_group=True):
+        """
+        Add a consumer to the given symbols.
+        With tick_group=False the consumer keeps the symbols flowing upstream
+        without receiving their ticks (e.g. it only wants derived candles).
+        Returns the symbols that had no subscriber before this call.
+        """
+        added = []
+        async with self._lock:
+            owned = self._channels.setdefault(channel_name, set())
+            for symbol in symbols:
+                channels = self._subscribers.setdefault(symbol, set())
+                if channel_name in channels:
+                    # May have been held without ticks until now
+                    if tick_group:
+                        await self.channel_layer.group_add(key_group(symbol), channel_name)
+                    continue
+                if not channels:
+                    added.append(symbol)
+                channels.add(channel_name)
+                owned.add(symbol)
+                if tick_group:
+                    await self.channel_layer.group_add(key_group(symbol), channel_name)
+
+            if added:
+                await self.demand_changed('add', added)
+        return added
+
+    async def unsubscribe(self, channel_name, symbols):
+        """
+        Remove a consumer from the given symbols.
+        Returns the symbols that no longer have any subscriber.
+        """
+        removed = []
+        async with self._lock:
+            owned = self._channels.get(channel_name, set())
+            for symbol in symbols:
+                channels = self._subscribers.get(symbol)
+                if not channels or channel_name not in channels:
+                    continue
+                channels.discard(channel_name)
+                owned.discard(symbol)
+                await self.channel_layer.group_discard(key_group(symbol), channel_name)
+                if not channels:
+                    del self._subscribers[symbol]
+                    removed.append(symbol)
+
+            if removed:
+                plain = [key for key in removed if not key.startswith(DEPTH_PREFIX)]
+                last_values.remove(plain)
+                if not self.owner:
+                    candle_aggregator.release(plain)
+                await self.demand_changed('remove', removed)
+                # The owner keeps books other processes still want
+                wanted = self.demand.symbols() if self.owner else set()
+                depth_books.remove(
+                    split_key(key)[0] for key in removed if key.startswith(DEPTH_PREFIX) and key not in wanted
+                )
+        return removed
+
+    # Synchronous callbacks, called from the Fyers thread
+    def on_message_sync(self, message):
+        symbol = message.get('symbol') if isinstance(message, dict) else None
+        if not symbol:
+            # Auth / subscription acknowledgements carry no symbol
+            logger.debug("Fyers control message: %s", message)
+            return
+        if self.recorder is not None:
+            self.recorder.write(message)
+        # Stamped here so consumers can measure callback-to-send latency
+        self.bridge.put((time.time(), message))
+
+    def on_error_sync(self, error):
+        logger.warning("Error from Fyers: %s", error)
+        asyncio.run_coroutine_threadsafe(
+            self.broadcast_status('error', str(error)), self._loop
+        )
+
+    def on_close_sync(self, generation, message=None):
+        logger.info("Fyers WebSocket connection closed: %s", message)
+        asyncio.run_coroutine_threadsafe(self.on_close_async(generation), self._loop)
+
+    def on_open_sync(self, generation):
+        logger.info("Fyers WebSocket connection opened")
+        asyncio.run_coroutine_threadsafe(self.on_open_async(generation), self._loop)
+
+    async def on_open_async(self, generation):
+        if generation != self._generation:
+            return
+        self.connected = True
+        self._opened_at = time.time()
+        # Restore everything consumers asked for while we were not connected
+        async with self._lock:
+            self._upstream = set()
+            await self.reconcile()
+        self._settled.set()
+
+        gap_start, self._outage_started = self._outage_started, None
+        if gap_start is None:
+            await self.broadcast_status('connected', 'Fyers WebSocket connection opened')
+        else:
+            logger.info(f"Upstream feed restored after {time.time() - gap_start:.1f}s")
+            await self.resync(gap_start, time.time())
+
+    async def on_close_async(self, generation):
+        if generation != self._generation:
+            # A socket the hub closed itself
+            return
+        self.connected = False
+        self._settled.set()
+        # Cached quotes can no longer be trusted to be current
+        last_values.mark_stale()
+
+        socket = self.fyers_socket
+        if not self.owner or getattr(socket, 'finished', False):
+            await self.broadcast_status('closed', 'Fyers WebSocket connection closed')
+            return
+
+        if self._opened_at is not None and time.time() - self._opened_at >= settings.FEED_RECONNECT_STABLE_SECONDS:
+            self.reconnect_attempts = 0
+        if self._outage_started is None:
+            self._outage_started = time.time()
+        self.start_supervisor()
+
+    async def dispatch_batch(self, batch):
+        """Bridge handler; batch holds (received at, message) pairs"""
+        started = time.perf_counter()
+        for received, message in batch:
+            await self.dispatch(message['symbol'], message, received)
+        alert_engine.flush()
+        if alert_engine.symbols_changed:
+            asyncio.ensure_future(self.sync_alert_symbols())
+        if paper_exchange.symbols_changed:
+            asyncio.ensure_future(self.sync_order_symbols())
+        feed_batch_size.observe(len(batch))
+        feed_dispatch_seconds.observe(time.perf_counter() - started)
+
+    async def dispatch(self, symbol, message, received=None):
+        if message.get('type') == 'dp':
+            await self.dispatch_depth(symbol, message, received)
+            return
+        if symbol in self._subscribers:
+            last_values.update(message)
+            portfolio_engine.on_tick(message)
+        candle_aggregator.on_tick(message)
+        alert_engine.on_tick(message)
+        paper_exchange.on_tick(message)
+        if settings.TICK_STORE_ENABLED:
+            tick_ingestor.add(message)
+        await self.channel_layer.group_send(symbol_group(symbol), {
+            'type': 'market.tick',
+            'message': message,
+            'received': received,
+        })
+
+    async def dispatch_depth(self, symbol, message, received=None):
+        """Apply a DepthUpdate and fan out the levels it changed"""
+        changed = depth_books.update(message)
+        if not changed:
+            return
+        await self.channel_layer.group_send(depth_group(symbol), {
+            'type': 'market.depth',
+            'symbol': symbol,
+            'book': depth_books.get(symbol).tolist(),
+            'changed': changed,
+            'received': received,
+        })
+
+    async def broadcast_status(self, status, message, **details):
+        await self.channel_layer.group_send(STATUS_GROUP, {
+            'type': 'market.status',
+            'status': status,
+            'message': message,
+            'details': details,
+        })
+
+
+market_data_hub = MarketDataHub()
+
+
+def bridge_stat(name):
+    bridge = market_data_hub.bridge
+    return bridge.stats()[name] if bridge is not None else None
+
+
+registry.collect('vtrade_feed_ticks_total', 'Ticks received from the upstream feed', 'counter',
+                 lambda: bridge_stat('enqueued'))
+registry.collect('vtrade_feed_ticks_dropped_total', 'Ticks dropped because the feed queue was full', 'counter',
+                 lambda: bridge_stat('dropped'))
+registry.collect('vtrade_feed_queue_depth', 'Ticks waiting in the feed queue', 'gauge',
+                 lambda: bridge_stat('depth'))
+registry.collect('vtrade_feed_queue_high_water', 'Deepest the feed queue has been', 'gauge',
+                 lambda: bridge_stat('high_water'))
+registry.collect('vtrade_feed_connected', 'Whether this process holds a connected upstream feed', 'gauge',
+                 lambda: int(market_data_hub.owner and market_data_hub.connected))
+registry.collect('vtrade_feed_symbols', 'Symbols with subscribers in this process', 'gauge',
+                 lambda: len(market_data_hub.symbols()))
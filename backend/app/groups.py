@@ -0,0 +1,57 @@
+import re
+from .cluster import PROCESS_TAG
+
+# Every stock consumer joins this group to hear about the upstream connection state
+STATUS_GROUP = 'market.status'
+
+_GROUP_UNSAFE = re.compile(r'[^a-zA-Z0-9\-_]')
+
+
+def escape_symbol(symbol):
+    """
+    Make a symbol usable inside a Channels group name.
+
+    Group names may only contain ASCII alphanumerics, hyphens, underscores
+    and periods, so every other character is escaped as '.<hex>'.
+    """
+    return _GROUP_UNSAFE.sub(lambda m: '.%x' % ord(m.group()), symbol)
+
+
+def symbol_group(symbol):
+    """Group carrying live ticks for one symbol"""
+    return 'ticks.' + escape_symbol(symbol)
+
+
+def depth_group(symbol):
+    """Group carrying market depth changes for one symbol"""
+    return 'depth.' + escape_symbol(symbol)
+
+
+def candle_group(symbol, timeframe):
+    """Group carrying closed candles for one symbol and timeframe"""
+    return f'candles.{timeframe}.' + escape_symbol(symbol)
+
+
+def indicator_group(symbol, timeframe, name, params):
+    """
+    Group carrying live values of one indicator, keyed by its parameters.
+    Every process computes the live indicators of its own connections, so
+    the group is local to this process.
+    """
+    suffix = '-'.join(str(value).replace('.', '_') for _, value in params)
+    return f'ind.{PROCESS_TAG}.{timeframe}.{name}.{suffix}.' + escape_symbol(symbol)
+
+
+# Every market data hub joins this group to share which symbols its
+# consumers want, so the feed owner can subscribe to them upstream
+FEED_CONTROL_GROUP = 'feed.control'
+
+
+def user_group(user_id):
+    """Group reaching every open stock stream of one user"""
+    return f'user.{user_id}'
+
+
+def portfolio_group(portfolio_id):
+    """Group reaching every open portfolio stream of one portfolio"""
+    return f'portfolio.{portfolio_id}'
@@ -0,0 +1,418 @@
+"""
+Technical indicators over candles.
+
+Every indicator has two implementations that produce the same numbers:
+a batch function that computes it with NumPy over whole candle arrays (for
+history and REST), and an incremental class that updates it in O(1) per
+closed candle (for live streams). EMA-based indicators are seeded with the
+simple average of their first `period` values, TA-Lib style; values before
+an indicator has enough data are NaN in batch and None incrementally.
+"""
+import asyncio
+import collections
+import logging
+import math
+import numpy as np
+from channels.layers import get_channel_layer
+from .archive import candle_archive, CANDLE_DTYPE
+from .candles import candle_aggregator, TIMEFRAME_SECONDS
+from .groups import indicator_group
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# VWAP resets at the start of each trading day, in IST
+SESSION_OFFSET_SECONDS = 19800
+
+# Live indicators warm up from this many multiples of their periods; by then
+# an EMA's seed has decayed far below rounding, (1 - 1/period) ** (20 * period)
+# being under 1e-8 for any period
+WARMUP_PERIODS = 20
+
+
+def _ema(values, alpha, seed_period):
+    """
+    Exponential moving average seeded with the mean of the first seed_period
+    values. The recursion is evaluated in closed form over blocks short
+    enough that the (1 - alpha) ** -k scaling stays well inside float range.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) < seed_period:
+        return out
+
+    out[seed_period - 1] = values[:seed_period].mean()
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        out[seed_period:] = values[seed_period:]
+        return out
+
+    block = max(1, int(8 * math.log(10) / -math.log(decay)))
+    powers = decay ** np.arange(block + 1)
+    inverse = 1.0 / powers[:block]
+    prev = out[seed_period - 1]
+    i = seed_period
+    while i < len(values):
+        chunk = values[i:i + block]
+        n = len(chunk)
+        acc = np.cumsum(chunk * inverse[:n]) * alpha
+        out[i:i + n] = powers[:n] * acc + powers[1:n + 1] * prev
+        prev = out[i + n - 1]
+        i += n
+    return out
+
+
+def _rolling_sum(values, period):
+    cumsum = np.concatenate(([0.0], np.cumsum(values)))
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        out[period - 1:] = cumsum[period:] - cumsum[:-period]
+    return out
+
+
+def sma(candles, period=20):
+    close = candles['c']
+    return {'sma': _rolling_sum(close, period) / period}
+
+
+def ema(candles, period=20):
+    return {'ema': _ema(candles['c'], 2.0 / (period + 1), period)}
+
+
+def rsi(candles, period=14):
+    close = np.asarray(candles['c'], dtype=np.float64)
+    out = np.full(len(close), np.nan)
+    if len(close) <= period:
+        return {'rsi': out}
+
+    change = np.diff(close)
+    gain = _ema(np.clip(change, 0, None), 1.0 / period, period)
+    loss = _ema(np.clip(-change, 0, None), 1.0 / period, period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = np.where(loss == 0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+    out[1:] = np.where(np.isnan(gain), np.nan, value)
+    return {'rsi': out}
+
+
+def macd(candles, fast=12, slow=26, signal=9):
+    close = candles['c']
+    line = _ema(close, 2.0 / (fast + 1), fast) - _ema(close, 2.0 / (slow + 1), slow)
+    signal_line = np.full(len(close), np.nan)
+    valid = np.flatnonzero(~np.isnan(line))
+    if len(valid):
+        signal_line[valid[0]:] = _ema(line[valid[0]:], 2.0 / (signal + 1), signal)
+    return {'macd': line, 'signal': signal_line, 'histogram': line - signal_line}
+
+
+def bollinger(candles, period=20, k=2.0):
+    close = np.asarray(candles['c'], dtype=np.float64)
+    mean = _rolling_sum(close, period) / period
+    mean_sq = _rolling_sum(close * close, period) / period
+    std = np.sqrt(np.maximum(mean_sq - mean * mean, 0.0))
+    return {'middle': mean, 'upper': mean + k * std, 'lower': mean - k * std}
+
+
+def vwap(candles):
+    typical = (candles['h'] + candles['l'] + candles['c']) / 3.0
+    volume = np.asarray(candles['v'], dtype=np.float64)
+    session = (candles['t'] + SESSION_OFFSET_SECONDS) // 86400
+    starts = np.concatenate(([True], session[1:] != session[:-1]))
+
+    # Cumulative sums restarted at every session boundary
+    def session_cumsum(values):
+        total = np.cumsum(values)
+        offsets = np.where(starts, total - values, 0.0)
+        return total - np.maximum.accumulate(np.where(starts, offsets, -np.inf))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = session_cumsum(typical * volume) / session_cumsum(volume)
+    return {'vwap': out}
+
+
+class IncrementalEMA:
+    def __init__(self, alpha, seed_period):
+        self.alpha = alpha
+        self.seed_period = seed_period
+        self._count = 0
+        self._seed = 0.0
+        self.value = None
+
+    def update(self, x):
+        if self.value is None:
+            self._count += 1
+            self._seed += x
+            if self._count == self.seed_period:
+                self.value = self._seed / self.seed_period
+            return self.value
+        self.value += self.alpha * (x - self.value)
+        return self.value
+
+
+class SMAIndicator:
+    def __init__(self, period=20):
+        self.period = period
+        self._window = collections.deque()
+        self._sum = 0.0
+
+    def update(self, candle):
+        close = candle[4]
+        self._window.append(close)
+        self._sum += close
+        if len(self._window) > self.period:
+            self._sum -= self._window.popleft()
+        return {'sma': self._sum / self.period if len(self._window) == self.period else None}
+
+
+class EMAIndicator:
+    def __init__(self, period=20):
+        self._ema = IncrementalEMA(2.0 / (period + 1), period)
+
+    def update(self, candle):
+        return {'ema': self._ema.update(candle[4])}
+
+
+class RSIIndicator:
+    def __init__(self, period=14):
+        self._prev = None
+        self._gain = IncrementalEMA(1.0 / period, period)
+        self._loss = IncrementalEMA(1.0 / period, period)
+
+    def update(self, candle):
+        close = candle[4]
+        if self._prev is None:
+            self._prev = close
+            return {'rsi': None}
+        change = close - self._prev
+        self._prev = close
+        gain = self._gain.update(max(change, 0.0))
+        loss = self._loss.update(max(-change, 0.0))
+        if gain is None:
+            return {'rsi': None}
+        if loss == 0:
+            return {'rsi': 100.0}
+        return {'rsi': 100.0 - 100.0 / (1.0 + gain / loss)}
+
+
+class MACDIndicator:
+    def __init__(self, fast=12, slow=26, signal=9):
+        self._fast = IncrementalEMA(2.0 / (fast + 1), fast)
+        self._slow = IncrementalEMA(2.0 / (slow + 1), slow)
+        self._signal = IncrementalEMA(2.0 / (signal + 1), signal)
+
+    def update(self, candle):
+        fast = self._fast.update(candle[4])
+        slow = self._slow.update(candle[4])
+        if fast is None or slow is None:
+            return {'macd': None, 'signal': None, 'histogram': None}
+        line = fast - slow
+        signal = self._signal.update(line)
+        return {
+            'macd': line,
+            'signal': signal,
+            'histogram': line - signal if signal is not None else None,
+        }
+
+
+class BollingerIndicator:
+    def __init__(self, period=20, k=2.0):
+        self.period = period
+        self.k = k
+        self._window = collections.deque()
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def update(self, candle):
+        close = candle[4]
+        self._window.append(close)
+        self._sum += close
+        self._sum_sq += close * close
+        if len(self._window) > self.period:
+            old = self._window.popleft()
+            self._sum -= old
+            self._sum_sq -= old * old
+        if len(self._window) < self.period:
+            return {'middle': None, 'upper': None, 'lower': None}
+        mean = self._sum / self.period
+        std = math.sqrt(max(self._sum_sq / self.period - mean * mean, 0.0))
+        return {'middle': mean, 'upper': mean + self.k * std, 'lower': mean - self.k * std}
+
+
+class VWAPIndicator:
+    def __init__(self):
+        self._session = None
+        self._pv = 0.0
+        self._volume = 0.0
+
+    def update(self, candle):
+        start, _, high, low, close, volume = candle
+        session = (int(start) + SESSION_OFFSET_SECONDS) // 86400
+        if session != self._session:
+            self._session = session
+            self._pv = 0.0
+            self._volume = 0.0
+        self._pv += (high + low + close) / 3.0 * volume
+        self._volume += volume
+        return {'vwap': self._pv / self._volume if self._volume else None}
+
+
+# name -> (batch function, incremental class, default parameters)
+INDICATORS = {
+    'sma': (sma, SMAIndicator, {'period': 20}),
+    'ema': (ema, EMAIndicator, {'period': 20}),
+    'rsi': (rsi, RSIIndicator, {'period': 14}),
+    'macd': (macd, MACDIndicator, {'fast': 12, 'slow': 26, 'signal': 9}),
+    'bollinger': (bollinger, BollingerIndicator, {'period': 20, 'k': 2.0}),
+    'vwap': (vwap, VWAPIndicator, {}),
+}
+
+
+def parse_params(name, raw):
+    """
+    Validate indicator parameters against the defaults, casting each to the
+    default's type. Returns a tuple of (name, value) pairs in a fixed order.
+    """
+    if name not in INDICATORS:
+        raise ValueError(f"Unknown indicator '{name}'")
+    defaults = INDICATORS[name][2]
+    params = []
+    for key, default in defaults.items():
+        value = raw.get(key, default)
+        try:
+            value = type(default)(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for {key}: {value}")
+        if value <= 0:
+            raise ValueError(f"{key} must be positive")
+        params.append((key, value))
+    return tuple(params)
+
+
+def warmup_candles(name, params, timeframe):
+    """
+    Number of trailing candles a live indicator needs to match the batch
+    result over all history
+    """
+    if name == 'vwap':
+        # Enough for a whole session even with no gaps
+        return 86400 // TIMEFRAME_SECONDS[timeframe] + 1
+    return WARMUP_PERIODS * sum(value for _, value in params if isinstance(value, int))
+
+
+def load_candles(symbol, timeframe, limit=None):
+    """
+    Archived candles followed by the aggregator's in-memory ones that are
+    newer than the archive, as a CANDLE_DTYPE array. With a limit only the
+    last `limit` candles are loaded.
+    """
+    archived = candle_archive.range(symbol, timeframe)
+    last = archived['t'][-1] if len(archived) else None
+    recent = [
+        candle for candle in candle_aggregator.recent(symbol, timeframe)
+        if last is None or candle[0] > last
+    ]
+    if limit is not None:
+        recent = recent[-limit:]
+        archived = archived[max(len(archived) - (limit - len(recent)), 0):]
+    if not recent:
+        return archived
+    recent = np.array([(int(c[0]),) + tuple(c[1:]) for c in recent], dtype=CANDLE_DTYPE)
+    return np.concatenate((archived, recent)) if len(archived) else recent
+
+
+class IndicatorEngine:
+    """
+    Computes indicators in batch for REST and keeps live indicators up to date.
+
+    Batch results are cached by (symbol, timeframe, indicator, params) and
+    reused until a newer candle arrives. Live indicators are created on the
+    first websocket subscription, warmed up from history, then updated in
+    O(1) from every closed candle and pushed to their Channels group.
+    """
+
+    def __init__(self, cache_size=1000):
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()  # key -> (last candle start, times, values)
+        self._live = {}  # (symbol, timeframe) -> {(name, params): [indicator, subscribers, latest values]}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def compute(self, symbol, timeframe, name, params):
+        """
+        Returns (times, {output: array}) over all known candles
+        """
+        candles = load_candles(symbol, timeframe)
+        last = int(candles['t'][-1]) if len(candles) else None
+        key = (symbol, timeframe, name, params)
+
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == last:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached[1], cached[2]
+        self.cache_misses += 1
+
+        values = INDICATORS[name][0](candles, **dict(params)) if len(candles) else {}
+        times = candles['t']
+        self._cache[key] = (last, times, values)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return times, values
+
+    def subscribe(self, symbol, timeframe, name, params):
+        """Start (or share) a live indicator; returns its latest values"""
+        live = self._live.setdefault((symbol, timeframe), {})
+        entry = live.get((name, params))
+        if entry is None:
+            indicator = INDICATORS[name][1](**dict(params))
+            latest = None
+            limit = warmup_candles(name, params, timeframe)
+            for candle in load_candles(symbol, timeframe, limit=limit).tolist():
+                latest = indicator.update(candle)
+            entry = live[(name, params)] = [indicator, 0, latest]
+        entry[1] += 1
+        return entry[2]
+
+    def latest(self, symbol, timeframe, name, params):
+        entry = self._live.get((symbol, timeframe), {}).get((name, params))
+        return entry[2] if entry is not None else None
+
+    def unsubscribe(self, symbol, timeframe, name, params):
+        live = self._live.get((symbol, timeframe), {})
+        entry = live.get((name, params))
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del live[(name, params)]
+            if not live:
+                self._live.pop((symbol, timeframe), None)
+
+    def on_candle(self, symbol, timeframe, candle):
+        """Candle aggregator listener"""
+        live = self._live.get((symbol, timeframe))
+        if not live:
+            return
+        channel_layer = get_channel_layer()
+        for (name, params), entry in live.items():
+            values = entry[0].update(candle)
+            entry[2] = values
+            asyncio.ensure_future(channel_layer.group_send(
+                indicator_group(symbol, timeframe, name, params), {
+                    'type': 'indicator.update',
+                    'symbol': symbol,
+                    'timeframe': timeframe,
+                    'indicator': name,
+                    'params': dict(params),
+                    't': int(candle[0]),
+                    'values': values,
+                }
+            ))
+
+
+indicator_engine = IndicatorEngine()
+candle_aggregator.listeners.append(indicator_engine.on_candle)
+registry.collect('vtrade_indicator_cache_hits_total', 'Batch indicator requests served from the cache', 'counter',
+                 lambda: indicator_engine.cache_hits)
+registry.collect('vtrade_indicator_cache_misses_total', 'Batch indicator requests computed', 'counter',
+                 lambda: indicator_engine.cache_misses)
@@ -0,0 +1,208 @@
+import asyncio
+import datetime
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connection
+from .models import Tick, Candle
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(epoch_seconds):
+    return datetime.datetime.fromtimestamp(epoch_seconds, tz=datetime.timezone.utc)
+
+
+class BulkIngestor:
+    """
+    Buffers rows in memory and writes them to Postgres in bulk.
+
+    Rows are appended to an in-memory buffer as tuples in `columns` order
+    and flushed when the buffer reaches batch_size rows or every
+    flush_interval seconds, whichever comes first. Writes use COPY on
+    Postgres and bulk_create elsewhere, and run on a dedicated single-thread
+    executor so the event loop never blocks on the database and the writer
+    keeps one connection. If the database falls behind and the buffer
+    reaches max_buffer rows, the oldest rows are dropped and counted.
+
+    Owners await stop() on shutdown, which writes whatever is still
+    buffered.
+    """
+
+    model = None
+    columns = ()
+
+    def __init__(self, batch_size=5000, flush_interval=1.0, max_buffer=200000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f'{self.model._meta.model_name}-ingest'
+        )
+        self._flush_lock = None
+        self._flush_task = None
+        self._timer_task = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def start(self):
+        """Start the periodic flush on the running loop"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        self._timer_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the periodic flush and write whatever is still buffered"""
+        if self._timer_task:
+            self._timer_task.cancel()
+            self._timer_task = None
+        await self.flush()
+
+    def add_row(self, row):
+        """Buffer one row; called on the event loop"""
+        self._buffer.append(row)
+
+        if len(self._buffer) > self.max_buffer:
+            excess = len(self._buffer) - self.max_buffer
+            del self._buffer[:excess]
+            self.dropped += excess
+
+        if len(self._buffer) >= self.batch_size and self._timer_task is not None:
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write everything buffered so far; one write runs at a time"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            while self._buffer:
+                rows = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                loop = asyncio.get_running_loop()
+                try:
+                    await loop.run_in_executor(self._executor, self._write_batch, rows)
+                except Exception as e:
+                    self.failed += len(rows)
+                    logger.exception(f"Error writing {len(rows)} {self.model.__name__} rows: {e}")
+
+    def _write_batch(self, rows):
+        # Runs on the writer thread; replaces a connection the database dropped
+        close_old_connections()
+        self._write(rows)
+
+    def _write(self, rows):
+        if connection.vendor == 'postgresql':
+            self._copy(rows)
+        else:
+            self.model.objects.bulk_create(
+                [self.model(**dict(zip(self.columns, row))) for row in rows],
+                batch_size=self.batch_size,
+            )
+        self.written += len(rows)
+
+    def _copy(self, rows):
+        sql = 'COPY {} ({}) FROM STDIN'.format(self.model._meta.db_table, ', '.join(self.columns))
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy'):
+                # psycopg 3
+                with raw.copy(sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            else:
+                # psycopg2
+                buffer = io.StringIO()
+                for row in rows:
+                    buffer.write('\t'.join(
+                        r'\N' if value is None else (
+                            value.isoformat() if isinstance(value, datetime.datetime) else str(value)
+                        )
+                        for value in row
+                    ))
+                    buffer.write('\n')
+                buffer.seek(0)
+                raw.copy_expert(sql, buffer)
+
+    def stats(self):
+        return {
+            'buffered': len(self._buffer),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+class TickIngestor(BulkIngestor):
+    """
+    Writes ticks from the live feed to the market_tick table
+    """
+
+    model = Tick
+    columns = (
+        'symbol', 'ltp', 'volume', 'last_traded_qty',
+        'bid_price', 'ask_price', 'exchange_time', 'received_at',
+    )
+
+    def add(self, message):
+        ltp = message.get('ltp')
+        feed_time = message.get('exch_feed_time') or message.get('last_traded_time')
+        if ltp is None or not feed_time:
+            return
+
+        self.add_row((
+            message['symbol'],
+            ltp,
+            message.get('vol_traded_today'),
+            message.get('last_traded_qty'),
+            message.get('bid_price'),
+            message.get('ask_price'),
+            _timestamp(feed_time),
+            datetime.datetime.now(tz=datetime.timezone.utc),
+        ))
+
+
+class CandleIngestor(BulkIngestor):
+    """
+    Writes closed candles from the candle aggregator to the market_candle table
+    """
+
+    model = Candle
+    columns = ('symbol', 'timeframe', 'start', 'open', 'high', 'low', 'close', 'volume')
+
+    def add(self, symbol, timeframe, candle):
+        start, open_, high, low, close, volume = candle
+        self.add_row((symbol, timeframe, _timestamp(start), open_, high, low, close, int(volume)))
+
+
+tick_ingestor = TickIngestor(
+    batch_size=settings.TICK_STORE_BATCH_SIZE,
+    flush_interval=settings.TICK_STORE_FLUSH_INTERVAL,
+    max_buffer=settings.TICK_STORE_MAX_BUFFER,
+)
+
+candle_ingestor = CandleIngestor(
+    batch_size=settings.CANDLE_STORE_BATCH_SIZE,
+    flush_interval=settings.CANDLE_STORE_FLUSH_INTERVAL,
+)
+
+for _name, _ingestor in (('tick', tick_ingestor), ('candle', candle_ingestor)):
+    registry.collect(f'vtrade_{_name}_store_rows_total', f'{_name.capitalize()} rows by outcome', 'counter',
+                     lambda ingestor=_ingestor: {
+                         (outcome,): ingestor.stats()[outcome] for outcome in ('written', 'dropped', 'failed')
+                     }, labelnames=('outcome',))
+    registry.collect(f'vtrade_{_name}_store_buffered', f'{_name.capitalize()} rows waiting to be written', 'gauge',
+                     lambda ingestor=_ingestor: ingestor.stats()['buffered'])
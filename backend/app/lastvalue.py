@@ -0,0 +1,165 @@
+import json
+import time
+from .metrics import registry
+
+# SymbolUpdate tick fields and the quotes API fields they correspond to
+TICK_TO_QUOTE_FIELDS = {
+    'ltp': 'lp',
+    'ch': 'ch',
+    'chp': 'chp',
+    'ask_price': 'ask',
+    'bid_price': 'bid',
+    'open_price': 'open_price',
+    'high_price': 'high_price',
+    'low_price': 'low_price',
+    'prev_close_price': 'prev_close_price',
+    'avg_trade_price': 'atp',
+    'vol_traded_today': 'volume',
+    'last_traded_time': 'tt',
+}
+
+
+class LastValue:
+    """
+    Latest tick of one symbol, plus views of it derived on first use.
+
+    The tick dict is the one the feed delivered, stored by reference. Its
+    JSON text and its quotes-API form are built at most once per tick and
+    dropped when the next tick arrives.
+    """
+    __slots__ = ('sid', 'symbol', 'tick', 'version', 'live', 'received_at', '_json', '_quote', '_quote_json')
+
+    def __init__(self, sid, symbol):
+        self.sid = sid
+        self.symbol = symbol
+        self.tick = None
+        self.version = 0
+        self.live = False
+        self.received_at = 0.0
+        self._json = None
+        self._quote = None
+        self._quote_json = None
+
+    def json(self):
+        if self._json is None:
+            self._json = json.dumps(self.tick)
+        return self._json
+
+    def quote(self):
+        """The tick as an item of a quotes response 'd' array"""
+        if self._quote is None:
+            tick = self.tick
+            values = {'symbol': self.symbol}
+            for tick_field, quote_field in TICK_TO_QUOTE_FIELDS.items():
+                if tick_field in tick:
+                    values[quote_field] = tick[tick_field]
+            if 'ask' in values and 'bid' in values:
+                values['spread'] = round(values['ask'] - values['bid'], 4)
+            self._quote = {'n': self.symbol, 's': 'ok', 'v': values}
+        return self._quote
+
+    def quote_json(self):
+        if self._quote_json is None:
+            self._quote_json = json.dumps(self.quote())
+        return self._quote_json
+
+
+class LastValueTable:
+    """
+    Process-wide latest tick per symbol, fed by the market data hub.
+
+    Symbols get a small integer id on first sight and their LastValue
+    record lives at that index, so the per-tick update is one dict lookup
+    and a few attribute stores. Readers (REST quotes, websocket snapshots,
+    alerts) share the records and their cached serializations instead of
+    copying ticks around.
+    """
+
+    def __init__(self):
+        self._ids = {}  # symbol -> id
+        self._records = []  # id -> LastValue, or None once removed
+        self._free = []  # ids available for reuse
+
+    def __len__(self):
+        return len(self._ids)
+
+    def sid(self, symbol):
+        return self._ids.get(symbol)
+
+    def get(self, symbol):
+        sid = self._ids.get(symbol)
+        return self._records[sid] if sid is not None else None
+
+    def record(self, sid):
+        return self._records[sid]
+
+    def update(self, message):
+        symbol = message['symbol']
+        sid = self._ids.get(symbol)
+        if sid is None:
+            if self._free:
+                sid = self._free.pop()
+                self._records[sid] = LastValue(sid, symbol)
+            else:
+                sid = len(self._records)
+                self._records.append(LastValue(sid, symbol))
+            self._ids[symbol] = sid
+
+        record = self._records[sid]
+        record.tick = message
+        record.version += 1
+        record.live = True
+        record.received_at = time.time()
+        record._json = record._quote = record._quote_json = None
+        return record
+
+    def mark_stale(self, symbols=None):
+        """The feed stopped covering these symbols (or every symbol)"""
+        targets = self._ids if symbols is None else symbols
+        for symbol in targets:
+            record = self.get(symbol)
+            if record is not None:
+                record.live = False
+
+    def remove(self, symbols):
+        for symbol in symbols:
+            sid = self._ids.pop(symbol, None)
+            if sid is not None:
+                self._records[sid] = None
+                self._free.append(sid)
+
+    def snapshot(self, symbols):
+        """Latest tick of each symbol that has one"""
+        records = [self.get(symbol) for symbol in symbols]
+        return [record.tick for record in records if record is not None]
+
+    def snapshot_json(self, symbols):
+        """snapshot() as a JSON array, built from the cached per-tick JSON"""
+        records = [self.get(symbol) for symbol in symbols]
+        return '[' + ','.join(record.json() for record in records if record is not None) + ']'
+
+    def dumps_quotes(self, entries):
+        """
+        JSON array of quote entries, reusing the cached text of entries
+        that came straight from this table
+        """
+        parts = []
+        for entry in entries:
+            record = self.get(entry.get('n'))
+            if record is not None and record._quote is entry:
+                parts.append(record.quote_json())
+            else:
+                parts.append(json.dumps(entry))
+        return '[' + ','.join(parts) + ']'
+
+    def stats(self):
+        live = sum(1 for record in self._records if record is not None and record.live)
+        return {'symbols': len(self._ids), 'live': live}
+
+
+last_values = LastValueTable()
+registry.collect('vtrade_last_values', 'Symbols in the last-value table, by whether the feed covers them',
+                 'gauge', lambda: {
+                     ('true',): last_values.stats()['live'],
+                     ('false',): len(last_values) - last_values.stats()['live'],
+                 }, labelnames=('live',))
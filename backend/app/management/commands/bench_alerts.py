@@ -0,0 +1,62 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from app.alerts import AlertEngine
+from app.models import AlertRule
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Benchmark alert evaluation against synthetic rules and a random-walk tick stream"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, default=100000)
+        parser.add_argument('--symbols', type=int, default=1000)
+        parser.add_argument('--ticks', type=int, default=200000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        symbols = [f'NSE:SYM{i}-EQ' for i in range(options['symbols'])]
+        prices = {symbol: rng.uniform(50, 5000) for symbol in symbols}
+
+        fired = []
+        engine = AlertEngine()
+        engine.notify = lambda user_id, alert: fired.append(alert)
+
+        started = time.perf_counter()
+        for rule_id in range(options['rules']):
+            symbol = rng.choice(symbols)
+            kind = rng.choice((AlertRule.PRICE_ABOVE, AlertRule.PRICE_BELOW))
+            offset = rng.uniform(0, 0.05) * prices[symbol]
+            threshold = prices[symbol] + offset if kind == AlertRule.PRICE_ABOVE else prices[symbol] - offset
+            engine.add(rule_id, rule_id % 1000, symbol, kind, threshold)
+        load_seconds = time.perf_counter() - started
+
+        # Prime every symbol's last price so the first tick can cross
+        for symbol in symbols:
+            engine.on_tick({'symbol': symbol, 'ltp': prices[symbol]})
+
+        timings = []
+        perf_counter_ns = time.perf_counter_ns
+        for _ in range(options['ticks']):
+            symbol = rng.choice(symbols)
+            prices[symbol] *= 1 + rng.gauss(0, 0.002)
+            message = {'symbol': symbol, 'ltp': round(prices[symbol], 2)}
+            t0 = perf_counter_ns()
+            engine.on_tick(message)
+            timings.append(perf_counter_ns() - t0)
+        engine._fired = []
+
+        timings.sort()
+        self.stdout.write(
+            f"{options['rules']} rules on {options['symbols']} symbols loaded in {load_seconds * 1000:.1f} ms\n"
+            f"{options['ticks']} ticks, {len(fired)} alerts fired, {len(engine)} rules left\n"
+            f"per tick: p50 {percentile(timings, 0.5) / 1000:.2f} us, "
+            f"p99 {percentile(timings, 0.99) / 1000:.2f} us, "
+            f"p99.9 {percentile(timings, 0.999) / 1000:.2f} us, "
+            f"max {timings[-1] / 1000:.2f} us"
+        )
@@ -0,0 +1,103 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from app.models import PaperOrder
+from app.paper import PaperExchange
+from app.lastvalue import last_values
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class CountingStore:
+    """Stands in for the batched writers so nothing reaches the database"""
+
+    def __init__(self):
+        self.rows = 0
+
+    def add(self, *args):
+        self.rows += 1
+
+
+class Command(BaseCommand):
+    help = "Benchmark paper order placement and tick matching against a random-walk feed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--symbols', type=int, default=500)
+        parser.add_argument('--ticks', type=int, default=200000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        symbols = [f'NSE:SYM{i}-EQ' for i in range(options['symbols'])]
+        prices = {symbol: rng.uniform(50, 5000) for symbol in symbols}
+
+        orders, fills = CountingStore(), CountingStore()
+        exchange = PaperExchange(orders=orders, fills=fills)
+        notified = []
+        exchange.notify = lambda user_id, update: notified.append(update)
+
+        # Every symbol has a live quote, so market orders fill on placement
+        for symbol in symbols:
+            price = prices[symbol]
+            last_values.update({'symbol': symbol, 'ltp': price, 'bid_price': price * 0.9995, 'ask_price': price * 1.0005})
+
+        kinds = (PaperOrder.MARKET, PaperOrder.LIMIT, PaperOrder.LIMIT, PaperOrder.STOP, PaperOrder.STOP_LIMIT)
+        timings = []
+        perf_counter_ns = time.perf_counter_ns
+        for order_id in range(1, options['orders'] + 1):
+            symbol = rng.choice(symbols)
+            price = prices[symbol]
+            side = rng.choice((PaperOrder.BUY, PaperOrder.SELL))
+            kind = rng.choice(kinds)
+            away = rng.uniform(0.001, 0.05) * price
+            # Limits rest away from the market, stops trigger further out
+            limit = stop = None
+            if kind in (PaperOrder.LIMIT, PaperOrder.STOP_LIMIT):
+                limit = price - away if side == PaperOrder.BUY else price + away
+            if kind in (PaperOrder.STOP, PaperOrder.STOP_LIMIT):
+                stop = price + away if side == PaperOrder.BUY else price - away
+                if limit is not None:
+                    limit = stop
+            t0 = perf_counter_ns()
+            exchange.place(order_id, order_id % 1000, symbol, side, kind, rng.randint(1, 100), limit, stop)
+            timings.append(perf_counter_ns() - t0)
+        place_seconds = sum(timings) / 1e9
+        working = len(exchange)
+
+        timings.sort()
+        self.stdout.write(
+            f"{options['orders']} orders placed on {options['symbols']} symbols in {place_seconds * 1000:.1f} ms "
+            f"({options['orders'] / place_seconds:,.0f} orders/s), {working} left working\n"
+            f"per order: p50 {percentile(timings, 0.5) / 1000:.2f} us, "
+            f"p99 {percentile(timings, 0.99) / 1000:.2f} us, "
+            f"max {timings[-1] / 1000:.2f} us"
+        )
+
+        filled_before = exchange.filled
+        timings = []
+        for _ in range(options['ticks']):
+            symbol = rng.choice(symbols)
+            prices[symbol] *= 1 + rng.gauss(0, 0.002)
+            price = round(prices[symbol], 2)
+            message = {
+                'symbol': symbol, 'ltp': price,
+                'bid_price': round(price * 0.9995, 2), 'ask_price': round(price * 1.0005, 2),
+            }
+            t0 = perf_counter_ns()
+            exchange.on_tick(message)
+            timings.append(perf_counter_ns() - t0)
+        tick_seconds = sum(timings) / 1e9
+
+        timings.sort()
+        self.stdout.write(
+            f"{options['ticks']} ticks in {tick_seconds * 1000:.1f} ms "
+            f"({options['ticks'] / tick_seconds:,.0f} ticks/s), "
+            f"{exchange.filled - filled_before} fills, {len(exchange)} orders left working\n"
+            f"per tick: p50 {percentile(timings, 0.5) / 1000:.2f} us, "
+            f"p99 {percentile(timings, 0.99) / 1000:.2f} us, "
+            f"max {timings[-1] / 1000:.2f} us\n"
+            f"{orders.rows} order updates and {fills.rows} fills queued for the database"
+        )
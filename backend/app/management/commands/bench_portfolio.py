@@ -0,0 +1,87 @@
+import asyncio
+import random
+import time
+from django.core.management.base import BaseCommand
+from app.portfolio import PortfolioEngine
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class NullLayer:
+    """Stands in for the channel layer so the push cost is the engine's own"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, channel, message):
+        self.sent += 1
+
+
+class Command(BaseCommand):
+    help = "Benchmark live portfolio P&L against synthetic portfolios and a random-walk tick stream"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--portfolios', type=int, default=20000)
+        parser.add_argument('--positions', type=int, default=20, help="Positions per portfolio")
+        parser.add_argument('--symbols', type=int, default=1000)
+        parser.add_argument('--ticks', type=int, default=200000)
+        parser.add_argument('--push-every', type=int, default=1000, help="Ticks between two pushes")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        rng = random.Random(options['seed'])
+        symbols = [f'NSE:SYM{i}-EQ' for i in range(options['symbols'])]
+        prices = {symbol: rng.uniform(50, 5000) for symbol in symbols}
+
+        engine = PortfolioEngine()
+        engine.start = lambda: None
+        layer = NullLayer()
+
+        started = time.perf_counter()
+        for portfolio_id in range(options['portfolios']):
+            held = rng.sample(symbols, min(options['positions'], len(symbols)))
+            rows = [(symbol, rng.randint(1, 500), prices[symbol] * rng.uniform(0.8, 1.2)) for symbol in held]
+            engine.watch(portfolio_id, f'bench.{portfolio_id}', rows)
+        load_seconds = time.perf_counter() - started
+
+        for symbol in symbols:
+            engine.on_tick({'symbol': symbol, 'ltp': prices[symbol], 'prev_close_price': prices[symbol]})
+
+        await engine.push(layer)
+
+        timings = []
+        pushes = []
+        perf_counter_ns = time.perf_counter_ns
+        for count in range(1, options['ticks'] + 1):
+            symbol = rng.choice(symbols)
+            prices[symbol] *= 1 + rng.gauss(0, 0.002)
+            message = {'symbol': symbol, 'ltp': round(prices[symbol], 2)}
+            t0 = perf_counter_ns()
+            engine.on_tick(message)
+            timings.append(perf_counter_ns() - t0)
+            if count % options['push_every'] == 0:
+                t0 = perf_counter_ns()
+                await engine.push(layer)
+                pushes.append(perf_counter_ns() - t0)
+
+        timings.sort()
+        pushes.sort()
+        stats = engine.stats()
+        self.stdout.write(
+            f"{stats['portfolios']} portfolios, {stats['positions']} positions on {stats['symbols']} symbols "
+            f"loaded in {load_seconds * 1000:.1f} ms\n"
+            f"{options['ticks']} ticks, {layer.sent} updates pushed\n"
+            f"per tick: p50 {percentile(timings, 0.5) / 1000:.2f} us, "
+            f"p99 {percentile(timings, 0.99) / 1000:.2f} us, "
+            f"max {timings[-1] / 1000:.2f} us"
+        )
+        if pushes:
+            self.stdout.write(
+                f"per push of {options['push_every']} ticks: p50 {percentile(pushes, 0.5) / 1e6:.2f} ms, "
+                f"p99 {percentile(pushes, 0.99) / 1e6:.2f} ms, max {pushes[-1] / 1e6:.2f} ms"
+            )
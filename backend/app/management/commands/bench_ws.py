@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+import aiohttp
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from app.symbols import symbol_master
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def process_usage(pid):
+    """CPU seconds and resident memory of a process, from /proc"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    ticks = os.sysconf('SC_CLK_TCK')
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    rss = int(fields[21]) * resource.getpagesize()
+    return cpu, rss
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Client:
+    """One simulated ws/stocks/ connection recording tick-to-client latency"""
+
+    def __init__(self, url, symbols, latencies, record):
+        self.url = url
+        self.symbols = symbols
+        self.latencies = latencies
+        self.record = record  # record[0] is False during warm-up
+        self.messages = 0
+        self.ticks = 0
+        self.errors = 0
+
+    async def run(self, session, stop):
+        async with session.ws_connect(self.url, max_msg_size=0) as ws:
+            await ws.send_str(json.dumps({'action': 'subscribe', 'symbols': self.symbols}))
+            receiving = asyncio.ensure_future(self.receive(ws))
+            await stop.wait()
+            await ws.close()
+            await receiving
+
+    async def receive(self, ws):
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            now = time.time()
+            data = json.loads(msg.data)
+            kind = data.get('type')
+            if kind == 'data_update':
+                ticks = (data['message'],)
+            elif kind == 'data_batch':
+                ticks = data['messages']
+            else:
+                if kind == 'error':
+                    self.errors += 1
+                continue
+            if not self.record[0]:
+                continue
+            self.messages += 1
+            for tick in ticks:
+                sent = tick.get('feed_ts')
+                if sent is not None:
+                    self.ticks += 1
+                    self.latencies.append(now - sent)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test ws/stocks/: start daphne workers on the synthetic feed, connect "
+        "simulated clients and report tick-to-client latency, throughput and worker CPU/RSS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100)
+        parser.add_argument('--symbols-per-client', type=int, default=10)
+        parser.add_argument('--universe', type=int, default=200, help="Distinct symbols across all clients")
+        parser.add_argument('--rate', type=int, default=1000, help="Feed ticks per second")
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument('--warmup', type=float, default=5)
+        parser.add_argument('--workers', type=int, default=1, help="daphne processes; more than one needs REDIS_URL")
+        parser.add_argument('--port', type=int, default=8900, help="Port of the first worker")
+        parser.add_argument('--conflate-ms', type=int, default=0)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help="JSON results file (default data/bench/ws-<time>.json)")
+
+    def handle(self, *args, **options):
+        if options['workers'] > 1 and not settings.REDIS_URL:
+            raise CommandError("More than one worker needs REDIS_URL for a shared channel layer")
+
+        if symbol_master.ensure_loaded():
+            universe = symbol_master.symbols[:options['universe']]
+        else:
+            universe = [f"NSE:BENCH{i}-EQ" for i in range(options['universe'])]
+        per_client = min(options['symbols_per_client'], len(universe))
+
+        env = dict(
+            os.environ,
+            FEED_SOURCE='synthetic',
+            FEED_SYNTHETIC_RATE=str(options['rate']),
+            STREAM_CONFLATE_MS=str(options['conflate_ms']),
+        )
+        ports = [options['port'] + i for i in range(options['workers'])]
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'daphne', '-p', str(port), 'vtrade.asgi:application'],
+                cwd=settings.BASE_DIR, env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            for port in ports
+        ]
+        try:
+            result = asyncio.run(self.run(options, universe, per_client, ports, workers))
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                try:
+                    worker.wait(10)
+                except subprocess.TimeoutExpired:
+                    worker.kill()
+
+        output = options['output'] or str(
+            Path(settings.BASE_DIR) / 'data' / 'bench' / time.strftime('ws-%Y%m%d-%H%M%S.json')
+        )
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+        self.report(result, output)
+
+    async def wait_for_port(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                _, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.2)
+        raise CommandError(f"Worker on port {port} did not start")
+
+    async def run(self, options, universe, per_client, ports, workers):
+        for port in ports:
+            await self.wait_for_port(port)
+
+        latencies = []
+        record = [False]
+        query = f"?conflate_ms={options['conflate_ms']}"
+        clients = []
+        for i in range(options['clients']):
+            # Spread subscriptions over the universe deterministically
+            start = (i * per_client + options['seed']) % len(universe)
+            symbols = [universe[(start + j) % len(universe)] for j in range(per_client)]
+            port = ports[i % len(ports)]
+            clients.append(Client(f'ws://127.0.0.1:{port}/ws/stocks/{query}', symbols, latencies, record))
+
+        stop = asyncio.Event()
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            tasks = [asyncio.ensure_future(client.run(session, stop)) for client in clients]
+            await asyncio.sleep(options['warmup'])
+
+            before = [process_usage(worker.pid) for worker in workers]
+            client_cpu = resource.getrusage(resource.RUSAGE_SELF)
+            record[0] = True
+            started = time.monotonic()
+            await asyncio.sleep(options['duration'])
+            record[0] = False
+            elapsed = time.monotonic() - started
+            after = [process_usage(worker.pid) for worker in workers]
+            client_cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+
+            stop.set()
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+
+        failed = [repr(outcome) for outcome in outcomes if isinstance(outcome, Exception)]
+        latencies.sort()
+        messages = sum(client.messages for client in clients)
+        ticks = sum(client.ticks for client in clients)
+        client_seconds = (
+            client_cpu_after.ru_utime + client_cpu_after.ru_stime
+            - client_cpu.ru_utime - client_cpu.ru_stime
+        )
+        return {
+            'commit': git_commit(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'host': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+            'config': {
+                'clients': options['clients'],
+                'symbols_per_client': per_client,
+                'universe': len(universe),
+                'rate': options['rate'],
+                'duration': options['duration'],
+                'warmup': options['warmup'],
+                'workers': len(workers),
+                'conflate_ms': options['conflate_ms'],
+                'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+            },
+            'latency_ms': {
+                'samples': len(latencies),
+                'p50': self.ms(percentile(latencies, 0.5)),
+                'p99': self.ms(percentile(latencies, 0.99)),
+                'p999': self.ms(percentile(latencies, 0.999)),
+                'max': self.ms(latencies[-1] if latencies else None),
+            },
+            'throughput': {
+                'messages_per_second': round(messages / elapsed, 1),
+                'ticks_per_second': round(ticks / elapsed, 1),
+            },
+            'workers': [
+                {
+                    'port': port,
+                    'cpu_percent': round((cpu_after - cpu_before) / elapsed * 100, 1),
+                    'rss_mb': round(rss / 2 ** 20, 1),
+                }
+                for port, (cpu_before, _), (cpu_after, rss) in zip(ports, before, after)
+            ],
+            'client_cpu_percent': round(client_seconds / elapsed * 100, 1),
+            'client_errors': sum(client.errors for client in clients),
+            'failed_clients': len(failed),
+            'failures': failed[:10],
+        }
+
+    def ms(self, seconds):
+        return round(seconds * 1000, 3) if seconds is not None else None
+
+    def report(self, result, output):
+        config, latency, throughput = result['config'], result['latency_ms'], result['throughput']
+        self.stdout.write(
+            f"{config['clients']} clients x {config['symbols_per_client']} symbols, "
+            f"{config['rate']} ticks/s over {config['universe']} symbols, {config['workers']} worker(s)\n"
+            f"latency: p50 {latency['p50']} ms, p99 {latency['p99']} ms, "
+            f"p99.9 {latency['p999']} ms, max {latency['max']} ms ({latency['samples']} samples)\n"
+            f"throughput: {throughput['messages_per_second']} msgs/s, {throughput['ticks_per_second']} ticks/s to clients"
+        )
+        for worker in result['workers']:
+            self.stdout.write(f"worker :{worker['port']}: cpu {worker['cpu_percent']}%, rss {worker['rss_mb']} MB")
+        if result['failed_clients'] or result['client_errors']:
+            self.stdout.write(self.style.WARNING(
+                f"{result['failed_clients']} clients failed, {result['client_errors']} error frames"
+            ))
+        self.stdout.write(f"results written to {output}")
@@ -0,0 +1,40 @@
+import asyncio
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from app.feed import market_data_hub
+
+
+class Command(BaseCommand):
+    help = (
+        "Own the upstream Fyers data socket outside the web workers and "
+        "publish its ticks to the channel layer. Web processes should run "
+        "with FEED_MODE=remote."
+    )
+
+    def handle(self, *args, **options):
+        backend = settings.CHANNEL_LAYERS['default']['BACKEND']
+        if backend.endswith('InMemoryChannelLayer'):
+            raise CommandError("run_feed needs a channel layer shared between processes; set REDIS_URL")
+        asyncio.run(self.run())
+
+    async def run(self):
+        hub = market_data_hub
+        hub.clustered = True
+        hub.can_own = True
+
+        if not await hub.start():
+            raise CommandError("Could not start the feed; is there a valid Fyers token?")
+        if hub.owner:
+            self.stdout.write(self.style.SUCCESS(f"Feed owned by {hub.worker_id}"))
+        else:
+            self.stdout.write(f"Another process holds the feed lease; {hub.worker_id} is standing by")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+
+        self.stdout.write("Stopping feed")
+        await hub.stop()
@@ -0,0 +1,235 @@
+"""
+Process-local metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms are plain attribute updates, cheap enough
+for the tick path; they are meant to be updated from the event loop.
+Numbers other components already keep (the feed queue, the caches) are
+not counted twice but read when /metrics is scraped, through callbacks
+registered with Registry.collect().
+"""
+import bisect
+import math
+
+# Latency buckets in seconds, from 100us to 10s
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """A metric family; with label names, values live in per-label children"""
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.help)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) tuples"""
+        if self.labelnames:
+            for values, child in self._children.items():
+                for suffix, _, extra, value in child.samples():
+                    yield suffix, values, extra, value
+        else:
+            yield from self._own_samples()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, values, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(self.labelnames, values, extra)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def _own_samples(self):
+        yield '', (), (), self.value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def _own_samples(self):
+        yield '', (), (), self.value
+
+
+class Histogram(Metric):
+    """
+    Fixed-bucket histogram. observe() is a bisect and three additions;
+    counts are kept per bucket and made cumulative when rendered.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _own_samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            yield '_bucket', (), (('le', format_value(float(bound))),), cumulative
+        yield '_sum', (), (), self.sum
+        yield '_count', (), (), self.count
+
+
+class CallbackMetric(Metric):
+    """
+    A counter or gauge whose value is read from func() at scrape time.
+    func returns a number, or a {label values tuple: number} dict when the
+    metric has label names. Errors and None values are skipped.
+    """
+
+    def __init__(self, name, help, type, func, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.func = func
+
+    def samples(self):
+        try:
+            value = self.func()
+        except Exception:
+            return
+        if value is None:
+            return
+        if self.labelnames:
+            for values, number in value.items():
+                yield '', values, (), number
+        else:
+            yield '', (), (), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def collect(self, name, help, type, func, labelnames=()):
+        return self.register(CallbackMetric(name, help, type, func, labelnames))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Metrics updated directly by the code paths they measure
+tick_to_send_seconds = registry.histogram(
+    'vtrade_tick_to_send_seconds',
+    'Time from a tick arriving from the feed to its websocket send completing',
+)
+ws_send_failures = registry.counter(
+    'vtrade_ws_send_failures_total',
+    'Websocket sends to clients that raised',
+)
+ws_connections = registry.gauge(
+    'vtrade_ws_connections',
+    'Open ws/stocks/ connections in this process',
+)
+feed_batch_size = registry.histogram(
+    'vtrade_feed_batch_size',
+    'Ticks taken off the feed queue per dispatch batch',
+    buckets=SIZE_BUCKETS,
+)
+feed_dispatch_seconds = registry.histogram(
+    'vtrade_feed_dispatch_seconds',
+    'Time to dispatch one batch of ticks',
+)
+fyers_request_seconds = registry.histogram(
+    'vtrade_fyers_request_seconds',
+    'Latency of Fyers REST calls',
+    labelnames=('endpoint',),
+)
+fyers_request_errors = registry.counter(
+    'vtrade_fyers_request_errors_total',
+    'Fyers REST calls that raised or did not return ok',
+    labelnames=('endpoint',),
+)
+token_refresh_seconds = registry.histogram(
+    'vtrade_token_refresh_seconds',
+    'Duration of Fyers access token refreshes, including storing the new token',
+)
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tick',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=64)),
+                ('ltp', models.FloatField()),
+                ('volume', models.BigIntegerField(blank=True, null=True)),
+                ('last_traded_qty', models.BigIntegerField(blank=True, null=True)),
+                ('bid_price', models.FloatField(blank=True, null=True)),
+                ('ask_price', models.FloatField(blank=True, null=True)),
+                ('exchange_time', models.DateTimeField()),
+                ('received_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'market_tick',
+                'indexes': [models.Index(fields=['symbol', 'exchange_time'], name='market_tick_symbol_44916d_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_tick'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Candle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=64)),
+                ('timeframe', models.CharField(max_length=8)),
+                ('start', models.DateTimeField()),
+                ('open', models.FloatField()),
+                ('high', models.FloatField()),
+                ('low', models.FloatField()),
+                ('close', models.FloatField()),
+                ('volume', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'market_candle',
+                'indexes': [models.Index(fields=['symbol', 'timeframe', 'start'], name='market_cand_symbol_5da295_idx')],
+            },
+        ),
+    ]
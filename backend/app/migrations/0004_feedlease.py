@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_candle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedLease',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('owner', models.CharField(max_length=128)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'feed_lease',
+            },
+        ),
+    ]
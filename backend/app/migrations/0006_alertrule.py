@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_watchlist'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=64)),
+                ('kind', models.CharField(choices=[('price_above', 'Price crosses above'), ('price_below', 'Price crosses below'), ('volume_multiple', 'Candle volume exceeds a multiple of its average')], max_length=20)),
+                ('threshold', models.FloatField()),
+                ('active', models.BooleanField(default=True)),
+                ('triggered_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alert_rules', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'alert_rule',
+                'indexes': [models.Index(fields=['active', 'symbol'], name='alert_rule_active_b0f7b8_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_portfolio'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaperOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=64)),
+                ('side', models.CharField(choices=[('buy', 'Buy'), ('sell', 'Sell')], max_length=4)),
+                ('order_type', models.CharField(choices=[('market', 'Market'), ('limit', 'Limit'), ('stop', 'Stop'), ('stop_limit', 'Stop-limit')], max_length=10)),
+                ('quantity', models.PositiveIntegerField()),
+                ('limit_price', models.FloatField(blank=True, null=True)),
+                ('stop_price', models.FloatField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('triggered', 'Stop triggered, working as a limit order'), ('filled', 'Filled'), ('cancelled', 'Cancelled')], default='open', max_length=10)),
+                ('filled_price', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paper_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'paper_order',
+            },
+        ),
+        migrations.CreateModel(
+            name='PaperFill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=64)),
+                ('side', models.CharField(choices=[('buy', 'Buy'), ('sell', 'Sell')], max_length=4)),
+                ('quantity', models.PositiveIntegerField()),
+                ('price', models.FloatField()),
+                ('filled_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='paper_fills', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fills', to='app.paperorder')),
+            ],
+            options={
+                'db_table': 'paper_fill',
+                'ordering': ['-filled_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='paperorder',
+            index=models.Index(fields=['status'], name='paper_order_status_fd29c5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paperorder',
+            index=models.Index(fields=['user', '-created_at'], name='paper_order_user_id_2605c8_idx'),
+        ),
+    ]
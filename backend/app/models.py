@@ -1,5 +1,7 @@
 # models.py
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q
 from django.utils import timezone
 import datetime
 import logging
@@ -20,23 +22,263 @@ class FyersToken(models.Model):
         db_table = 'fyers_token'
     
     @classmethod
-    def get_valid_token(cls):
+    def get_valid(cls):
         """
-        Get a valid token or None if no valid token exists
+        Get the newest token record that is still valid, or None
         """
         now = timezone.now()
         # Add a 5-minute buffer to avoid edge cases
         buffer_time = now + datetime.timedelta(minutes=5)
         
         try:
-            # Try to get a valid token
-            token = cls.objects.filter(
+            return cls.objects.filter(
                 expires_at__gt=buffer_time
             ).order_by('-created_at').first()
-            
-            if token:
-                return token.access_token
-            return None
         except Exception as e:
             logger.exception(f"Error getting valid token: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    @classmethod
+    def get_valid_token(cls):
+        """
+        Get a valid token or None if no valid token exists
+        """
+        token = cls.get_valid()
+        if token:
+            return token.access_token
+        return None
+
+
+class Tick(models.Model):
+    """
+    A single market data tick from the live feed.
+
+    Rows are written in bulk by app.ingest.TickIngestor, never one at a time.
+    """
+    symbol = models.CharField(max_length=64)
+    ltp = models.FloatField()
+    volume = models.BigIntegerField(null=True, blank=True)
+    last_traded_qty = models.BigIntegerField(null=True, blank=True)
+    bid_price = models.FloatField(null=True, blank=True)
+    ask_price = models.FloatField(null=True, blank=True)
+    exchange_time = models.DateTimeField()
+    received_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'market_tick'
+        indexes = [
+            models.Index(fields=['symbol', 'exchange_time']),
+        ]
+
+
+class Candle(models.Model):
+    """
+    A closed OHLCV candle built from the live feed by app.candles
+    """
+    symbol = models.CharField(max_length=64)
+    timeframe = models.CharField(max_length=8)
+    start = models.DateTimeField()
+    open = models.FloatField()
+    high = models.FloatField()
+    low = models.FloatField()
+    close = models.FloatField()
+    volume = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'market_candle'
+        indexes = [
+            models.Index(fields=['symbol', 'timeframe', 'start']),
+        ]
+
+
+class FeedLease(models.Model):
+    """
+    Time-limited claim on a shared resource, used so that only one process
+    owns the upstream Fyers socket. The holder renews it before it expires;
+    if the holder dies, another process takes over once it has lapsed.
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+    owner = models.CharField(max_length=128)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'feed_lease'
+
+    @classmethod
+    def acquire(cls, name, owner, seconds):
+        """
+        Take or renew the lease. Returns True when owner holds it afterwards.
+        """
+        now = timezone.now()
+        expires_at = now + datetime.timedelta(seconds=seconds)
+        # A single conditional UPDATE, so two contenders cannot both win
+        updated = cls.objects.filter(name=name).filter(
+            Q(owner=owner) | Q(expires_at__lt=now)
+        ).update(owner=owner, expires_at=expires_at)
+        if updated:
+            return True
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, owner=owner, expires_at=expires_at)
+            return True
+        except IntegrityError:
+            return False
+
+    @classmethod
+    def release(cls, name, owner):
+        cls.objects.filter(name=name, owner=owner).delete()
+
+
+class Watchlist(models.Model):
+    """
+    A user's named, ordered list of symbols
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='watchlists')
+    name = models.CharField(max_length=100)
+    symbols = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'watchlist'
+        ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_watchlist_name'),
+        ]
+
+
+class AlertRule(models.Model):
+    """
+    A one-shot alert on a symbol, evaluated by app.alerts against the live feed
+    """
+    PRICE_ABOVE = 'price_above'
+    PRICE_BELOW = 'price_below'
+    VOLUME_MULTIPLE = 'volume_multiple'
+    KIND_CHOICES = [
+        (PRICE_ABOVE, 'Price crosses above'),
+        (PRICE_BELOW, 'Price crosses below'),
+        (VOLUME_MULTIPLE, 'Candle volume exceeds a multiple of its average'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='alert_rules')
+    symbol = models.CharField(max_length=64)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    threshold = models.FloatField()
+    active = models.BooleanField(default=True)
+    triggered_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'alert_rule'
+        indexes = [
+            models.Index(fields=['active', 'symbol']),
+        ]
+
+    @classmethod
+    def mark_triggered(cls, ids):
+        cls.objects.filter(pk__in=ids).update(active=False, triggered_at=timezone.now())
+
+
+class Portfolio(models.Model):
+    """
+    A user's named set of holdings, marked to market by app.portfolio
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='portfolios')
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'portfolio'
+        ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='unique_portfolio_name'),
+        ]
+
+
+class Position(models.Model):
+    """
+    Holding of one symbol in a portfolio; a negative quantity is a short
+    """
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='positions')
+    symbol = models.CharField(max_length=64)
+    quantity = models.FloatField()
+    avg_price = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'portfolio_position'
+        ordering = ['symbol']
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'symbol'], name='unique_position_symbol'),
+        ]
+
+
+class PaperOrder(models.Model):
+    """
+    A virtual order, matched against the live feed by app.paper.
+    Rows are created by the API; state changes are written back in batches.
+    """
+    BUY = 'buy'
+    SELL = 'sell'
+    SIDE_CHOICES = [(BUY, 'Buy'), (SELL, 'Sell')]
+
+    MARKET = 'market'
+    LIMIT = 'limit'
+    STOP = 'stop'
+    STOP_LIMIT = 'stop_limit'
+    TYPE_CHOICES = [
+        (MARKET, 'Market'),
+        (LIMIT, 'Limit'),
+        (STOP, 'Stop'),
+        (STOP_LIMIT, 'Stop-limit'),
+    ]
+
+    OPEN = 'open'
+    TRIGGERED = 'triggered'
+    FILLED = 'filled'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (OPEN, 'Open'),
+        (TRIGGERED, 'Stop triggered, working as a limit order'),
+        (FILLED, 'Filled'),
+        (CANCELLED, 'Cancelled'),
+    ]
+    WORKING = (OPEN, TRIGGERED)
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='paper_orders')
+    symbol = models.CharField(max_length=64)
+    side = models.CharField(max_length=4, choices=SIDE_CHOICES)
+    order_type = models.CharField(max_length=10, choices=TYPE_CHOICES)
+    quantity = models.PositiveIntegerField()
+    limit_price = models.FloatField(null=True, blank=True)
+    stop_price = models.FloatField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=OPEN)
+    filled_price = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'paper_order'
+        indexes = [
+            models.Index(fields=['status']),
+            models.Index(fields=['user', '-created_at']),
+        ]
+
+
+class PaperFill(models.Model):
+    """
+    Execution of a paper order against a live quote
+    """
+    order = models.ForeignKey(PaperOrder, on_delete=models.CASCADE, related_name='fills')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='paper_fills')
+    symbol = models.CharField(max_length=64)
+    side = models.CharField(max_length=4, choices=PaperOrder.SIDE_CHOICES)
+    quantity = models.PositiveIntegerField()
+    price = models.FloatField()
+    filled_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'paper_fill'
+        ordering = ['-filled_at']
@@ -0,0 +1,398 @@
+"""
+Simulated exchange for paper trading, matching virtual orders against the
+live feed.
+"""
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .models import PaperOrder, PaperFill
+from .ingest import BulkIngestor
+from .lastvalue import last_values
+from .groups import FEED_CONTROL_GROUP, user_group
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BUY, SELL = PaperOrder.BUY, PaperOrder.SELL
+MARKET, LIMIT, STOP, STOP_LIMIT = PaperOrder.MARKET, PaperOrder.LIMIT, PaperOrder.STOP, PaperOrder.STOP_LIMIT
+OPEN, TRIGGERED, FILLED, CANCELLED = PaperOrder.OPEN, PaperOrder.TRIGGERED, PaperOrder.FILLED, PaperOrder.CANCELLED
+
+place_seconds = registry.histogram(
+    'vtrade_paper_place_seconds', 'Time to place a paper order, matching included',
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01),
+)
+
+
+def _now():
+    return datetime.datetime.now(tz=datetime.timezone.utc)
+
+
+class OrderUpdateIngestor(BulkIngestor):
+    """
+    Writes paper order state changes back to the paper_order table.
+    Rows only carry the changing columns; an order changing more than once
+    in a batch is written once with its last state.
+    """
+
+    model = PaperOrder
+    columns = ('id', 'status', 'filled_price', 'updated_at')
+
+    def add(self, order):
+        self.add_row((order.id, order.status, order.filled_price, _now()))
+
+    def _write(self, rows):
+        latest = {row[0]: row for row in rows}
+        self.model.objects.bulk_update(
+            [self.model(**dict(zip(self.columns, row))) for row in latest.values()],
+            self.columns[1:],
+            batch_size=self.batch_size,
+        )
+        self.written += len(rows)
+
+
+class FillIngestor(BulkIngestor):
+    """
+    Writes paper fills to the paper_fill table
+    """
+
+    model = PaperFill
+    columns = ('order_id', 'user_id', 'symbol', 'side', 'quantity', 'price', 'filled_at')
+
+    def add(self, order, price):
+        self.add_row((order.id, order.user_id, order.symbol, order.side, order.quantity, price, _now()))
+
+
+class Order:
+    __slots__ = ('id', 'user_id', 'symbol', 'side', 'order_type', 'quantity',
+                 'limit_price', 'stop_price', 'status', 'filled_price')
+
+    def __init__(self, id, user_id, symbol, side, order_type, quantity, limit_price=None, stop_price=None,
+                 status=OPEN):
+        self.id = id
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        self.quantity = quantity
+        self.limit_price = limit_price
+        self.stop_price = stop_price
+        self.status = status
+        self.filled_price = None
+
+    @property
+    def working(self):
+        return self.status == OPEN or self.status == TRIGGERED
+
+
+class SymbolBook:
+    """
+    Working orders of one symbol in price-sorted heaps, best price on top:
+    resting buy limits by highest price, sell limits by lowest, buy stops
+    by lowest and sell stops by highest trigger price. Entries are
+    (key, order id, order), so equal prices keep time priority. Cancelled
+    orders are left in place and skipped when they reach the top, until
+    they outnumber the working ones.
+    """
+    __slots__ = ('bids', 'asks', 'buy_stops', 'sell_stops', 'market', 'working', 'ltp', 'bid', 'ask')
+
+    def __init__(self):
+        self.bids = []
+        self.asks = []
+        self.buy_stops = []
+        self.sell_stops = []
+        self.market = []  # market orders placed before the symbol had a price
+        self.working = 0
+        self.ltp = self.bid = self.ask = None
+
+    def entries(self):
+        return len(self.bids) + len(self.asks) + len(self.buy_stops) + len(self.sell_stops) + len(self.market)
+
+    def compact(self):
+        """Drop the entries of orders that stopped working"""
+        for name in ('bids', 'asks', 'buy_stops', 'sell_stops'):
+            heap = [entry for entry in getattr(self, name) if entry[2].working]
+            heapq.heapify(heap)
+            setattr(self, name, heap)
+        self.market = [order for order in self.market if order.working]
+
+
+class PaperExchange:
+    """
+    Matches paper orders against the live feed.
+
+    Each tick updates the symbol's quote and fills whatever it crosses,
+    in heap order: stops whose trigger price the last price reached go
+    first (a stop becomes a market order, a stop-limit a resting limit),
+    then buy limits at or above the ask and sell limits at or below the
+    bid. Market orders fill at the ask or bid, limit orders at the quote
+    when it is better than their limit; quotes without a bid or ask use
+    the last price. Orders fill in full. Placing an order matches it
+    against the current quote straight away, so a tick or placement costs
+    O(log n) per order it fills, whatever the size of the book.
+
+    The exchange runs in the process that owns the feed and orders reach
+    it over the feed.control group. Order state changes and fills are
+    persisted in batches off the event loop, and every change is pushed
+    to the owner's user group.
+    """
+
+    def __init__(self, orders=None, fills=None, compact_ratio=0.5):
+        self.orders_store = orders
+        self.fills_store = fills
+        self.compact_ratio = compact_ratio
+        self.notify = self.push
+        self._books = {}  # symbol -> SymbolBook
+        self._orders = {}  # order id -> working Order
+        self.symbols_changed = False  # set when a symbol gains its first or loses its last order
+        self.placed = 0
+        self.filled = 0
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self._orders)
+
+    def symbols(self):
+        return list(self._books)
+
+    def load(self, rows):
+        """Replace every order with working orders as PaperOrder field rows, oldest first"""
+        self._books = {}
+        self._orders = {}
+        self.symbols_changed = True
+        for row in rows:
+            self._add(Order(*row))
+        logger.info(f"Paper exchange loaded {len(self._orders)} working orders")
+
+    def _book(self, symbol):
+        book = self._books.get(symbol)
+        if book is None:
+            book = self._books[symbol] = SymbolBook()
+            self.symbols_changed = True
+            record = last_values.get(symbol)
+            tick = record.tick if record is not None and record.live else None
+            if tick and tick.get('ltp') is not None:
+                self._quote(book, tick)
+        return book
+
+    def _add(self, order):
+        if order.id in self._orders:
+            return None
+        book = self._book(order.symbol)
+        self._orders[order.id] = order
+        book.working += 1
+        if order.status == TRIGGERED or order.order_type == LIMIT:
+            self._rest(book, order)
+        elif order.order_type == MARKET:
+            book.market.append(order)
+        elif order.side == BUY:
+            heapq.heappush(book.buy_stops, (order.stop_price, order.id, order))
+        else:
+            heapq.heappush(book.sell_stops, (-order.stop_price, order.id, order))
+        return book
+
+    @staticmethod
+    def _rest(book, order):
+        if order.side == BUY:
+            heapq.heappush(book.bids, (-order.limit_price, order.id, order))
+        else:
+            heapq.heappush(book.asks, (order.limit_price, order.id, order))
+
+    def place(self, id, user_id, symbol, side, order_type, quantity, limit_price=None, stop_price=None):
+        """Accept a new order and match it at once; returns its status"""
+        started = time.perf_counter()
+        order = Order(id, user_id, symbol, side, order_type, quantity, limit_price, stop_price)
+        book = self._add(order)
+        if book is None:
+            return self._orders[id].status
+        self.placed += 1
+        if book.ltp is not None:
+            self._match(book)
+        place_seconds.observe(time.perf_counter() - started)
+        return order.status
+
+    def cancel(self, order_id, user_id=None):
+        """Cancel a working order; returns False if there is none to cancel"""
+        order = self._orders.get(order_id)
+        if order is None or (user_id is not None and order.user_id != user_id):
+            return False
+        order.status = CANCELLED
+        self.cancelled += 1
+        self._finish(order)
+        book = self._books.get(order.symbol)
+        if book is not None and book.entries() > book.working / self.compact_ratio:
+            book.compact()
+        self._changed(order)
+        return True
+
+    def apply(self, command):
+        """Handle a place or cancel command from the feed.control group"""
+        if command['action'] == 'place':
+            self.place(**command['order'])
+        elif command['action'] == 'cancel':
+            self.cancel(command['order'], command.get('user_id'))
+
+    def on_tick(self, message):
+        book = self._books.get(message['symbol'])
+        if book is None or message.get('ltp') is None:
+            return
+        self._quote(book, message)
+        self._match(book)
+
+    @staticmethod
+    def _quote(book, message):
+        ltp = message['ltp']
+        book.ltp = ltp
+        book.bid = message.get('bid_price') or ltp
+        book.ask = message.get('ask_price') or ltp
+
+    def _match(self, book):
+        ltp, bid, ask = book.ltp, book.bid, book.ask
+
+        if book.market:
+            orders, book.market = book.market, []
+            for order in orders:
+                if order.working:
+                    self._fill(order, ask if order.side == BUY else bid)
+
+        stops = book.buy_stops
+        while stops and stops[0][0] <= ltp:
+            self._trigger(book, heapq.heappop(stops)[2])
+        stops = book.sell_stops
+        while stops and -stops[0][0] >= ltp:
+            self._trigger(book, heapq.heappop(stops)[2])
+
+        bids = book.bids
+        while bids and -bids[0][0] >= ask:
+            order = heapq.heappop(bids)[2]
+            if order.working:
+                self._fill(order, ask)
+        asks = book.asks
+        while asks and asks[0][0] <= bid:
+            order = heapq.heappop(asks)[2]
+            if order.working:
+                self._fill(order, bid)
+
+        # Drop the tops left by cancellations
+        for heap in (bids, asks, book.buy_stops, book.sell_stops):
+            while heap and not heap[0][2].working:
+                heapq.heappop(heap)
+
+    def _trigger(self, book, order):
+        if not order.working:
+            return
+        if order.order_type == STOP:
+            self._fill(order, book.ask if order.side == BUY else book.bid)
+            return
+        order.status = TRIGGERED
+        self._rest(book, order)
+        self._changed(order)
+
+    def _fill(self, order, price):
+        order.status = FILLED
+        order.filled_price = price
+        self.filled += 1
+        if self.fills_store is not None:
+            self.fills_store.add(order, price)
+        self._finish(order)
+        self._changed(order)
+
+    def _finish(self, order):
+        """Take an order that stopped working out of the index"""
+        del self._orders[order.id]
+        book = self._books[order.symbol]
+        book.working -= 1
+        if not book.working:
+            del self._books[order.symbol]
+            self.symbols_changed = True
+
+    def _changed(self, order):
+        if self.orders_store is not None:
+            self.orders_store.add(order)
+        self.notify(order.user_id, {
+            'order': order.id,
+            'symbol': order.symbol,
+            'side': order.side,
+            'order_type': order.order_type,
+            'quantity': order.quantity,
+            'status': order.status,
+            'filled_price': order.filled_price,
+            'ts': time.time(),
+        })
+
+    def push(self, user_id, update):
+        channel_layer = get_channel_layer()
+        asyncio.ensure_future(channel_layer.group_send(user_group(user_id), dict(update, type='order.update')))
+
+    def stats(self):
+        return {
+            'working': len(self._orders),
+            'symbols': len(self._books),
+            'placed': self.placed,
+            'filled': self.filled,
+            'cancelled': self.cancelled,
+        }
+
+
+def working_orders():
+    """Rows for PaperExchange.load; blocking, run it off the event loop"""
+    return list(PaperOrder.objects.filter(status__in=PaperOrder.WORKING).order_by('id').values_list(
+        'id', 'user_id', 'symbol', 'side', 'order_type', 'quantity', 'limit_price', 'stop_price', 'status'
+    ))
+
+
+def order_placed(order):
+    """Hand a new order to the feed owner. Called from request handlers."""
+    async_to_sync(get_channel_layer().group_send)(FEED_CONTROL_GROUP, {
+        'type': 'paper.order',
+        'action': 'place',
+        'order': {
+            'id': order.pk,
+            'user_id': order.user_id,
+            'symbol': order.symbol,
+            'side': order.side,
+            'order_type': order.order_type,
+            'quantity': order.quantity,
+            'limit_price': order.limit_price,
+            'stop_price': order.stop_price,
+        },
+    })
+
+
+def order_cancelled(order):
+    """
+    Tell the feed owner an order's row was cancelled, so it leaves the book.
+    Called from request handlers.
+    """
+    async_to_sync(get_channel_layer().group_send)(FEED_CONTROL_GROUP, {
+        'type': 'paper.order',
+        'action': 'cancel',
+        'order': order.pk,
+        'user_id': order.user_id,
+    })
+
+
+order_store = OrderUpdateIngestor(
+    batch_size=settings.PAPER_STORE_BATCH_SIZE,
+    flush_interval=settings.PAPER_STORE_FLUSH_INTERVAL,
+)
+fill_store = FillIngestor(
+    batch_size=settings.PAPER_STORE_BATCH_SIZE,
+    flush_interval=settings.PAPER_STORE_FLUSH_INTERVAL,
+)
+paper_exchange = PaperExchange(orders=order_store, fills=fill_store)
+
+registry.collect('vtrade_paper_orders_working', 'Paper orders working on the exchange', 'gauge',
+                 lambda: len(paper_exchange))
+registry.collect('vtrade_paper_orders_total', 'Paper orders by outcome', 'counter',
+                 lambda: {(outcome,): paper_exchange.stats()[outcome] for outcome in ('placed', 'filled', 'cancelled')},
+                 labelnames=('outcome',))
+for _name, _store in (('order', order_store), ('fill', fill_store)):
+    registry.collect(f'vtrade_paper_{_name}_store_rows_total', f'Paper {_name} rows by outcome', 'counter',
+                     lambda store=_store: {
+                         (outcome,): store.stats()[outcome] for outcome in ('written', 'dropped', 'failed')
+                     }, labelnames=('outcome',))
@@ -0,0 +1,359 @@
+"""
+Live mark-to-market of portfolios from the tick feed.
+"""
+import asyncio
+import logging
+import time
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .models import Position
+from .lastvalue import last_values
+from .groups import portfolio_group
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+def summarize(value, cost, day_base, positions, priced):
+    pnl = value - cost
+    return {
+        'value': value,
+        'cost': cost,
+        'pnl': pnl,
+        'pnl_pct': pnl / abs(cost) * 100 if cost else 0.0,
+        'day_pnl': value - day_base,
+        'positions': positions,
+        'priced': priced,
+    }
+
+
+class LivePortfolio:
+    """A watched portfolio: its row in the totals arrays, positions and consumers"""
+    __slots__ = ('id', 'slot', 'positions', 'channels')
+
+    def __init__(self, portfolio_id, slot):
+        self.id = portfolio_id
+        self.slot = slot
+        self.positions = {}  # symbol -> (quantity, average price)
+        self.channels = set()
+
+
+class SymbolHolders:
+    """
+    Positions held in one symbol, as parallel arrays (portfolio slot,
+    quantity, average price) rebuilt from `members` after any change.
+    `marked` is the price the portfolio totals currently reflect, None
+    until the symbol is first priced.
+    """
+    __slots__ = ('members', 'slots', 'quantity', 'avg_price', 'stale', 'ltp', 'prev_close', 'marked')
+
+    def __init__(self):
+        self.members = {}  # slot -> (quantity, average price)
+        self.stale = True
+        self.ltp = self.prev_close = self.marked = None
+
+    def rebuild(self):
+        count = len(self.members)
+        self.slots = np.fromiter(self.members, dtype=np.int64, count=count)
+        rows = np.array(list(self.members.values()), dtype=np.float64).reshape(count, 2)
+        self.quantity = rows[:, 0].copy()
+        self.avg_price = rows[:, 1].copy()
+        self.stale = False
+
+
+class PortfolioEngine:
+    """
+    Keeps the P&L of watched portfolios current as ticks arrive.
+
+    An inverted index maps each symbol to the positions held in it. A tick
+    only stores the symbol's price and marks it dirty, so its cost does not
+    depend on how many portfolios hold the symbol. Once per push interval
+    the price move of every dirty symbol is applied to the running totals
+    (value, cost and previous-close value of priced positions) of all its
+    holders at once with numpy, and each repriced portfolio gets one update
+    with its totals and the positions that moved. Totals are recomputed
+    exactly whenever a portfolio's positions are (re)loaded.
+
+    Only portfolios with a ws/portfolio/ consumer in this process are
+    tracked.
+    """
+
+    def __init__(self, push_interval_ms=500, capacity=1024):
+        self.push_interval = push_interval_ms / 1000.0
+        self._portfolios = {}  # id -> LivePortfolio
+        self._by_slot = {}  # slot -> LivePortfolio
+        self._free = []
+        self._next_slot = 0
+        self._value = np.zeros(capacity)
+        self._cost = np.zeros(capacity)
+        self._day_base = np.zeros(capacity)
+        self._priced = np.zeros(capacity, dtype=np.int64)
+        self._holders = {}  # symbol -> SymbolHolders
+        self._dirty = set()  # symbols with a new price since the last push
+        self._task = None
+        self.pushed = 0
+
+    def __len__(self):
+        return len(self._portfolios)
+
+    def symbols(self, portfolio_id):
+        portfolio = self._portfolios.get(portfolio_id)
+        return list(portfolio.positions) if portfolio is not None else []
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        slot = self._next_slot
+        self._next_slot += 1
+        if slot == len(self._value):
+            size = 2 * len(self._value)
+            self._value = np.resize(self._value, size)
+            self._cost = np.resize(self._cost, size)
+            self._day_base = np.resize(self._day_base, size)
+            self._priced = np.resize(self._priced, size)
+        return slot
+
+    def watch(self, portfolio_id, channel_name, positions):
+        """
+        Track a portfolio for a consumer, with (symbol, quantity, average
+        price) rows; returns its snapshot
+        """
+        portfolio = self._portfolios.get(portfolio_id)
+        if portfolio is None:
+            portfolio = LivePortfolio(portfolio_id, self._allocate())
+            self._portfolios[portfolio_id] = self._by_slot[portfolio.slot] = portfolio
+            self.set_positions(portfolio_id, positions)
+        portfolio.channels.add(channel_name)
+        self.start()
+        return self.snapshot(portfolio_id)
+
+    def unwatch(self, portfolio_id, channel_name):
+        portfolio = self._portfolios.get(portfolio_id)
+        if portfolio is None:
+            return
+        portfolio.channels.discard(channel_name)
+        if not portfolio.channels:
+            self._unindex(portfolio)
+            del self._portfolios[portfolio_id]
+            del self._by_slot[portfolio.slot]
+            self._free.append(portfolio.slot)
+
+    def set_positions(self, portfolio_id, positions):
+        """Replace a tracked portfolio's positions and recompute its totals"""
+        portfolio = self._portfolios.get(portfolio_id)
+        if portfolio is None:
+            return
+        previous = portfolio.positions
+        self._unindex(portfolio, prune=False)
+        slot = portfolio.slot
+        portfolio.positions = {symbol: (quantity, avg_price) for symbol, quantity, avg_price in positions}
+        value = cost = day_base = 0.0
+        priced = 0
+        for symbol, (quantity, avg_price) in portfolio.positions.items():
+            holders = self._holders.get(symbol)
+            if holders is None:
+                holders = self._holders[symbol] = SymbolHolders()
+                self._seed_price(symbol, holders)
+            holders.members[slot] = (quantity, avg_price)
+            holders.stale = True
+            if holders.marked is not None:
+                value += quantity * holders.marked
+                cost += quantity * avg_price
+                day_base += quantity * holders.prev_close
+                priced += 1
+        self._value[slot] = value
+        self._cost[slot] = cost
+        self._day_base[slot] = day_base
+        self._priced[slot] = priced
+        self._prune(previous)
+
+    def _unindex(self, portfolio, prune=True):
+        for symbol in portfolio.positions:
+            holders = self._holders.get(symbol)
+            if holders is not None:
+                holders.members.pop(portfolio.slot, None)
+                holders.stale = True
+        if prune:
+            self._prune(portfolio.positions)
+
+    def _prune(self, symbols):
+        """Forget the symbols among these that nobody holds any more"""
+        for symbol in symbols:
+            holders = self._holders.get(symbol)
+            if holders is not None and not holders.members:
+                del self._holders[symbol]
+                self._dirty.discard(symbol)
+
+    def _seed_price(self, symbol, holders):
+        """Price a newly indexed symbol from its last tick, if there is one"""
+        record = last_values.get(symbol)
+        tick = record.tick if record is not None else None
+        if tick and tick.get('ltp') is not None:
+            holders.ltp = holders.marked = tick['ltp']
+            holders.prev_close = tick.get('prev_close_price') or tick['ltp']
+
+    def on_tick(self, message):
+        symbol = message['symbol']
+        holders = self._holders.get(symbol)
+        if holders is None:
+            return
+        ltp = message.get('ltp')
+        if ltp is None or ltp == holders.ltp:
+            return
+        if holders.prev_close is None:
+            holders.prev_close = message.get('prev_close_price') or ltp
+        holders.ltp = ltp
+        self._dirty.add(symbol)
+
+    def position_view(self, symbol, quantity, avg_price):
+        view = {'symbol': symbol, 'quantity': quantity, 'avg_price': avg_price}
+        holders = self._holders.get(symbol)
+        if holders is not None and holders.ltp is not None:
+            ltp = holders.ltp
+            view.update(ltp=ltp, pnl=quantity * (ltp - avg_price), day_pnl=quantity * (ltp - holders.prev_close))
+        return view
+
+    def snapshot(self, portfolio_id):
+        """Totals and every holding of a portfolio, at the latest prices"""
+        portfolio = self._portfolios[portfolio_id]
+        holdings = [self.position_view(symbol, *position) for symbol, position in portfolio.positions.items()]
+        value = cost = day_base = 0.0
+        priced = 0
+        for view in holdings:
+            if 'ltp' in view:
+                value += view['quantity'] * view['ltp']
+                cost += view['quantity'] * view['avg_price']
+                day_base += view['quantity'] * view['ltp'] - view['day_pnl']
+                priced += 1
+        return dict(
+            summarize(value, cost, day_base, len(holdings), priced),
+            portfolio=portfolio_id,
+            holdings=holdings,
+        )
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        """Push the portfolios repriced since the last round, every interval"""
+        while True:
+            await asyncio.sleep(self.push_interval)
+            try:
+                await self.push()
+            except Exception as e:
+                logger.exception(f"Error pushing portfolio updates: {e}")
+
+    def settle(self):
+        """
+        Apply the new prices of the dirty symbols to their holders' totals.
+        Returns the moved positions as (slots, symbols, ltp, pnl, day_pnl)
+        sorted by slot, or None.
+        """
+        dirty, self._dirty = self._dirty, set()
+        names, slots, ltps, pnls, day_pnls = [], [], [], [], []
+        for symbol in dirty:
+            holders = self._holders.get(symbol)
+            if holders is None:
+                continue
+            if holders.stale:
+                holders.rebuild()
+            at, quantity, ltp = holders.slots, holders.quantity, holders.ltp
+            if holders.marked is None:
+                # First price of the symbol: its positions join the totals
+                self._value[at] += quantity * ltp
+                self._cost[at] += quantity * holders.avg_price
+                self._day_base[at] += quantity * holders.prev_close
+                self._priced[at] += 1
+            else:
+                self._value[at] += quantity * (ltp - holders.marked)
+            holders.marked = ltp
+            names.append(symbol)
+            slots.append(at)
+            ltps.append(ltp)
+            pnls.append(quantity * (ltp - holders.avg_price))
+            day_pnls.append(quantity * (ltp - holders.prev_close))
+        if not slots:
+            return None
+
+        lengths = [len(at) for at in slots]
+        slots = np.concatenate(slots)
+        order = np.argsort(slots, kind='stable')
+        symbol_index = np.repeat(np.arange(len(names)), lengths)[order]
+        return (
+            slots[order],
+            np.array(names, dtype=object)[symbol_index].tolist(),
+            np.array(ltps)[symbol_index],
+            np.concatenate(pnls)[order],
+            np.concatenate(day_pnls)[order],
+        )
+
+    async def push(self, channel_layer=None):
+        moved = self.settle()
+        if moved is None:
+            return
+        slots, names, ltps, pnls, day_pnls = moved
+        # Where each portfolio's run of moved positions starts and ends
+        bounds = np.flatnonzero(np.diff(slots)) + 1
+        starts = [0] + bounds.tolist()
+        ends = bounds.tolist() + [len(slots)]
+        changed = slots[starts]
+        value = self._value[changed].tolist()
+        cost = self._cost[changed].tolist()
+        day_base = self._day_base[changed].tolist()
+        priced = self._priced[changed].tolist()
+        # Holdings go out as compact [symbol, ltp, pnl, day_pnl] rows
+        rows = list(zip(names, ltps.tolist(), pnls.tolist(), day_pnls.tolist()))
+
+        channel_layer = channel_layer or get_channel_layer()
+        ts = time.time()
+        sent = 0
+        for i, slot in enumerate(changed.tolist()):
+            portfolio = self._by_slot.get(slot)
+            if portfolio is None:
+                continue
+            message = summarize(value[i], cost[i], day_base[i], len(portfolio.positions), priced[i])
+            message.update(
+                type='portfolio.update',
+                portfolio=portfolio.id,
+                holdings=rows[starts[i]:ends[i]],
+                ts=ts,
+            )
+            for channel_name in portfolio.channels:
+                await channel_layer.send(channel_name, message)
+            sent += 1
+        self.pushed += sent
+
+    def stats(self):
+        return {
+            'portfolios': len(self._portfolios),
+            'symbols': len(self._holders),
+            'positions': sum(len(portfolio.positions) for portfolio in self._portfolios.values()),
+            'pushed': self.pushed,
+        }
+
+
+def portfolio_positions(portfolio_id):
+    """Rows for PortfolioEngine.watch; blocking, run it off the event loop"""
+    return list(Position.objects.filter(portfolio_id=portfolio_id).values_list('symbol', 'quantity', 'avg_price'))
+
+
+def positions_changed(portfolio_id, deleted=False):
+    """
+    Tell the consumers following a portfolio to reload its positions, or to
+    drop it when it was deleted. Called from request handlers.
+    """
+    async_to_sync(get_channel_layer().group_send)(portfolio_group(portfolio_id), {
+        'type': 'portfolio.changed',
+        'portfolio': portfolio_id,
+        'deleted': deleted,
+    })
+
+
+portfolio_engine = PortfolioEngine(push_interval_ms=settings.PORTFOLIO_PUSH_INTERVAL_MS)
+registry.collect('vtrade_portfolios_watched', 'Portfolios marked to market by this process', 'gauge',
+                 lambda: len(portfolio_engine))
+registry.collect('vtrade_portfolio_updates_total', 'Portfolio updates pushed to consumers', 'counter',
+                 lambda: portfolio_engine.pushed)
@@ -0,0 +1,102 @@
+"""
+Sampling profiler that can be switched on in a running process.
+
+A background thread wakes every interval and records the stack of every
+other thread from sys._current_frames(). Nothing is instrumented, so the
+cost is bounded by the sampling rate and zero while it is stopped.
+Results are in the collapsed-stack format flame graph tools read: one
+'frame;frame;frame count' line per distinct stack, outermost frame first.
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval_ms=10, max_stacks=20000):
+        self.interval = interval_ms / 1000.0
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stacks = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms=None, reset=True):
+        """Start sampling; returns False if it was already running"""
+        with self._lock:
+            if self.running:
+                return False
+            if interval_ms:
+                self.interval = interval_ms / 1000.0
+            if reset:
+                self._stacks = collections.Counter()
+                self.samples = 0
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        logger.info(f"Sampling profiler started at {self.interval * 1000:.1f} ms")
+        return True
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return False
+            self._stop.set()
+            thread = self._thread
+        thread.join()
+        self.stopped_at = time.time()
+        logger.info(f"Sampling profiler stopped after {self.samples} samples")
+        return True
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                if key in self._stacks or len(self._stacks) < self.max_stacks:
+                    self._stacks[key] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Samples so far as collapsed stacks, most frequent first"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'stacks': len(self._stacks),
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at,
+        }
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .services import FyersClientService
+from .lastvalue import last_values
+from .metrics import registry, fyers_request_seconds, fyers_request_errors
+
+logger = logging.getLogger(__name__)
+
+class QuoteCache:
+    """
+    Per-symbol cache of quote entries (the items of a quotes 'd' array).
+
+    Entries expire after a fixed TTL and the least recently used symbol is
+    evicted once the cache is full. Symbols covered by the live feed are
+    served from the last-value table instead (see QuoteService).
+    """
+
+    def __init__(self, ttl_ms, max_size):
+        self.ttl = ttl_ms / 1000.0
+        self.max_size = max_size
+        self._entries = OrderedDict()  # symbol -> (expires_at, quote)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, symbol):
+        entry = self._entries.get(symbol)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(symbol)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def peek(self, symbol):
+        """Return the cached entry without touching the LRU order, TTL or counters"""
+        entry = self._entries.get(symbol)
+        return entry[1] if entry is not None else None
+
+    def put(self, symbol, quote):
+        self._entries[symbol] = (time.monotonic() + self.ttl, quote)
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl_ms': int(self.ttl * 1000),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+quote_cache = QuoteCache(settings.QUOTE_CACHE_TTL_MS, settings.QUOTE_CACHE_MAX_SYMBOLS)
+registry.collect('vtrade_quote_cache_hits_total', 'Quote lookups served from memory', 'counter',
+                 lambda: quote_cache.hits)
+registry.collect('vtrade_quote_cache_misses_total', 'Quote lookups that went upstream', 'counter',
+                 lambda: quote_cache.misses)
+registry.collect('vtrade_quote_cache_evictions_total', 'Quotes evicted from the cache', 'counter',
+                 lambda: quote_cache.evictions)
+registry.collect('vtrade_quote_cache_size', 'Symbols in the quote cache', 'gauge', lambda: len(quote_cache))
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how many upstream calls start per second
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class QuoteService:
+    """
+    Fetches quotes from Fyers for the REST API.
+
+    Symbols the live feed covers are answered from the last-value table and
+    symbols found in the quote cache from memory; only the missing ones go
+    upstream. A symbol that is already being fetched by
+    another request waits for that request instead of issuing another
+    upstream call.
+
+    Large symbol lists are split into batches of FYERS_QUOTES_BATCH_SIZE
+    that run concurrently, capped by FYERS_QUOTES_MAX_CONCURRENCY and
+    FYERS_QUOTES_RATE_LIMIT calls per second. A failed batch only marks
+    its own symbols as errors.
+    """
+
+    _inflight = {}  # symbol -> task fetching it
+    live_hits = 0  # lookups answered from the last-value table
+    _semaphore = None
+    _rate_limiter = None
+
+    @classmethod
+    async def get_quotes(cls, symbols):
+        """
+        Get a Fyers-style quotes response for a list of formatted symbols,
+        with one 'd' entry per symbol in the requested order.
+        Returns None when no access token is available.
+        """
+        quotes = {}
+        pending = {}
+        to_fetch = []
+        for symbol in dict.fromkeys(symbols):
+            record = last_values.get(symbol)
+            if record is not None and record.live:
+                quotes[symbol] = record.quote()
+                cls.live_hits += 1
+                continue
+
+            quote = quote_cache.get(symbol)
+            if quote is not None:
+                quotes[symbol] = quote
+            elif symbol in cls._inflight:
+                pending[symbol] = cls._inflight[symbol]
+            else:
+                to_fetch.append(symbol)
+
+        if to_fetch:
+            task = asyncio.ensure_future(cls._fetch(to_fetch))
+            for symbol in to_fetch:
+                cls._inflight[symbol] = pending[symbol] = task
+            task.add_done_callback(lambda done, fetched=to_fetch: cls._forget(fetched, done))
+
+        responses = {}
+        for task in set(pending.values()):
+            # Shield so one cancelled caller does not cancel the shared request
+            responses[task] = await asyncio.shield(task)
+
+        failed = [response for response in responses.values() if response is None or response.get('s') != 'ok']
+        if failed and len(failed) == len(responses) and not quotes:
+            # Nothing could be answered, report the upstream error as is
+            return failed[0]
+
+        # A failed request only marks its own symbols, cached ones still go out
+        for symbol, task in pending.items():
+            response = responses[task]
+            if response is None:
+                quotes[symbol] = cls._error_entry(symbol, 'No access token available')
+            elif response.get('s') != 'ok':
+                quotes[symbol] = cls._error_entry(symbol, response.get('message') or 'Quote request failed')
+            else:
+                quotes[symbol] = cls._entry_for(response, symbol)
+
+        return {'s': 'ok', 'd': [quotes[symbol] for symbol in dict.fromkeys(symbols)]}
+
+    @classmethod
+    def _forget(cls, symbols, task):
+        for symbol in symbols:
+            if cls._inflight.get(symbol) is task:
+                del cls._inflight[symbol]
+
+    @classmethod
+    def _entry_for(cls, response, symbol):
+        for entry in response.get('d', ()):
+            if entry.get('n') == symbol:
+                return entry
+        return cls._error_entry(symbol, 'No quote returned for symbol')
+
+    @staticmethod
+    def _error_entry(symbol, message):
+        return {'n': symbol, 's': 'error', 'errmsg': message}
+
+    @classmethod
+    async def _fetch(cls, symbols):
+        fyers = await FyersClientService.get_client()
+        if fyers is None:
+            return None
+
+        size = settings.FYERS_QUOTES_BATCH_SIZE
+        batches = [symbols[i:i + size] for i in range(0, len(symbols), size)]
+        responses = await asyncio.gather(*[cls._fetch_batch(fyers, batch) for batch in batches])
+
+        failures = [response for response in responses if response.get('s') != 'ok']
+        if len(failures) == len(responses):
+            # Nothing succeeded, report the upstream error as is
+            return failures[0]
+
+        # Merge the batches back in the order the symbols were requested
+        entries = []
+        for batch, response in zip(batches, responses):
+            if response.get('s') != 'ok':
+                message = response.get('message') or 'Quote request failed'
+                entries.extend(cls._error_entry(symbol, message) for symbol in batch)
+                continue
+
+            returned = {entry.get('n'): entry for entry in response.get('d', ())}
+            for symbol in batch:
+                entry = returned.get(symbol)
+                if entry is None:
+                    entry = cls._error_entry(symbol, 'No quote returned for symbol')
+                elif entry.get('s') == 'ok':
+                    quote_cache.put(symbol, entry)
+                entries.append(entry)
+
+        return {'s': 'ok', 'd': entries}
+
+    @classmethod
+    async def _fetch_batch(cls, fyers, symbols):
+        if cls._semaphore is None:
+            cls._semaphore = asyncio.Semaphore(settings.FYERS_QUOTES_MAX_CONCURRENCY)
+            cls._rate_limiter = RateLimiter(settings.FYERS_QUOTES_RATE_LIMIT)
+
+        data = {
+            "symbols": ",".join(symbols)
+        }
+        async with cls._semaphore:
+            await cls._rate_limiter.acquire()
+            logger.debug("Requesting quotes for %s", data["symbols"])
+            started = time.perf_counter()
+            try:
+                response = await fyers.quotes(data)
+            except Exception as e:
+                fyers_request_errors.labels('quotes').inc()
+                logger.warning(f"Quote batch failed: {e}")
+                return {'s': 'error', 'message': str(e)}
+            finally:
+                fyers_request_seconds.labels('quotes').observe(time.perf_counter() - started)
+            if response.get('s') != 'ok':
+                fyers_request_errors.labels('quotes').inc()
+            return response
+
+
+registry.collect('vtrade_quote_live_hits_total', 'Quote lookups answered from the live feed', 'counter',
+                 lambda: QuoteService.live_hits)
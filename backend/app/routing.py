@@ -1,6 +1,8 @@
 from django.urls import path
-from app.consumers import StockPriceConsumer
+from app.consumers import StockPriceConsumer, CandleConsumer, PortfolioConsumer
 
 websocket_urlpatterns = [
     path('ws/stocks/', StockPriceConsumer.as_asgi()),
+    path('ws/candles/', CandleConsumer.as_asgi()),
+    path('ws/portfolio/', PortfolioConsumer.as_asgi()),
 ]
@@ -0,0 +1,164 @@
+from django.conf import settings
+from rest_framework import serializers
+from .models import Watchlist, AlertRule, Portfolio, Position, PaperOrder, PaperFill
+from .symbols import symbol_master
+
+
+class WatchlistSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Watchlist
+        fields = ['id', 'name', 'symbols', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def validate_symbols(self, value):
+        """Store canonical symbols only, in the order given"""
+        if not isinstance(value, list) or not all(isinstance(sym, str) for sym in value):
+            raise serializers.ValidationError("symbols must be a list of strings")
+        symbols, invalid = symbol_master.resolve_all(value)
+        if invalid:
+            raise serializers.ValidationError(f"Unknown symbols: {', '.join(invalid)}")
+        if len(symbols) > settings.WATCHLIST_MAX_SYMBOLS:
+            raise serializers.ValidationError(
+                f"A watchlist holds at most {settings.WATCHLIST_MAX_SYMBOLS} symbols"
+            )
+        return symbols
+
+    def validate_name(self, value):
+        user = self.context['request'].user
+        others = Watchlist.objects.filter(user=user, name=value)
+        if self.instance is not None:
+            others = others.exclude(pk=self.instance.pk)
+        if others.exists():
+            raise serializers.ValidationError("You already have a watchlist with this name")
+        return value
+
+
+class AlertRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AlertRule
+        fields = ['id', 'symbol', 'kind', 'threshold', 'active', 'triggered_at', 'created_at']
+        read_only_fields = ['id', 'triggered_at', 'created_at']
+
+    def validate_symbol(self, value):
+        symbol = symbol_master.resolve(value)
+        if symbol is None:
+            raise serializers.ValidationError(f"Unknown symbol: {value}")
+        return symbol
+
+    def validate_threshold(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("threshold must be positive")
+        return value
+
+    def validate(self, attrs):
+        # Creating an active rule or reactivating one counts against the limit
+        was_active = self.instance is not None and self.instance.active
+        if attrs.get('active', True if self.instance is None else was_active) and not was_active:
+            user = self.context['request'].user
+            if user.alert_rules.filter(active=True).count() >= settings.ALERT_MAX_RULES_PER_USER:
+                raise serializers.ValidationError(
+                    f"At most {settings.ALERT_MAX_RULES_PER_USER} active alerts per user"
+                )
+            if self.instance is not None:
+                # A reactivated rule is armed again, so it has not fired yet
+                attrs['triggered_at'] = None
+        return attrs
+
+
+class PositionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Position
+        fields = ['id', 'symbol', 'quantity', 'avg_price', 'updated_at']
+        read_only_fields = ['id', 'updated_at']
+
+    def validate_symbol(self, value):
+        symbol = symbol_master.resolve(value)
+        if symbol is None:
+            raise serializers.ValidationError(f"Unknown symbol: {value}")
+        return symbol
+
+    def validate_quantity(self, value):
+        if value == 0:
+            raise serializers.ValidationError("quantity must not be zero")
+        return value
+
+    def validate_avg_price(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("avg_price must be positive")
+        return value
+
+    def validate(self, attrs):
+        portfolio = self.context['portfolio']
+        others = portfolio.positions.all()
+        if self.instance is not None:
+            others = others.exclude(pk=self.instance.pk)
+        if 'symbol' in attrs and others.filter(symbol=attrs['symbol']).exists():
+            raise serializers.ValidationError("The portfolio already holds this symbol")
+        if self.instance is None and others.count() >= settings.PORTFOLIO_MAX_POSITIONS:
+            raise serializers.ValidationError(
+                f"A portfolio holds at most {settings.PORTFOLIO_MAX_POSITIONS} positions"
+            )
+        return attrs
+
+
+class PortfolioSerializer(serializers.ModelSerializer):
+    positions = PositionSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Portfolio
+        fields = ['id', 'name', 'positions', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def validate_name(self, value):
+        user = self.context['request'].user
+        others = Portfolio.objects.filter(user=user, name=value)
+        if self.instance is not None:
+            others = others.exclude(pk=self.instance.pk)
+        if others.exists():
+            raise serializers.ValidationError("You already have a portfolio with this name")
+        return value
+
+
+class PaperOrderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaperOrder
+        fields = [
+            'id', 'symbol', 'side', 'order_type', 'quantity', 'limit_price', 'stop_price',
+            'status', 'filled_price', 'created_at', 'updated_at',
+        ]
+        read_only_fields = ['id', 'status', 'filled_price', 'created_at', 'updated_at']
+
+    def validate_symbol(self, value):
+        symbol = symbol_master.resolve(value)
+        if symbol is None:
+            raise serializers.ValidationError(f"Unknown symbol: {value}")
+        return symbol
+
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("quantity must be positive")
+        return value
+
+    def validate(self, attrs):
+        order_type = attrs['order_type']
+        needs_limit = order_type in (PaperOrder.LIMIT, PaperOrder.STOP_LIMIT)
+        needs_stop = order_type in (PaperOrder.STOP, PaperOrder.STOP_LIMIT)
+        for field, needed in (('limit_price', needs_limit), ('stop_price', needs_stop)):
+            price = attrs.get(field)
+            if needed and (price is None or price <= 0):
+                raise serializers.ValidationError({field: f"A positive {field} is required for {order_type} orders"})
+            if not needed and price is not None:
+                raise serializers.ValidationError({field: f"{order_type} orders do not take a {field}"})
+
+        user = self.context['request'].user
+        if user.paper_orders.filter(status__in=PaperOrder.WORKING).count() >= settings.PAPER_MAX_WORKING_ORDERS:
+            raise serializers.ValidationError(
+                f"At most {settings.PAPER_MAX_WORKING_ORDERS} working paper orders per user"
+            )
+        return attrs
+
+
+class PaperFillSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaperFill
+        fields = ['id', 'order', 'symbol', 'side', 'quantity', 'price', 'filled_at']
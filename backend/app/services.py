@@ -3,17 +3,120 @@ from django.utils import timezone
 from django.conf import settings
 import datetime
 import logging
+import time
 from fyers_apiv3 import fyersModel
 from .models import FyersToken
 from asgiref.sync import sync_to_async
+from .metrics import fyers_request_seconds, fyers_request_errors, token_refresh_seconds
 
 logger = logging.getLogger(__name__)
 
+# Treat cached tokens as expired this long before Fyers does
+TOKEN_EXPIRY_BUFFER = datetime.timedelta(minutes=5)
+# The background task refreshes the token this long before it expires
+TOKEN_REFRESH_AHEAD = datetime.timedelta(minutes=10)
+# Delay between attempts when a background refresh fails
+TOKEN_REFRESH_RETRY_SECONDS = 60
+
+async def timed_call(endpoint, func):
+    """Run a blocking Fyers call in a thread, recording its latency"""
+    started = time.perf_counter()
+    try:
+        response = await asyncio.to_thread(func)
+    except Exception:
+        fyers_request_errors.labels(endpoint).inc()
+        raise
+    finally:
+        fyers_request_seconds.labels(endpoint).observe(time.perf_counter() - started)
+    if not isinstance(response, dict) or response.get('s') != 'ok':
+        fyers_request_errors.labels(endpoint).inc()
+    return response
+
+
 class FyersTokenService:
     """
     Service for managing Fyers API tokens
+
+    The current token is cached in memory together with its expiry, so the
+    hot path does not touch the database. Loading or refreshing the token
+    happens under a single asyncio lock: concurrent callers wait for the one
+    refresh in flight and then read its result from the cache.
     """
 
+    _access_token = None
+    _refresh_token = None
+    _expires_at = None
+    _lock = None
+    _lock_loop = None
+    _refresh_task = None
+
+    @classmethod
+    def _cached_token(cls):
+        """Return the cached access token if it is still comfortably valid"""
+        if cls._access_token and cls._expires_at > timezone.now() + TOKEN_EXPIRY_BUFFER:
+            return cls._access_token
+        return None
+
+    @classmethod
+    def _cache_token(cls, token):
+        cls._access_token = token.access_token
+        cls._refresh_token = token.refresh_token
+        cls._expires_at = token.expires_at
+        cls._schedule_refresh()
+
+    @classmethod
+    def clear_cache(cls):
+        cls._access_token = None
+        cls._refresh_token = None
+        cls._expires_at = None
+        if cls._refresh_task:
+            cls._refresh_task.cancel()
+            cls._refresh_task = None
+
+    @classmethod
+    def _get_lock(cls):
+        # asyncio locks belong to one event loop
+        loop = asyncio.get_running_loop()
+        if cls._lock is None or cls._lock_loop is not loop:
+            cls._lock = asyncio.Lock()
+            cls._lock_loop = loop
+        return cls._lock
+
+    @classmethod
+    def _schedule_refresh(cls):
+        """Start the background task that refreshes the token before it expires"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Called from sync code; the next async caller will schedule it
+            return
+        if cls._refresh_task and not cls._refresh_task.done():
+            if cls._refresh_task.get_loop() is loop:
+                return
+            cls._refresh_task.cancel()
+        cls._refresh_task = loop.create_task(cls._refresh_ahead())
+
+    @classmethod
+    async def _refresh_ahead(cls):
+        while cls._expires_at:
+            delay = (cls._expires_at - TOKEN_REFRESH_AHEAD - timezone.now()).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            async with cls._get_lock():
+                # Someone else may have refreshed while we slept
+                if cls._expires_at - TOKEN_REFRESH_AHEAD > timezone.now():
+                    continue
+                if not cls._refresh_token:
+                    logger.warning("Token expires soon and there is no refresh token")
+                    return
+                refreshed = await cls.refresh_token(cls._refresh_token)
+
+            if not refreshed:
+                if cls._expires_at <= timezone.now():
+                    return
+                await asyncio.sleep(TOKEN_REFRESH_RETRY_SECONDS)
+
     @classmethod
     async def initialize_token(cls, auth_code):
         """
@@ -35,7 +138,7 @@ class FyersTokenService:
             session.set_token(auth_code)
 
             # Run blocking API call in a separate thread
-            response = await asyncio.to_thread(session.generate_token)
+            response = await timed_call('generate_token', session.generate_token)
 
             if response.get('s') == 'ok':
                 access_token = response.get('access_token')
@@ -52,6 +155,7 @@ class FyersTokenService:
                     expires_at=expires_at
                 )
 
+                cls._cache_token(token)
                 logger.info(f"Successfully initialized token, expires at {expires_at}")
                 return token.access_token
             else:
@@ -66,6 +170,7 @@ class FyersTokenService:
         """
         Refresh an access token asynchronously using a refresh token
         """
+        started = time.perf_counter()
         try:
             client_id = settings.FYERS_CLIENT_ID
 
@@ -75,7 +180,7 @@ class FyersTokenService:
             )
 
             # Run blocking API call in a separate thread
-            response = await asyncio.to_thread(session.refresh_token)
+            response = await timed_call('refresh_token', session.refresh_token)
 
             if response.get('s') == 'ok':
                 token_data = response.get('data', {})
@@ -93,6 +198,7 @@ class FyersTokenService:
                     expires_at=expires_at
                 )
 
+                cls._cache_token(token)
                 logger.info(f"Successfully refreshed token, expires at {expires_at}")
                 return token.access_token
             else:
@@ -101,6 +207,8 @@ class FyersTokenService:
         except Exception as e:
             logger.exception(f"Error refreshing token: {e}")
             return None
+        finally:
+            token_refresh_seconds.observe(time.perf_counter() - started)
 
     @classmethod
     async def get_access_token(cls):
@@ -108,20 +216,69 @@ class FyersTokenService:
         Get a valid access token, refreshing if necessary.
         This method is async-friendly.
         """
+        token = cls._cached_token()
+        if token:
+            return token
+
         try:
-            # Fetch the latest valid token asynchronously
-            token = await sync_to_async(FyersToken.get_valid_token, thread_sensitive=True)()
-            if token:
-                return token
-
-            # No valid token, try to refresh using the most recent refresh token
-            latest_token = await sync_to_async(lambda: FyersToken.objects.order_by('-created_at').first(), thread_sensitive=True)()
-            if latest_token and latest_token.refresh_token:
-                new_token = await cls.refresh_token(latest_token.refresh_token)
-                if new_token:
-                    return new_token
+            async with cls._get_lock():
+                # Another caller may have loaded the token while we waited
+                token = cls._cached_token()
+                if token:
+                    return token
+
+                # Fetch the latest valid token asynchronously
+                valid_token = await sync_to_async(FyersToken.get_valid, thread_sensitive=True)()
+                if valid_token:
+                    cls._cache_token(valid_token)
+                    return valid_token.access_token
+
+                # No valid token, try to refresh using the most recent refresh token
+                latest_token = await sync_to_async(lambda: FyersToken.objects.order_by('-created_at').first(), thread_sensitive=True)()
+                if latest_token and latest_token.refresh_token:
+                    new_token = await cls.refresh_token(latest_token.refresh_token)
+                    if new_token:
+                        return new_token
         except Exception as e:
             logger.exception(f"Error in get_access_token: {e}")
 
         logger.error("No valid token available and refresh failed")
-        return None
\ No newline at end of file
+        return None
+
+
+class FyersClientService:
+    """
+    Hands out one long-lived async FyersModel per access token.
+
+    FyersModel opens its log files and, in async mode, an aiohttp session
+    that is reused for every call, so building one per request throws away
+    the connection pool. The client is replaced when the token changes.
+    """
+
+    _client = None
+    _client_token = None
+
+    @classmethod
+    async def get_client(cls):
+        """
+        Get the shared client for the current token, or None without a token
+        """
+        access_token = await FyersTokenService.get_access_token()
+        if not access_token:
+            return None
+
+        if cls._client is None or cls._client_token != access_token:
+            stale = cls._client
+            cls._client = fyersModel.FyersModel(
+                client_id=settings.FYERS_CLIENT_ID,
+                is_async=True,
+                token=access_token
+            )
+            cls._client_token = access_token
+            if stale is not None:
+                try:
+                    await stale.close()
+                except Exception as e:
+                    logger.warning(f"Error closing stale Fyers client: {e}")
+
+        return cls._client
@@ -0,0 +1,263 @@
+"""
+Upstream tick sources for the market data hub.
+
+A feed source has the surface of fyers_apiv3's FyersDataSocket that the hub
+uses: it is built with on_connect / on_close / on_error / on_message
+callbacks, which it calls from its own thread, and offers connect(),
+subscribe(symbols, data_type), unsubscribe(symbols, data_type) and
+close_connection(). FEED_SOURCE picks the implementation.
+
+The hub reconnects a source that closes unexpectedly, with a new instance.
+A source that ends on its own (a replay without loop) sets `finished`
+before calling on_close and is left closed.
+
+Recorded tick files are gzip-compressed, one JSON array per line:
+[received_at_ms, tick].
+"""
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from fyers_apiv3.FyersWebsocket import data_ws
+
+logger = logging.getLogger(__name__)
+
+# Tick fields holding exchange epoch seconds, shifted when replaying as live
+TIME_FIELDS = ('exch_feed_time', 'last_traded_time')
+
+
+def fyers_source(access_token, **callbacks):
+    return data_ws.FyersDataSocket(
+        access_token=access_token,
+        log_path="",
+        litemode=False,
+        write_to_file=False,
+        # The hub supervises reconnects, restoring subscriptions and gaps
+        reconnect=False,
+        **callbacks
+    )
+
+
+class ReplayFeedSource:
+    """
+    Plays a recorded tick file back through the feed callbacks.
+
+    speed is a multiple of the recorded pace; 0 replays as fast as the
+    consumer keeps up. Only subscribed symbols are delivered, as with the
+    live socket, with depth ('dp') messages only for symbols subscribed as
+    DepthUpdate. With retime, exchange timestamps are shifted so the
+    recording looks like it is happening now. With loop, the file starts
+    over at the end; otherwise on_close is called when it runs out.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, retime=True,
+                 on_connect=None, on_close=None, on_error=None, on_message=None):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.retime = retime
+        self.on_connect = on_connect
+        self.on_close = on_close
+        self.on_error = on_error
+        self.on_message = on_message
+        self.replayed = 0
+        self.finished = False
+        self._symbols = set()
+        self._depth_symbols = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def connect(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='feed-replay', daemon=True)
+        self._thread.start()
+
+    def subscribe(self, symbols, data_type='SymbolUpdate', channel=11):
+        (self._depth_symbols if data_type == 'DepthUpdate' else self._symbols).update(symbols)
+
+    def unsubscribe(self, symbols, data_type='SymbolUpdate', channel=11):
+        (self._depth_symbols if data_type == 'DepthUpdate' else self._symbols).difference_update(symbols)
+
+    def close_connection(self):
+        self._stop.set()
+
+    def _run(self):
+        if self.on_connect:
+            self.on_connect()
+        try:
+            while not self._stop.is_set():
+                self._play_once()
+                if not self.loop:
+                    break
+        except Exception as e:
+            logger.exception(f"Replay of {self.path} failed: {e}")
+            if self.on_error:
+                self.on_error(str(e))
+        self.finished = not self._stop.is_set()
+        if self.on_close:
+            self.on_close({'code': 0, 'message': f'Replay of {self.path} finished'})
+
+    def _play_once(self):
+        started = time.time()
+        first = None
+        with gzip.open(self.path, 'rt') as f:
+            for line in f:
+                if self._stop.is_set():
+                    return
+                received_ms, message = json.loads(line)
+                if first is None:
+                    first = received_ms / 1000.0
+                offset = received_ms / 1000.0 - first
+
+                if self.speed > 0:
+                    delay = started + offset / self.speed - time.time()
+                    if delay > 0 and self._stop.wait(delay):
+                        return
+
+                wanted = self._depth_symbols if message.get('type') == 'dp' else self._symbols
+                if message.get('symbol') not in wanted:
+                    continue
+                if self.retime:
+                    # Exchange time moves by however long ago it was received
+                    shift = int(time.time() - received_ms / 1000.0)
+                    for field in TIME_FIELDS:
+                        if message.get(field):
+                            message[field] += shift
+                self.replayed += 1
+                self.on_message(message)
+
+
+class SyntheticFeedSource:
+    """
+    Generates random-walk SymbolUpdate ticks for the subscribed symbols at a
+    fixed total rate, for load tests. Every tick carries 'feed_ts', the
+    wall-clock time it was produced, so clients can measure delivery latency.
+    """
+
+    def __init__(self, rate=1000, on_connect=None, on_close=None, on_error=None, on_message=None):
+        self.rate = rate
+        self.on_connect = on_connect
+        self.on_close = on_close
+        self.on_error = on_error
+        self.on_message = on_message
+        self.generated = 0
+        self._symbols = []
+        self._prices = {}
+        self._volumes = {}
+        self._stop = threading.Event()
+
+    def connect(self):
+        self._stop.clear()
+        threading.Thread(target=self._run, name='feed-synthetic', daemon=True).start()
+
+    def subscribe(self, symbols, data_type='SymbolUpdate', channel=11):
+        # Only quotes are generated; depth subscriptions are accepted and ignored
+        if data_type != 'SymbolUpdate':
+            return
+        for symbol in symbols:
+            if symbol not in self._prices:
+                self._prices[symbol] = 100.0 + len(self._prices) % 1000
+                self._volumes[symbol] = 0
+        self._symbols = list(self._prices)
+
+    def unsubscribe(self, symbols, data_type='SymbolUpdate', channel=11):
+        if data_type != 'SymbolUpdate':
+            return
+        for symbol in symbols:
+            self._prices.pop(symbol, None)
+            self._volumes.pop(symbol, None)
+        self._symbols = list(self._prices)
+
+    def close_connection(self):
+        self._stop.set()
+
+    def _run(self):
+        if self.on_connect:
+            self.on_connect()
+        rng = random.Random(0)
+        started = time.time()
+        sent = 0
+        # Emit in small bursts to hold the average rate without a sleep per tick
+        while not self._stop.wait(0.005):
+            due = int((time.time() - started) * self.rate) - sent
+            symbols = self._symbols
+            if not symbols:
+                sent += due
+                continue
+            for i in range(due):
+                symbol = symbols[(sent + i) % len(symbols)]
+                price = self._prices.get(symbol)
+                if price is None:
+                    continue
+                price = round(price * (1 + rng.gauss(0, 0.0005)), 2)
+                self._prices[symbol] = price
+                self._volumes[symbol] = volume = self._volumes.get(symbol, 0) + rng.randint(1, 500)
+                now = time.time()
+                self.on_message({
+                    'symbol': symbol,
+                    'type': 'sf',
+                    'ltp': price,
+                    'vol_traded_today': volume,
+                    'last_traded_qty': 1,
+                    'exch_feed_time': int(now),
+                    'feed_ts': now,
+                })
+            sent += due
+            self.generated = sent
+        if self.on_close:
+            self.on_close({'code': 0, 'message': 'Synthetic feed stopped'})
+
+
+def synthetic_source(access_token=None, **callbacks):
+    return SyntheticFeedSource(rate=settings.FEED_SYNTHETIC_RATE, **callbacks)
+
+
+def replay_source(access_token=None, **callbacks):
+    return ReplayFeedSource(
+        settings.FEED_REPLAY_FILE,
+        speed=settings.FEED_REPLAY_SPEED,
+        loop=settings.FEED_REPLAY_LOOP,
+        **callbacks
+    )
+
+
+# name -> (factory(access_token, **callbacks), needs a Fyers access token)
+FEED_SOURCES = {
+    'fyers': (fyers_source, True),
+    'replay': (replay_source, False),
+    'synthetic': (synthetic_source, False),
+}
+
+
+class TickRecorder:
+    """
+    Appends every tick it is given to a recorded tick file.
+
+    write() is called on the feed thread; lines are compressed as they are
+    written, and concatenated gzip members from separate runs read back as
+    one file.
+    """
+
+    def __init__(self, path):
+        self.path = time.strftime(path)
+        self.recorded = 0
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = gzip.open(self.path, 'at', compresslevel=6)
+        self._lock = threading.Lock()
+
+    def write(self, message):
+        line = json.dumps([int(time.time() * 1000), message], separators=(',', ':'))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+                self.recorded += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
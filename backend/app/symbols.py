@@ -0,0 +1,196 @@
+"""
+In-memory symbol master built from Fyers symbol-master CSV files
+(e.g. https://public.fyers.in/sym_details/NSE_CM.csv).
+"""
+import bisect
+import csv
+import logging
+import threading
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Column positions in the Fyers symbol-master CSV, which has no header row
+FYTOKEN, NAME, ISIN, SYMBOL, EXCHANGE_TOKEN, UNDERLYING = 0, 1, 5, 9, 12, 13
+
+# Shorter queries match too much of the master to be worth a substring scan
+MIN_SUBSTRING_QUERY = 2
+
+
+def default_symbol(sym):
+    """Fyers symbol for a bare ticker when no symbol master is loaded"""
+    if ':' not in sym:
+        sym = f"NSE:{sym}-EQ"
+    return sym
+
+
+def joined(index):
+    """
+    The keys of a sorted (key, position) list joined by newlines, with the
+    offset where each key starts and a final offset past the end
+    """
+    offsets = [0]
+    for key, _ in index:
+        offsets.append(offsets[-1] + len(key) + 1)
+    return '\n'.join(key for key, _ in index) + '\n', offsets
+
+
+class SymbolMaster:
+    """
+    Index of every tradable symbol.
+
+    Records live in parallel lists indexed by position. Autocomplete runs a
+    binary search over two sorted key lists, one of tickers and one of the
+    words of instrument names, so a prefix query costs O(log n + limit).
+    When prefixes find fewer than `limit` records, a substring scan over
+    the same keys, joined into one string per list, fills up the rest.
+    A dict maps each canonical symbol, ticker, ISIN, Fyers token and
+    exchange token to the record position for validation.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.loaded = False
+        self._attempted = False
+        self.symbols = []
+        self.names = []
+        self.isins = []
+        self.tokens = []
+        self._lookup = {}
+        self._tickers = []  # sorted (ticker, position)
+        self._words = []  # sorted (name word, position)
+        self._ticker_text = ('', [0])  # keys joined by newlines, offset of each key
+        self._word_text = ('', [0])
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self):
+        """Load the files on first use; a missing file is not retried"""
+        if not self._attempted:
+            with self._lock:
+                if not self._attempted:
+                    self.load()
+                    self._attempted = True
+        return self.loaded
+
+    def load(self):
+        symbols, names, isins, tokens, lookup, tickers, words = [], [], [], [], {}, [], []
+        for path in self.paths:
+            try:
+                with open(path, newline='', encoding='utf-8') as f:
+                    rows = list(csv.reader(f))
+            except OSError as e:
+                logger.warning(f"Symbol master {path} not loaded: {e}")
+                continue
+
+            for row in rows:
+                if len(row) <= UNDERLYING or ':' not in row[SYMBOL]:
+                    continue
+                i = len(symbols)
+                symbol = row[SYMBOL].strip()
+                exchange = symbol.split(':', 1)[0]
+                ticker = row[UNDERLYING].strip().upper()
+                symbols.append(symbol)
+                names.append(row[NAME].strip())
+                isins.append(row[ISIN].strip())
+                tokens.append(row[FYTOKEN].strip())
+
+                lookup[symbol.upper()] = i
+                lookup.setdefault(row[FYTOKEN].strip(), i)
+                lookup.setdefault(f'{exchange}:{row[EXCHANGE_TOKEN].strip()}', i)
+                # A bare ticker or ISIN means the NSE cash equity when there is one
+                preferred = symbol.startswith('NSE:') and symbol.endswith('-EQ')
+                for key in (ticker, row[ISIN].strip().upper()):
+                    if key and (preferred or key not in lookup):
+                        lookup[key] = i
+
+                tickers.append((ticker, i))
+                for word in names[i].upper().split():
+                    words.append((word, i))
+
+        tickers.sort()
+        words.sort()
+        self.symbols, self.names, self.isins, self.tokens = symbols, names, isins, tokens
+        self._lookup, self._tickers, self._words = lookup, tickers, words
+        self._ticker_text, self._word_text = joined(tickers), joined(words)
+        self.loaded = bool(symbols)
+        if self.loaded:
+            logger.info(f"Symbol master loaded with {len(symbols)} symbols")
+
+    def resolve(self, text):
+        """
+        Canonical Fyers symbol for a symbol, bare ticker, ISIN or token, or
+        None if it is unknown. Without a symbol master every input is
+        accepted as before.
+        """
+        text = text.strip()
+        if not self.ensure_loaded():
+            return default_symbol(text)
+        i = self._lookup.get(text.upper())
+        return self.symbols[i] if i is not None else None
+
+    def resolve_all(self, symbols):
+        """Returns (canonical symbols, unknown inputs)"""
+        resolved, invalid = [], []
+        for text in symbols:
+            symbol = self.resolve(text)
+            if symbol is None:
+                invalid.append(text)
+            elif symbol not in resolved:
+                resolved.append(symbol)
+        return resolved, invalid
+
+    def _prefix(self, index, prefix, seen, out, limit):
+        pos = bisect.bisect_left(index, (prefix,))
+        while pos < len(index) and len(out) < limit:
+            key, i = index[pos]
+            if not key.startswith(prefix):
+                break
+            if i not in seen:
+                seen.add(i)
+                out.append(i)
+            pos += 1
+
+    def _substring(self, index, joined_keys, query, seen, out, limit):
+        text, offsets = joined_keys
+        pos = text.find(query)
+        while pos != -1 and len(out) < limit:
+            row = bisect.bisect_right(offsets, pos) - 1
+            i = index[row][1]
+            if i not in seen:
+                seen.add(i)
+                out.append(i)
+            pos = text.find(query, offsets[row + 1])
+
+    def search(self, query, limit=10):
+        """
+        Ticker prefix matches first, then matches on words of the name, then
+        tickers and name words that contain the query
+        """
+        if not self.ensure_loaded():
+            return []
+        query = query.strip().upper()
+        if not query:
+            return []
+
+        seen, out = set(), []
+        exact = self._lookup.get(query)
+        if exact is not None:
+            seen.add(exact)
+            out.append(exact)
+        self._prefix(self._tickers, query, seen, out, limit)
+        self._prefix(self._words, query, seen, out, limit)
+        if len(query) >= MIN_SUBSTRING_QUERY and '\n' not in query:
+            self._substring(self._tickers, self._ticker_text, query, seen, out, limit)
+            self._substring(self._words, self._word_text, query, seen, out, limit)
+        return [self.describe(i) for i in out[:limit]]
+
+    def describe(self, i):
+        return {
+            'symbol': self.symbols[i],
+            'name': self.names[i],
+            'isin': self.isins[i],
+            'token': self.tokens[i],
+        }
+
+
+symbol_master = SymbolMaster(settings.SYMBOL_MASTER_FILES)
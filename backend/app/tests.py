@@ -1,3 +1,1442 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import datetime
+import json
+import math
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .alerts import AlertEngine
+from .archive import ArchiveWriter, CandleArchive, CANDLE_DTYPE
+from .bridge import TickBridge, DROP_OLDEST, DROP_NEWEST, BLOCK
+from .candles import CandleAggregator
+from .cluster import FeedDemand
+from .conflation import TickConflator, DepthConflator
+from .consumers import StockPriceConsumer
+from .depth import DepthBooks, levels, ALL_SLOTS, LEVELS
+from .feed import DEFAULT_DATA_TYPE, MarketDataHub, market_data_hub
+from .indicators import INDICATORS, parse_params, IndicatorEngine, load_candles, warmup_candles
+from .ingest import TickIngestor
+from .lastvalue import last_values, LastValueTable
+from .metrics import Registry
+from .models import AlertRule, Candle, FeedLease, FyersToken, PaperOrder, Tick, Watchlist
+from .paper import PaperExchange, BUY, SELL, MARKET, LIMIT, STOP, STOP_LIMIT, OPEN, TRIGGERED, FILLED, CANCELLED
+from .portfolio import PortfolioEngine
+from .quotes import QuoteService, QuoteCache, quote_cache
+from .services import FyersTokenService, TOKEN_REFRESH_AHEAD, FyersClientService
+from .sources import ReplayFeedSource, TickRecorder
+from .symbols import SymbolMaster
+from .wire import DeltaEncoder
 
-# Create your tests here.
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FyersTokenServiceTests(TransactionTestCase):
+
+    def setUp(self):
+        FyersTokenService.clear_cache()
+        self.addCleanup(FyersTokenService.clear_cache)
+        self.refreshed = []
+        patcher = mock.patch.object(FyersTokenService, 'refresh_token', self.fake_refresh)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def fake_refresh(self, refresh_token):
+        self.refreshed.append(refresh_token)
+        await asyncio.sleep(0.01)
+        FyersTokenService._cache_token(SimpleNamespace(
+            access_token=f'access-{len(self.refreshed)}',
+            refresh_token=refresh_token,
+            expires_at=timezone.now() + datetime.timedelta(hours=24),
+        ))
+        return FyersTokenService._access_token
+
+    def test_cached_token_skips_the_database(self):
+        FyersTokenService._cache_token(SimpleNamespace(
+            access_token='cached', refresh_token='refresh-0',
+            expires_at=timezone.now() + datetime.timedelta(hours=1),
+        ))
+        with mock.patch.object(FyersToken, 'get_valid') as get_valid:
+            self.assertEqual(run(FyersTokenService.get_access_token()), 'cached')
+        get_valid.assert_not_called()
+
+    def test_concurrent_callers_share_one_refresh(self):
+        FyersToken.objects.create(access_token='expired', refresh_token='refresh-1',
+                                  expires_at=timezone.now() - datetime.timedelta(hours=1))
+
+        async def scenario():
+            return await asyncio.gather(*[FyersTokenService.get_access_token() for _ in range(5)])
+
+        self.assertEqual(run(scenario()), ['access-1'] * 5)
+        self.assertEqual(self.refreshed, ['refresh-1'])
+
+    def test_token_is_refreshed_ahead_of_expiry(self):
+        async def scenario():
+            FyersTokenService._cache_token(SimpleNamespace(
+                access_token='access-0', refresh_token='refresh-0',
+                expires_at=timezone.now() + TOKEN_REFRESH_AHEAD + datetime.timedelta(milliseconds=50),
+            ))
+            # Still comfortably valid, so callers get it from the cache
+            self.assertEqual(await FyersTokenService.get_access_token(), 'access-0')
+            self.assertEqual(self.refreshed, [])
+            await asyncio.sleep(0.2)
+            return await FyersTokenService.get_access_token()
+
+        self.assertEqual(run(scenario()), 'access-1')
+        self.assertEqual(self.refreshed, ['refresh-0'])
+
+
+class FakeQuotesClient:
+    """Stands in for the Fyers client; fails the symbols in `failing`"""
+
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+        self.release = None
+
+    async def quotes(self, data):
+        symbols = data['symbols'].split(',')
+        self.calls.append(symbols)
+        if self.release is not None:
+            await self.release.wait()
+        if self.failing.intersection(symbols):
+            return {'s': 'error', 'message': 'upstream down'}
+        return {'s': 'ok', 'd': [{'n': symbol, 's': 'ok', 'v': {'lp': 100.0}} for symbol in symbols]}
+
+
+class QuoteCoalescingTests(SimpleTestCase):
+
+    def setUp(self):
+        QuoteService._inflight = {}
+        self.client = FakeQuotesClient()
+        patcher = mock.patch.object(FyersClientService, 'get_client', mock.AsyncMock(return_value=self.client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent_requests_share_one_fetch(self):
+        async def scenario():
+            self.client.release = asyncio.Event()
+            first = asyncio.ensure_future(QuoteService.get_quotes(['QC:A', 'QC:B']))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(QuoteService.get_quotes(['QC:B', 'QC:A']))
+            await asyncio.sleep(0.01)
+            self.client.release.set()
+            return await first, await second
+
+        first, second = run(scenario())
+        self.assertEqual(self.client.calls, [['QC:A', 'QC:B']])
+        self.assertEqual((first['s'], second['s']), ('ok', 'ok'))
+        self.assertEqual(QuoteService._inflight, {})
+
+    def test_cancelled_caller_does_not_cancel_the_shared_fetch(self):
+        async def scenario():
+            self.client.release = asyncio.Event()
+            first = asyncio.ensure_future(QuoteService.get_quotes(['QC:C']))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(QuoteService.get_quotes(['QC:C']))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            self.client.release.set()
+            return await second
+
+        response = run(scenario())
+        self.assertEqual(self.client.calls, [['QC:C']])
+        self.assertEqual(response['s'], 'ok')
+
+
+class QuoteCacheTests(SimpleTestCase):
+
+    def test_entries_expire(self):
+        cache = QuoteCache(ttl_ms=1000, max_size=10)
+        with mock.patch('app.quotes.time.monotonic', return_value=100.0):
+            cache.put('NSE:SBIN-EQ', {'n': 'NSE:SBIN-EQ'})
+        with mock.patch('app.quotes.time.monotonic', return_value=100.5):
+            self.assertEqual(cache.get('NSE:SBIN-EQ'), {'n': 'NSE:SBIN-EQ'})
+        with mock.patch('app.quotes.time.monotonic', return_value=101.0):
+            self.assertIsNone(cache.get('NSE:SBIN-EQ'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # Expired entries can still be peeked at
+        self.assertEqual(cache.peek('NSE:SBIN-EQ'), {'n': 'NSE:SBIN-EQ'})
+
+    def test_least_recently_used_is_evicted(self):
+        cache = QuoteCache(ttl_ms=60000, max_size=2)
+        cache.put('A', 1)
+        cache.put('B', 2)
+        cache.get('A')
+        cache.put('C', 3)
+        self.assertIsNone(cache.peek('B'))
+        self.assertEqual(cache.get('A'), 1)
+        self.assertEqual(cache.get('C'), 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+
+
+class QuoteServiceCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        quote_cache.clear()
+        QuoteService._inflight = {}
+        self.client = FakeQuotesClient()
+        patcher = mock.patch.object(FyersClientService, 'get_client', mock.AsyncMock(return_value=self.client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(quote_cache.clear)
+
+    def test_only_missing_symbols_go_upstream(self):
+        quote_cache.put('QS:A', {'n': 'QS:A', 's': 'ok', 'v': {'lp': 1.0}})
+        response = run(QuoteService.get_quotes(['QS:B', 'QS:A']))
+        self.assertEqual(self.client.calls, [['QS:B']])
+        self.assertEqual([entry['n'] for entry in response['d']], ['QS:B', 'QS:A'])
+        self.assertEqual(response['d'][1]['v'], {'lp': 1.0})
+        # The fetched quote is served from memory next time
+        run(QuoteService.get_quotes(['QS:B']))
+        self.assertEqual(self.client.calls, [['QS:B']])
+
+    def test_failed_fetch_keeps_cache_hits(self):
+        self.client.failing = {'QS:B'}
+        quote_cache.put('QS:A', {'n': 'QS:A', 's': 'ok', 'v': {'lp': 1.0}})
+        response = run(QuoteService.get_quotes(['QS:A', 'QS:B']))
+        self.assertEqual(response['s'], 'ok')
+        self.assertEqual(response['d'][0]['s'], 'ok')
+        self.assertEqual(response['d'][1], {'n': 'QS:B', 's': 'error', 'errmsg': 'upstream down'})
+
+
+@override_settings(FYERS_QUOTES_BATCH_SIZE=2, FYERS_QUOTES_MAX_CONCURRENCY=4, FYERS_QUOTES_RATE_LIMIT=1000)
+class QuoteBatchingTests(SimpleTestCase):
+
+    def setUp(self):
+        quote_cache.clear()
+        QuoteService._inflight = {}
+        QuoteService._semaphore = None
+        QuoteService._rate_limiter = None
+        self.client = FakeQuotesClient()
+        patcher = mock.patch.object(FyersClientService, 'get_client', mock.AsyncMock(return_value=self.client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(quote_cache.clear)
+
+    def test_batches_keep_the_requested_order(self):
+        symbols = ['QB:E', 'QB:A', 'QB:D', 'QB:B', 'QB:C']
+        response = run(QuoteService.get_quotes(symbols))
+        self.assertEqual(response['s'], 'ok')
+        self.assertEqual([entry['n'] for entry in response['d']], symbols)
+        self.assertEqual(sorted(self.client.calls), [['QB:C'], ['QB:D', 'QB:B'], ['QB:E', 'QB:A']])
+
+    def test_failed_batch_only_marks_its_symbols(self):
+        self.client.failing = {'QB:C'}
+        response = run(QuoteService.get_quotes(['QB:A', 'QB:B', 'QB:C']))
+        self.assertEqual([entry['s'] for entry in response['d']], ['ok', 'ok', 'error'])
+        self.assertEqual(response['d'][2]['errmsg'], 'upstream down')
+        self.assertIsNotNone(quote_cache.peek('QB:A'))
+        self.assertIsNone(quote_cache.peek('QB:C'))
+
+    def test_everything_failing_returns_the_upstream_error(self):
+        self.client.failing = {'QB:A', 'QB:C'}
+        response = run(QuoteService.get_quotes(['QB:A', 'QB:B', 'QB:C']))
+        self.assertEqual(response, {'s': 'error', 'message': 'upstream down'})
+
+
+class TickConflatorTests(SimpleTestCase):
+
+    def tick(self, symbol, ltp):
+        return {'symbol': symbol, 'ltp': ltp}
+
+    def test_latest_tick_wins(self):
+        conflator = TickConflator(interval_ms=100, max_pending=10)
+        conflator.add('A', self.tick('A', 1))
+        conflator.add('B', self.tick('B', 1))
+        conflator.add('A', self.tick('A', 2))
+        # A moved behind B when it was replaced
+        self.assertEqual(conflator.drain(), [self.tick('B', 1), self.tick('A', 2)])
+        self.assertEqual(conflator.conflated, 1)
+        self.assertEqual(len(conflator), 0)
+
+    def test_full_conflator_drops_the_stalest_symbol(self):
+        conflator = TickConflator(interval_ms=100, max_pending=2)
+        for symbol in ('A', 'B', 'C'):
+            conflator.add(symbol, self.tick(symbol, 1))
+        self.assertEqual([tick['symbol'] for tick in conflator.drain()], ['B', 'C'])
+        self.assertEqual(conflator.dropped, 1)
+
+    def test_empty_drain_is_not_a_frame(self):
+        conflator = TickConflator(interval_ms=100, max_pending=10)
+        self.assertEqual(conflator.drain(), [])
+        conflator.add('A', self.tick('A', 1))
+        conflator.drain()
+        stats = conflator.stats()
+        self.assertEqual((stats['frames'], stats['flushed'], stats['pending']), (1, 1, 0))
+
+    def test_run_sends_one_batch_per_interval(self):
+        sent = []
+
+        async def send_batch(batch):
+            sent.append(batch)
+
+        async def scenario():
+            conflator = TickConflator(interval_ms=20, max_pending=10)
+            task = asyncio.ensure_future(conflator.run(send_batch))
+            for ltp in range(5):
+                conflator.add('A', self.tick('A', ltp))
+            conflator.add('B', self.tick('B', 1))
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        run(scenario())
+        self.assertEqual(sent, [[self.tick('A', 4), self.tick('B', 1)]])
+
+
+def decode(frames):
+    """Rebuild full ticks from 's'/'d' frames, as a client would"""
+    field_names = {}
+    symbols = {}
+    ticks = []
+    for frame in frames:
+        kind = frame[0]
+        if kind in ('h', 'f'):
+            fields = frame[2] if kind == 'h' else frame[1]
+            field_names.update({fid: name for name, fid in fields.items()})
+            continue
+        if kind == 's':
+            _, sid, symbol, _, flat = frame
+            symbols[sid] = {'symbol': symbol}
+        else:
+            _, sid, _, flat = frame
+        tick = symbols[sid]
+        for i in range(0, len(flat), 2):
+            tick[field_names[flat[i]]] = flat[i + 1]
+        ticks.append(dict(tick))
+    return ticks
+
+
+class DeltaEncoderTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        encoder = DeltaEncoder()
+        ticks = [
+            {'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0, 'vol_traded_today': 10, 'chp': 0.1},
+            {'symbol': 'NSE:INFY-EQ', 'ltp': 1500.0, 'vol_traded_today': 5},
+            {'symbol': 'NSE:SBIN-EQ', 'ltp': 801.0, 'vol_traded_today': 10, 'chp': 0.2},
+            {'symbol': 'NSE:SBIN-EQ', 'ltp': 801.0, 'vol_traded_today': 12, 'chp': 0.2, 'oi': 3},
+        ]
+        frames = [encoder.header()]
+        for tick in ticks:
+            frame = encoder.encode(tick, ts=1)
+            new_fields = encoder.take_new_fields()
+            if new_fields:
+                frames.append(new_fields)
+            frames.append(frame)
+        self.assertEqual([frame[0] for frame in frames], ['h', 's', 's', 'd', 'f', 'd'])
+        self.assertEqual(frames[3][3], [encoder.field_ids['ltp'], 801.0, encoder.field_ids['chp'], 0.2])
+        self.assertEqual(decode(frames), ticks)
+
+    def test_unchanged_tick_is_skipped(self):
+        encoder = DeltaEncoder()
+        tick = {'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0}
+        encoder.encode(tick)
+        self.assertIsNone(encoder.encode(dict(tick)))
+
+    def test_forget_sends_a_new_snapshot(self):
+        encoder = DeltaEncoder()
+        tick = {'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0}
+        encoder.encode(tick)
+        encoder.forget(['NSE:SBIN-EQ'])
+        frame = encoder.encode(dict(tick))
+        self.assertEqual(frame[0], 's')
+        self.assertEqual(frame[1], 1)
+
+
+class TickBridgeTests(SimpleTestCase):
+
+    def bridge(self, policy, maxsize=3):
+        async def handler(batch):
+            pass
+        return TickBridge(handler, maxsize=maxsize, policy=policy)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.bridge('drop-all')
+
+    def test_drop_oldest(self):
+        bridge = self.bridge(DROP_OLDEST)
+        results = [bridge.put(i) for i in range(5)]
+        self.assertEqual(results, [True] * 5)
+        self.assertEqual(list(bridge._queue), [2, 3, 4])
+        self.assertEqual(bridge.stats()['dropped'], 2)
+        self.assertEqual(bridge.stats()['high_water'], 3)
+
+    def test_drop_newest(self):
+        bridge = self.bridge(DROP_NEWEST)
+        results = [bridge.put(i) for i in range(5)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.assertEqual(list(bridge._queue), [0, 1, 2])
+        self.assertEqual(bridge.dropped, 2)
+        self.assertEqual(bridge.enqueued, 3)
+
+    def test_block_waits_for_room(self):
+        received = []
+
+        async def scenario():
+            async def handler(batch):
+                received.extend(batch)
+
+            bridge = TickBridge(handler, maxsize=2, policy=BLOCK, batch_size=1)
+            bridge.put(0)
+            bridge.put(1)
+            producer = threading.Thread(target=lambda: [bridge.put(i) for i in range(2, 6)])
+            producer.start()
+            # The producer is stuck on a full queue until the drainer runs
+            await asyncio.sleep(0.05)
+            self.assertEqual(len(bridge), 2)
+            bridge.start()
+            for _ in range(100):
+                if len(received) == 6:
+                    break
+                await asyncio.sleep(0.01)
+            await asyncio.to_thread(producer.join, 1)
+            bridge.stop()
+            return bridge
+
+        bridge = run(scenario())
+        self.assertEqual(received, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(bridge.dropped, 0)
+        self.assertLessEqual(bridge.high_water, 2)
+
+    def test_put_after_stop(self):
+        bridge = self.bridge(DROP_OLDEST)
+        bridge.stop()
+        self.assertFalse(bridge.put(0))
+        self.assertEqual(len(bridge), 0)
+
+
+class BulkIngestorTests(TransactionTestCase):
+
+    def tick(self, i):
+        return {'symbol': 'NSE:SBIN-EQ', 'ltp': 100.0 + i, 'vol_traded_today': i, 'exch_feed_time': time.time()}
+
+    def test_stop_writes_the_buffer(self):
+        ingestor = TickIngestor(batch_size=2, flush_interval=60)
+
+        async def scenario():
+            ingestor.start()
+            for i in range(5):
+                ingestor.add(self.tick(i))
+            await ingestor.stop()
+
+        run(scenario())
+        self.assertEqual(len(ingestor), 0)
+        self.assertEqual(ingestor.stats()['written'], 5)
+        self.assertEqual(Tick.objects.count(), 5)
+        self.assertEqual(sorted(Tick.objects.values_list('ltp', flat=True)), [100.0, 101.0, 102.0, 103.0, 104.0])
+
+    def test_rows_without_a_price_or_time_are_skipped(self):
+        ingestor = TickIngestor()
+        ingestor.add({'symbol': 'NSE:SBIN-EQ', 'ltp': None, 'exch_feed_time': time.time()})
+        ingestor.add({'symbol': 'NSE:SBIN-EQ', 'ltp': 1.0})
+        run(ingestor.stop())
+        self.assertEqual(Tick.objects.count(), 0)
+
+    def test_buffer_drops_the_oldest_rows(self):
+        ingestor = TickIngestor(max_buffer=3)
+        for i in range(5):
+            ingestor.add(self.tick(i))
+        self.assertEqual(ingestor.dropped, 2)
+        self.assertEqual([row[1] for row in ingestor._buffer], [102.0, 103.0, 104.0])
+        run(ingestor.stop())
+        self.assertEqual(Tick.objects.count(), 3)
+        self.assertIsInstance(Tick.objects.first().exchange_time, datetime.datetime)
+
+    def test_writes_close_stale_connections(self):
+        ingestor = TickIngestor()
+        ingestor.add(self.tick(0))
+        with mock.patch('app.ingest.close_old_connections') as close_old_connections:
+            run(ingestor.stop())
+        close_old_connections.assert_called_once_with()
+        self.assertEqual((ingestor.written, ingestor.failed), (1, 0))
+        self.assertEqual(Tick.objects.count(), 1)
+
+
+class CandleAggregatorTests(SimpleTestCase):
+
+    START = 1704099600  # 2024-01-01 09:00:00 UTC, on an hour boundary
+
+    def setUp(self):
+        self.aggregator = CandleAggregator()
+        self.closed = []
+        self.aggregator.listeners.append(lambda symbol, timeframe, candle: self.closed.append((timeframe, candle)))
+
+    def tick(self, offset, ltp, volume):
+        self.aggregator.on_tick({'symbol': 'NSE:SBIN-EQ', 'ltp': ltp, 'vol_traded_today': volume,
+                                 'exch_feed_time': self.START + offset})
+
+    def test_ticks_build_one_second_candles(self):
+        self.tick(0, 100, 1000)
+        self.tick(0.5, 102, 1010)
+        self.tick(0.9, 99, 1015)
+        self.tick(1, 101, 1020)
+        self.assertEqual(self.closed, [('1s', (self.START, 100, 102, 99, 99, 15))])
+        self.assertEqual(self.aggregator.current('NSE:SBIN-EQ', '1s'), (self.START + 1, 101, 101, 101, 101, 5))
+
+    def test_larger_timeframes_roll_up(self):
+        self.tick(0, 100, 1000)
+        self.tick(30, 105, 1010)
+        self.tick(59, 98, 1030)
+        self.tick(60, 101, 1040)
+        self.tick(61, 101, 1040)
+        minute = [candle for timeframe, candle in self.closed if timeframe == '1m']
+        self.assertEqual(minute, [(self.START, 100, 105, 98, 98, 30)])
+        self.assertEqual(self.aggregator.current('NSE:SBIN-EQ', '5m'), (self.START, 100, 105, 98, 101, 40))
+        self.assertEqual(self.aggregator.recent('NSE:SBIN-EQ', '1m'), minute)
+
+    def test_sweep_closes_on_the_exchange_clock(self):
+        # The exchange clock is an hour behind the wall clock
+        with mock.patch('app.candles.time.time', return_value=self.START + 3600):
+            self.tick(0, 100, 1000)
+            self.tick(10, 101, 1005)
+            self.aggregator.sweep()
+        # The wall clock is far past the 1s candle at +10 but the exchange is not
+        self.assertEqual([timeframe for timeframe, _ in self.closed], ['1s'])
+        with mock.patch('app.candles.time.time', return_value=self.START + 3600 + 61):
+            self.aggregator.sweep()
+        self.assertEqual([timeframe for timeframe, _ in self.closed], ['1s', '1s', '1m'])
+        self.assertEqual(self.closed[-1][1], (self.START, 100, 101, 100, 101, 5))
+        self.assertIsNone(self.aggregator.current('NSE:SBIN-EQ', '1m'))
+        self.assertIsNotNone(self.aggregator.current('NSE:SBIN-EQ', '5m'))
+
+    def test_backfill_fills_only_the_gap(self):
+        self.tick(300, 100, 1000)
+        rows = [[self.START + 60 * i, 100, 101, 99, 100, 10] for i in range(7)]
+        # Minutes up to the open one at +300 are inserted, later ones are not
+        self.assertEqual(self.aggregator.backfill('NSE:SBIN-EQ', rows, now=self.START + 600), 5)
+        self.assertEqual([candle[0] for _, candle in self.closed], [self.START + 60 * i for i in range(5)])
+        self.assertEqual(self.aggregator.recent('NSE:SBIN-EQ', '1m')[-1][0], self.START + 240)
+        # Nothing is inserted twice
+        self.assertEqual(self.aggregator.backfill('NSE:SBIN-EQ', rows, now=self.START + 600), 0)
+
+    def test_released_symbols_are_dropped_once_closed(self):
+        self.tick(0, 100, 1000)
+        self.aggregator.release(['NSE:SBIN-EQ'])
+        self.assertEqual(self.aggregator.symbols(), ['NSE:SBIN-EQ'])
+        self.aggregator.sweep(now=self.START + 3600)
+        self.assertEqual(self.aggregator.symbols(), [])
+        self.assertEqual(self.aggregator.recent('NSE:SBIN-EQ', '1s'), [])
+
+    def test_owner_listeners_only_run_on_the_owner(self):
+        owned = []
+        self.aggregator.owner_listeners.append(lambda *args: owned.append(args))
+        self.tick(0, 100, 1000)
+        self.aggregator.sweep(now=self.START + 1)
+        self.assertEqual(owned, [])
+        self.assertEqual(len(self.closed), 1)
+        self.aggregator.owner = True
+        self.tick(1, 100, 1000)
+        self.aggregator.sweep(now=self.START + 2)
+        self.assertEqual(len(owned), 1)
+
+
+class CandleArchiveTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.archive = CandleArchive(self.root)
+
+    def candles(self, *starts):
+        return [(start, 100.0, 101.0, 99.0, 100.5, 10.0) for start in starts]
+
+    def test_range_reads(self):
+        self.assertEqual(self.archive.append('NSE:SBIN-EQ', '1m', self.candles(60, 120, 180, 240)), 4)
+        self.assertEqual(self.archive.range('NSE:SBIN-EQ', '1m', 100, 180)['t'].tolist(), [120, 180])
+        self.assertEqual(self.archive.range('NSE:SBIN-EQ', '1m', start=200)['t'].tolist(), [240])
+        self.assertEqual(len(self.archive.range('NSE:SBIN-EQ', '1m')), 4)
+        self.assertEqual(len(self.archive.range('NSE:SBIN-EQ', '5m')), 0)
+        record = self.archive.range('NSE:SBIN-EQ', '1m', 60, 60)[0]
+        self.assertEqual(tuple(record.tolist()), self.candles(60)[0])
+
+    def test_append_keeps_the_file_sorted(self):
+        self.archive.append('NSE:SBIN-EQ', '1m', self.candles(60, 120))
+        self.assertEqual(self.archive.append('NSE:SBIN-EQ', '1m', self.candles(120, 90, 180)), 1)
+        self.assertEqual(self.archive.range('NSE:SBIN-EQ', '1m')['t'].tolist(), [60, 120, 180])
+
+    def test_reopened_archive_continues_the_file(self):
+        self.archive.append('NSE:SBIN-EQ', '1m', self.candles(60, 120))
+        # Readers see appends without reopening
+        self.assertEqual(len(self.archive.range('NSE:SBIN-EQ', '1m')), 2)
+        self.archive.append('NSE:SBIN-EQ', '1m', self.candles(180))
+        self.assertEqual(len(self.archive.range('NSE:SBIN-EQ', '1m')), 3)
+
+        restarted = CandleArchive(self.root)
+        self.assertEqual(restarted.append('NSE:SBIN-EQ', '1m', self.candles(180, 240)), 1)
+        self.assertEqual(restarted.range('NSE:SBIN-EQ', '1m')['t'].tolist(), [60, 120, 180, 240])
+
+    def test_partial_trailing_record_is_ignored(self):
+        self.archive.append('NSE:SBIN-EQ', '1m', self.candles(60, 120))
+        with open(self.archive.path('NSE:SBIN-EQ', '1m'), 'ab') as f:
+            f.write(b'\0' * (CANDLE_DTYPE.itemsize // 2))
+        self.assertEqual(CandleArchive(self.root).range('NSE:SBIN-EQ', '1m')['t'].tolist(), [60, 120])
+
+    def test_writer_appends_off_the_loop(self):
+        writer = ArchiveWriter(self.archive, ['1m'], flush_interval=60)
+        writer.add('NSE:SBIN-EQ', '1m', self.candles(60)[0])
+        writer.add('NSE:SBIN-EQ', '1s', self.candles(60)[0])
+        run(writer.flush())
+        self.assertEqual(writer.written, 1)
+        self.assertEqual(len(self.archive.range('NSE:SBIN-EQ', '1m')), 1)
+        self.assertEqual(len(self.archive.range('NSE:SBIN-EQ', '1s')), 0)
+
+    def test_writer_stop_appends_pending_candles(self):
+        writer = ArchiveWriter(self.archive, ['1m'], flush_interval=60)
+
+        async def scenario():
+            writer.start()
+            writer.add('NSE:SBIN-EQ', '1m', self.candles(60)[0])
+            await writer.stop()
+
+        run(scenario())
+        self.assertIsNone(writer._task)
+        self.assertEqual(len(self.archive.range('NSE:SBIN-EQ', '1m')), 1)
+
+    def test_forget_tails_rereads_files_another_writer_appended_to(self):
+        self.archive.append('NSE:SBIN-EQ', '1m', self.candles(60))
+        # Another process owned the feed for a while
+        CandleArchive(self.root).append('NSE:SBIN-EQ', '1m', self.candles(120, 180))
+        self.archive.forget_tails()
+        self.assertEqual(self.archive.append('NSE:SBIN-EQ', '1m', self.candles(120, 180, 240)), 1)
+        self.assertEqual(self.archive.range('NSE:SBIN-EQ', '1m')['t'].tolist(), [60, 120, 180, 240])
+
+    def test_writer_reopen_appends_pending_candles_first(self):
+        writer = ArchiveWriter(self.archive, ['1m'], flush_interval=60)
+        writer.add('NSE:SBIN-EQ', '1m', self.candles(60)[0])
+        run(writer.reopen())
+        self.assertEqual(writer.written, 1)
+        self.assertEqual(self.archive._last_start, {})
+
+
+def candle_series(count, step=60, start=1704079800):
+    """A random walk of CANDLE_DTYPE candles that spans two sessions"""
+    rng = np.random.default_rng(7)
+    close = 100 + np.cumsum(rng.normal(0, 1, count))
+    candles = np.zeros(count, dtype=CANDLE_DTYPE)
+    candles['t'] = start + step * np.arange(count)
+    candles['o'] = close + rng.normal(0, 0.5, count)
+    candles['h'] = np.maximum(candles['o'], close) + rng.random(count)
+    candles['l'] = np.minimum(candles['o'], close) - rng.random(count)
+    candles['c'] = close
+    candles['v'] = rng.integers(1, 1000, count)
+    return candles
+
+
+class IndicatorTests(SimpleTestCase):
+
+    def assertMatches(self, batch, incremental):
+        for output, values in batch.items():
+            for i, value in enumerate(values):
+                live = incremental[i][output]
+                if math.isnan(value):
+                    self.assertIsNone(live, f'{output}[{i}]')
+                else:
+                    self.assertAlmostEqual(live, value, delta=1e-9 * max(1.0, abs(value)), msg=f'{output}[{i}]')
+
+    def test_batch_and_incremental_agree(self):
+        candles = candle_series(600, step=300)
+        for name, (batch, incremental, _) in INDICATORS.items():
+            for params in ({}, {'period': 5, 'fast': 3, 'slow': 7, 'signal': 4, 'k': 1.5}):
+                params = dict(parse_params(name, params))
+                with self.subTest(indicator=name, params=params):
+                    indicator = incremental(**params)
+                    updates = [indicator.update(candle) for candle in candles.tolist()]
+                    self.assertMatches(batch(candles, **params), updates)
+
+    def test_parse_params(self):
+        self.assertEqual(parse_params('macd', {'fast': '5'}), (('fast', 5), ('slow', 26), ('signal', 9)))
+        with self.assertRaises(ValueError):
+            parse_params('sma', {'period': 0})
+        with self.assertRaises(ValueError):
+            parse_params('kama', {})
+
+    def test_live_indicators_warm_up_from_their_lookback_only(self):
+        candles = candle_series(5000)
+        engine = IndicatorEngine()
+        for name in ('ema', 'rsi', 'macd', 'bollinger', 'vwap'):
+            params = parse_params(name, {})
+            with self.subTest(indicator=name):
+                limit = warmup_candles(name, params, '1m')
+                self.assertLess(limit, len(candles))
+                with mock.patch('app.indicators.load_candles',
+                                side_effect=lambda symbol, timeframe, limit: candles[-limit:]) as load:
+                    latest = engine.subscribe('NSE:SBIN-EQ', '1m', name, params)
+                load.assert_called_once_with('NSE:SBIN-EQ', '1m', limit=limit)
+                for output, values in INDICATORS[name][0](candles, **dict(params)).items():
+                    self.assertAlmostEqual(latest[output], values[-1], delta=1e-6 * abs(values[-1]))
+
+    def test_load_candles_limit_spans_archive_and_memory(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive = CandleArchive(directory.name)
+        archive.append('NSE:SBIN-EQ', '1m', [(t, 1.0, 1.0, 1.0, 1.0, 1.0) for t in (60, 120, 180)])
+        aggregator = mock.Mock(recent=mock.Mock(return_value=[(t, 1.0, 1.0, 1.0, 1.0, 1.0) for t in (180, 240, 300)]))
+        with mock.patch('app.indicators.candle_archive', archive),                 mock.patch('app.indicators.candle_aggregator', aggregator):
+            self.assertEqual(load_candles('NSE:SBIN-EQ', '1m')['t'].tolist(), [60, 120, 180, 240, 300])
+            self.assertEqual(load_candles('NSE:SBIN-EQ', '1m', limit=4)['t'].tolist(), [120, 180, 240, 300])
+            self.assertEqual(load_candles('NSE:SBIN-EQ', '1m', limit=2)['t'].tolist(), [240, 300])
+
+
+class FeedLeaseTests(TestCase):
+
+    def test_holder_renews_and_others_wait(self):
+        self.assertTrue(FeedLease.acquire('feed', 'worker-a', 15))
+        self.assertFalse(FeedLease.acquire('feed', 'worker-b', 15))
+        self.assertTrue(FeedLease.acquire('feed', 'worker-a', 15))
+        self.assertEqual(FeedLease.objects.get(name='feed').owner, 'worker-a')
+
+    def test_lapsed_lease_is_taken_over(self):
+        FeedLease.acquire('feed', 'worker-a', 15)
+        FeedLease.objects.filter(name='feed').update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertTrue(FeedLease.acquire('feed', 'worker-b', 15))
+        # The old holder finds out on its next renewal
+        self.assertFalse(FeedLease.acquire('feed', 'worker-a', 15))
+
+    def test_only_the_holder_releases(self):
+        FeedLease.acquire('feed', 'worker-a', 15)
+        FeedLease.release('feed', 'worker-b')
+        self.assertFalse(FeedLease.acquire('feed', 'worker-b', 15))
+        FeedLease.release('feed', 'worker-a')
+        self.assertTrue(FeedLease.acquire('feed', 'worker-b', 15))
+
+
+class FeedDemandTests(SimpleTestCase):
+
+    def test_symbols_are_the_union_of_workers(self):
+        demand = FeedDemand()
+        demand.add('a', ['NSE:SBIN-EQ', 'NSE:INFY-EQ'])
+        demand.add('b', ['NSE:SBIN-EQ'])
+        demand.remove('a', ['NSE:SBIN-EQ'])
+        self.assertEqual(demand.symbols(), {'NSE:SBIN-EQ', 'NSE:INFY-EQ'})
+        demand.replace('b', ['NSE:TCS-EQ'])
+        self.assertEqual(demand.symbols(), {'NSE:INFY-EQ', 'NSE:TCS-EQ'})
+
+    def test_workers_without_heartbeats_expire(self):
+        demand = FeedDemand()
+        with mock.patch('app.cluster.time.monotonic', return_value=100.0):
+            demand.add('a', ['NSE:SBIN-EQ'])
+            demand.add('b', ['NSE:INFY-EQ'])
+        with mock.patch('app.cluster.time.monotonic', return_value=120.0):
+            # A heartbeat, even with nothing new, keeps a worker alive
+            demand.touch('b')
+            demand.expire(15)
+        self.assertEqual(demand.workers(), ['b'])
+        self.assertEqual(demand.symbols(), {'NSE:INFY-EQ'})
+
+
+SYMBOL_ROWS = [
+    # fytoken, name, ..., ISIN, ..., symbol, ..., exchange token, underlying
+    ['10100000003045', 'STATE BANK OF INDIA', '0', '1', '0.05', 'INE062A01020', '', '', '',
+     'NSE:SBIN-EQ', '', '', '3045', 'SBIN'],
+    ['1210000500112', 'STATE BANK OF INDIA', '0', '1', '0.05', 'INE062A01020', '', '', '',
+     'BSE:SBIN-A', '', '', '500112', 'SBIN'],
+    ['10100000017971', 'SBI CARDS AND PAYMENT SERVICES', '0', '1', '0.05', 'INE018E01016', '', '', '',
+     'NSE:SBICARD-EQ', '', '', '17971', 'SBICARD'],
+    ['10100000001594', 'INFOSYS LIMITED', '0', '1', '0.05', 'INE009A01021', '', '', '',
+     'NSE:INFY-EQ', '', '', '1594', 'INFY'],
+]
+
+
+class SymbolMasterTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/NSE_CM.csv'
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(SYMBOL_ROWS)
+        self.master = SymbolMaster([path])
+
+    def symbols(self, query, limit=10):
+        return [match['symbol'] for match in self.master.search(query, limit)]
+
+    def test_resolve(self):
+        self.assertEqual(self.master.resolve(' sbin '), 'NSE:SBIN-EQ')
+        self.assertEqual(self.master.resolve('INE062A01020'), 'NSE:SBIN-EQ')
+        self.assertEqual(self.master.resolve('bse:sbin-a'), 'BSE:SBIN-A')
+        self.assertEqual(self.master.resolve('BSE:500112'), 'BSE:SBIN-A')
+        self.assertEqual(self.master.resolve('10100000001594'), 'NSE:INFY-EQ')
+        self.assertIsNone(self.master.resolve('NSE:NOPE-EQ'))
+        self.assertEqual(self.master.resolve_all(['SBIN', 'NSE:SBIN-EQ', 'NOPE']), (['NSE:SBIN-EQ'], ['NOPE']))
+
+    def test_search_ranks_tickers_before_names(self):
+        self.assertEqual(self.symbols('sbi'), ['NSE:SBICARD-EQ', 'NSE:SBIN-EQ', 'BSE:SBIN-A'])
+        # An exact ticker comes first
+        self.assertEqual(self.symbols('SBIN'), ['NSE:SBIN-EQ', 'BSE:SBIN-A'])
+        self.assertEqual(self.symbols('infos'), ['NSE:INFY-EQ'])
+        self.assertEqual(self.symbols('s', limit=2), ['NSE:SBICARD-EQ', 'NSE:SBIN-EQ'])
+        self.assertEqual(self.master.search('infy')[0], {
+            'symbol': 'NSE:INFY-EQ', 'name': 'INFOSYS LIMITED', 'isin': 'INE009A01021', 'token': '10100000001594',
+        })
+
+    def test_without_a_master_every_symbol_is_accepted(self):
+        master = SymbolMaster(['/nonexistent/NSE_CM.csv'])
+        self.assertEqual(master.resolve('SBIN'), 'NSE:SBIN-EQ')
+        self.assertEqual(master.resolve('BSE:SBIN-A'), 'BSE:SBIN-A')
+        self.assertEqual(master.search('SBI'), [])
+
+    def test_search_falls_back_to_substrings(self):
+        self.assertEqual(self.symbols('BIN'), ['NSE:SBIN-EQ', 'BSE:SBIN-A'])
+        self.assertEqual(self.symbols('aymen'), ['NSE:SBICARD-EQ'])
+        self.assertEqual(self.symbols('BI'), ['NSE:SBICARD-EQ', 'NSE:SBIN-EQ', 'BSE:SBIN-A'])
+        self.assertEqual(self.symbols('BI', limit=2), ['NSE:SBICARD-EQ', 'NSE:SBIN-EQ'])
+        self.assertEqual(self.symbols('DIA'), ['NSE:SBIN-EQ', 'BSE:SBIN-A'])
+        self.assertEqual(self.symbols('Y'), [])
+        self.assertEqual(self.symbols('XYZ'), [])
+
+
+class FakeHub:
+    """Records what a consumer asks of the market data hub"""
+
+    def __init__(self):
+        self.subscribed = []
+        self.unsubscribed = []
+
+    async def subscribe(self, channel_name, symbols):
+        self.subscribed.append(list(symbols))
+
+    async def unsubscribe(self, channel_name, symbols):
+        self.unsubscribed.append(list(symbols))
+
+
+class WatchlistStreamTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='trader', password='x')
+        last_values.update({'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0})
+        self.addCleanup(last_values.remove, ['NSE:SBIN-EQ'])
+        self.hub = FakeHub()
+        self.consumer = StockPriceConsumer()
+        self.consumer.scope = {'user': self.user}
+        self.consumer.channel_name = 'test.channel'
+        self.consumer.hub = self.hub
+        self.consumer.send = mock.AsyncMock()
+
+    def sent(self):
+        return [json.loads(call.kwargs['text_data']) for call in self.consumer.send.call_args_list]
+
+    def test_snapshot_on_subscribe(self):
+        watchlist = Watchlist.objects.create(user=self.user, name='banks', symbols=['NSE:SBIN-EQ', 'NSE:HDFCBANK-EQ'])
+        run(self.consumer.subscribe_watchlist('banks'))
+        self.assertEqual(self.hub.subscribed, [['NSE:SBIN-EQ', 'NSE:HDFCBANK-EQ']])
+        [snapshot] = self.sent()
+        self.assertEqual(snapshot['type'], 'watchlist_snapshot')
+        self.assertEqual(snapshot['watchlist'], {'id': watchlist.pk, 'name': 'banks'})
+        # Only symbols that have ticked so far are in the snapshot
+        self.assertEqual(snapshot['messages'], [{'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0}])
+
+    def test_unknown_watchlist(self):
+        other = get_user_model().objects.create_user(username='other', password='x')
+        Watchlist.objects.create(user=other, name='banks', symbols=['NSE:SBIN-EQ'])
+        run(self.consumer.subscribe_watchlist('banks'))
+        self.assertEqual(self.sent()[0]['type'], 'error')
+        self.assertEqual(self.hub.subscribed, [])
+
+    def test_leaving_a_watchlist_keeps_shared_symbols(self):
+        banks = Watchlist.objects.create(user=self.user, name='banks', symbols=['NSE:SBIN-EQ', 'NSE:HDFCBANK-EQ'])
+        Watchlist.objects.create(user=self.user, name='psu', symbols=['NSE:SBIN-EQ', 'NSE:ONGC-EQ'])
+        run(self.consumer.subscribe_watchlist('banks'))
+        run(self.consumer.subscribe_watchlist('psu'))
+        run(self.consumer.unsubscribe_watchlist(banks.pk))
+        self.assertEqual(self.hub.unsubscribed, [['NSE:HDFCBANK-EQ']])
+
+    def test_leaving_a_watchlist_keeps_direct_subscriptions(self):
+        watchlist = Watchlist.objects.create(user=self.user, name='banks', symbols=['NSE:SBIN-EQ', 'NSE:HDFCBANK-EQ'])
+        run(self.consumer.subscribe(['NSE:SBIN-EQ'], DEFAULT_DATA_TYPE))
+        run(self.consumer.subscribe_watchlist(watchlist.pk))
+        run(self.consumer.unsubscribe_watchlist(watchlist.pk))
+        self.assertEqual(self.hub.unsubscribed, [['NSE:HDFCBANK-EQ']])
+
+
+class LastValueTableTests(SimpleTestCase):
+
+    def test_serializations_are_cached_per_tick(self):
+        table = LastValueTable()
+        record = table.update({'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0})
+        self.assertIs(record.json(), record.json())
+        self.assertEqual(json.loads(record.json()), {'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0})
+        self.assertIs(record.quote(), record.quote())
+        table.update({'symbol': 'NSE:SBIN-EQ', 'ltp': 801.0, 'bid_price': 800.9, 'ask_price': 801.2})
+        self.assertEqual(record.version, 2)
+        self.assertEqual(record.quote(), {'n': 'NSE:SBIN-EQ', 's': 'ok', 'v': {
+            'symbol': 'NSE:SBIN-EQ', 'lp': 801.0, 'bid': 800.9, 'ask': 801.2, 'spread': 0.3,
+        }})
+        self.assertEqual(json.loads(record.json())['ltp'], 801.0)
+
+    def test_snapshot_json(self):
+        table = LastValueTable()
+        table.update({'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0})
+        table.update({'symbol': 'NSE:INFY-EQ', 'ltp': 1500.0})
+        text = table.snapshot_json(['NSE:INFY-EQ', 'NSE:TCS-EQ', 'NSE:SBIN-EQ'])
+        self.assertEqual(json.loads(text), [{'symbol': 'NSE:INFY-EQ', 'ltp': 1500.0},
+                                            {'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0}])
+        self.assertEqual(table.snapshot_json([]), '[]')
+
+    def test_stale_and_removed_symbols(self):
+        table = LastValueTable()
+        table.update({'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0})
+        table.update({'symbol': 'NSE:INFY-EQ', 'ltp': 1500.0})
+        table.mark_stale(['NSE:SBIN-EQ'])
+        self.assertFalse(table.get('NSE:SBIN-EQ').live)
+        self.assertEqual(table.stats(), {'symbols': 2, 'live': 1})
+        table.update({'symbol': 'NSE:SBIN-EQ', 'ltp': 800.5})
+        self.assertTrue(table.get('NSE:SBIN-EQ').live)
+        table.mark_stale()
+        self.assertEqual(table.stats()['live'], 0)
+
+        sid = table.sid('NSE:SBIN-EQ')
+        table.remove(['NSE:SBIN-EQ'])
+        self.assertIsNone(table.get('NSE:SBIN-EQ'))
+        # Ids of removed symbols are reused
+        self.assertEqual(table.update({'symbol': 'NSE:TCS-EQ', 'ltp': 4000.0}).sid, sid)
+        self.assertEqual(len(table), 2)
+
+
+class LiveQuoteTests(SimpleTestCase):
+
+    def setUp(self):
+        quote_cache.clear()
+        QuoteService._inflight = {}
+        self.client = FakeQuotesClient()
+        patcher = mock.patch.object(FyersClientService, 'get_client', mock.AsyncMock(return_value=self.client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(quote_cache.clear)
+        self.addCleanup(last_values.remove, ['QL:A'])
+
+    def test_live_symbols_are_answered_from_the_last_value_table(self):
+        record = last_values.update({'symbol': 'QL:A', 'ltp': 101.5})
+        hits, live_hits = quote_cache.hits, QuoteService.live_hits
+        response = run(QuoteService.get_quotes(['QL:A', 'QL:B']))
+        self.assertEqual(self.client.calls, [['QL:B']])
+        self.assertIs(response['d'][0], record.quote())
+        self.assertEqual(response['d'][0]['v'], {'symbol': 'QL:A', 'lp': 101.5})
+        # Live answers are not quote cache hits
+        self.assertEqual((quote_cache.hits, QuoteService.live_hits), (hits, live_hits + 1))
+        # Once the feed stops covering it the symbol goes upstream again
+        last_values.mark_stale(['QL:A'])
+        run(QuoteService.get_quotes(['QL:A']))
+        self.assertEqual(self.client.calls, [['QL:B'], ['QL:A']])
+
+
+class AlertEngineTests(SimpleTestCase):
+
+    def setUp(self):
+        self.fired = []
+        self.engine = AlertEngine(volume_window=3)
+        self.engine.notify = lambda user_id, alert: self.fired.append((user_id, alert['rule']))
+
+    def tick(self, price, symbol='NSE:SBIN-EQ'):
+        self.engine.on_tick({'symbol': symbol, 'ltp': price})
+
+    def test_price_above_fires_once_on_crossing(self):
+        self.engine.add(1, 7, 'NSE:SBIN-EQ', AlertRule.PRICE_ABOVE, 100.0)
+        self.engine.add(2, 7, 'NSE:SBIN-EQ', AlertRule.PRICE_ABOVE, 105.0)
+        self.tick(101)  # first price only sets the reference
+        self.assertEqual(self.fired, [])
+        self.tick(99)
+        self.tick(102)
+        self.assertEqual(self.fired, [(7, 1)])
+        self.tick(99)
+        self.tick(102)
+        self.assertEqual(self.fired, [(7, 1)])
+        self.tick(110)
+        self.assertEqual(self.fired, [(7, 1), (7, 2)])
+        self.assertEqual(self.engine.symbols(), [])
+
+    def test_price_below_includes_the_threshold(self):
+        self.engine.add(1, 7, 'NSE:SBIN-EQ', AlertRule.PRICE_BELOW, 100.0)
+        self.tick(101)
+        self.tick(100.5)
+        self.assertEqual(self.fired, [])
+        self.tick(100)
+        self.assertEqual(self.fired, [(7, 1)])
+
+    def test_deactivated_rule_does_not_fire(self):
+        rule = {'id': 1, 'user_id': 7, 'symbol': 'NSE:SBIN-EQ', 'kind': AlertRule.PRICE_ABOVE,
+                'threshold': 100.0, 'active': True}
+        self.engine.apply(rule)
+        self.engine.apply(dict(rule, id=2))
+        self.engine.apply(dict(rule, active=False))
+        self.tick(99)
+        self.tick(101)
+        self.assertEqual(self.fired, [(7, 2)])
+        self.assertEqual(len(self.engine), 0)
+
+    def test_volume_rule_needs_a_full_window(self):
+        self.engine.add(1, 7, 'NSE:SBIN-EQ', AlertRule.VOLUME_MULTIPLE, 2.0)
+        with mock.patch.object(self.engine, 'flush'):
+            for volume in (100, 100, 100):
+                self.engine.on_candle('NSE:SBIN-EQ', '1m', (0, 1, 1, 1, 1, volume))
+            self.engine.on_candle('NSE:SBIN-EQ', '5m', (0, 1, 1, 1, 1, 1000))
+            self.assertEqual(self.fired, [])
+            self.engine.on_candle('NSE:SBIN-EQ', '1m', (0, 1, 1, 1, 1, 250))
+        self.assertEqual(self.fired, [(7, 1)])
+
+
+class AlertRuleApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='trader', password='x')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.rule = AlertRule.objects.create(
+            user=self.user, symbol='NSE:SBIN-EQ', kind=AlertRule.PRICE_ABOVE, threshold=100.0,
+        )
+
+    def test_deactivate(self):
+        with mock.patch('app.views.rule_changed') as rule_changed:
+            response = self.api.patch(f'/api/alerts/{self.rule.pk}/', {'active': False}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(rule_changed.call_args[0][0].active)
+
+    def test_delete_tells_the_engine_which_rule_went(self):
+        with mock.patch('app.views.rule_changed') as rule_changed:
+            response = self.api.delete(f'/api/alerts/{self.rule.pk}/')
+        self.assertEqual(response.status_code, 204)
+        sent = rule_changed.call_args[0][0]
+        self.assertEqual((sent.pk, sent.active), (self.rule.pk, False))
+
+        engine = AlertEngine()
+        engine.notify = mock.Mock()
+        engine.add(self.rule.pk, self.user.pk, 'NSE:SBIN-EQ', AlertRule.PRICE_ABOVE, 100.0)
+        engine.apply({'id': sent.pk, 'active': sent.active})
+        engine.on_tick({'symbol': 'NSE:SBIN-EQ', 'ltp': 99})
+        engine.on_tick({'symbol': 'NSE:SBIN-EQ', 'ltp': 101})
+        engine.notify.assert_not_called()
+
+    @override_settings(ALERT_MAX_RULES_PER_USER=1)
+    def test_reactivation_counts_against_the_limit(self):
+        self.rule.active = False
+        self.rule.save()
+        AlertRule.objects.create(user=self.user, symbol='NSE:INFY-EQ', kind=AlertRule.PRICE_BELOW, threshold=1000.0)
+        with mock.patch('app.views.rule_changed') as rule_changed:
+            response = self.api.patch(f'/api/alerts/{self.rule.pk}/', {'active': True}, format='json')
+            self.assertEqual(response.status_code, 400)
+            # Editing an active rule is not a new activation
+            other = AlertRule.objects.get(symbol='NSE:INFY-EQ')
+            response = self.api.patch(f'/api/alerts/{other.pk}/', {'threshold': 900.0}, format='json')
+            self.assertEqual(response.status_code, 200)
+        rule_changed.assert_called_once()
+
+    def test_reactivating_a_fired_rule_rearms_it(self):
+        AlertRule.objects.filter(pk=self.rule.pk).update(active=False, triggered_at=timezone.now())
+        with mock.patch('app.views.rule_changed'):
+            response = self.api.patch(f'/api/alerts/{self.rule.pk}/', {'active': True}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['triggered_at'])
+            self.rule.refresh_from_db()
+            self.assertIsNone(self.rule.triggered_at)
+            # Other edits keep the time the rule fired
+            fired = timezone.now()
+            AlertRule.objects.filter(pk=self.rule.pk).update(active=False, triggered_at=fired)
+            self.api.patch(f'/api/alerts/{self.rule.pk}/', {'threshold': 90.0}, format='json')
+        self.rule.refresh_from_db()
+        self.assertEqual(self.rule.triggered_at, fired)
+
+
+class ReplayTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/ticks.jsonl.gz'
+
+    def record(self, messages, received_at):
+        recorder = TickRecorder(self.path)
+        with mock.patch('app.sources.time.time', return_value=received_at):
+            for message in messages:
+                recorder.write(message)
+        recorder.close()
+        self.assertEqual(recorder.recorded, len(messages))
+
+    def replay(self, symbols, data_type='SymbolUpdate', retime=False):
+        received = []
+        closed = threading.Event()
+        source = ReplayFeedSource(self.path, speed=0, retime=retime,
+                                  on_message=received.append, on_close=lambda message: closed.set())
+        source.subscribe(symbols, data_type)
+        source.connect()
+        self.assertTrue(closed.wait(5))
+        return received
+
+    def test_recorded_ticks_replay_in_order(self):
+        ticks = [
+            {'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0, 'exch_feed_time': 1704099600},
+            {'symbol': 'NSE:INFY-EQ', 'ltp': 1500.0, 'exch_feed_time': 1704099600},
+            {'symbol': 'NSE:SBIN-EQ', 'ltp': 801.0, 'exch_feed_time': 1704099601},
+        ]
+        self.record(ticks[:2], time.time())
+        # A second run appends to the same file
+        self.record(ticks[2:], time.time())
+        self.assertEqual(self.replay(['NSE:SBIN-EQ']), [ticks[0], ticks[2]])
+        self.assertEqual(self.replay(['NSE:SBIN-EQ', 'NSE:INFY-EQ']), ticks)
+
+    def test_retime_shifts_exchange_time_to_now(self):
+        self.record([{'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0, 'exch_feed_time': 1704099600}], time.time() - 100)
+        [tick] = self.replay(['NSE:SBIN-EQ'], retime=True)
+        self.assertIn(tick['exch_feed_time'] - 1704099600, (100, 101))
+
+    def test_depth_is_replayed_for_depth_subscriptions_only(self):
+        quote = {'symbol': 'NSE:SBIN-EQ', 'ltp': 800.0}
+        depth = {'symbol': 'NSE:SBIN-EQ', 'type': 'dp', 'bid_price1': 799.9}
+        self.record([quote, depth], time.time())
+        self.assertEqual(self.replay(['NSE:SBIN-EQ']), [quote])
+        self.assertEqual(self.replay(['NSE:SBIN-EQ'], 'DepthUpdate'), [depth])
+
+
+class MetricsRegistryTests(SimpleTestCase):
+
+    def test_render(self):
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests', labelnames=('endpoint',))
+        requests.labels('quotes').inc()
+        requests.labels('quotes').inc(2)
+        latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+        registry.collect('queue_size', 'Queue size', 'gauge', lambda: 7)
+        registry.collect('broken', 'Raises', 'gauge', lambda: 1 / 0)
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{endpoint="quotes"} 3',
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            'latency_seconds_sum 5.55',
+            'latency_seconds_count 3',
+            '# HELP queue_size Queue size',
+            '# TYPE queue_size gauge',
+            'queue_size 7',
+            '# HELP broken Raises',
+            '# TYPE broken gauge',
+        ])
+
+    def test_names_are_unique(self):
+        registry = Registry()
+        registry.counter('requests_total', 'Requests')
+        with self.assertRaises(ValueError):
+            registry.gauge('requests_total', 'Requests')
+
+
+class HubReconnectTests(SimpleTestCase):
+
+    @override_settings(FEED_RECONNECT_BASE_SECONDS=1, FEED_RECONNECT_MAX_SECONDS=8)
+    def test_backoff_doubles_up_to_the_cap(self):
+        hub = MarketDataHub()
+        for attempts, ceiling in enumerate((1, 2, 4, 8, 8, 8)):
+            hub.reconnect_attempts = attempts
+            for _ in range(20):
+                delay = hub.backoff_delay()
+                self.assertGreaterEqual(delay, ceiling / 2)
+                self.assertLessEqual(delay, ceiling)
+
+    @override_settings(FEED_SOURCE='fyers', FEED_BACKFILL_ENABLED=True)
+    def test_resync_backfills_then_reports_the_gap(self):
+        hub = MarketDataHub()
+        hub._upstream = {'NSE:SBIN-EQ', 'NSE:INFY-EQ'}
+        hub.broadcast_status = mock.AsyncMock()
+        backfilled = {'NSE:SBIN-EQ': 3, 'NSE:INFY-EQ': 0}
+        with mock.patch('app.feed.backfill_gap', mock.AsyncMock(return_value=backfilled)) as backfill_gap:
+            run(hub.resync(1704099600.0, 1704099900.0))
+        backfill_gap.assert_awaited_once_with(['NSE:INFY-EQ', 'NSE:SBIN-EQ'], 1704099600.0, 1704099900.0)
+        hub.broadcast_status.assert_awaited_once_with(
+            'resynced', 'Market data feed restored',
+            gap_start=1704099600.0, gap_end=1704099900.0, symbols=2, backfilled=3,
+        )
+
+    @override_settings(FEED_SOURCE='fyers', FEED_BACKFILL_ENABLED=True)
+    def test_failed_backfill_still_resyncs(self):
+        hub = MarketDataHub()
+        hub._upstream = {'NSE:SBIN-EQ'}
+        hub.broadcast_status = mock.AsyncMock()
+        with mock.patch('app.feed.backfill_gap', mock.AsyncMock(side_effect=RuntimeError('history down'))):
+            run(hub.resync(1704099600.0, 1704099900.0))
+        self.assertEqual(hub.broadcast_status.await_args.args[0], 'resynced')
+        self.assertEqual(hub.broadcast_status.await_args.kwargs['backfilled'], 0)
+
+
+class FakeChannelLayer:
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, channel_name, message):
+        self.sent.append((channel_name, message))
+
+
+class PortfolioEngineTests(SimpleTestCase):
+
+    def setUp(self):
+        self.engine = PortfolioEngine(push_interval_ms=60000)
+        self.layer = FakeChannelLayer()
+
+    def tick(self, symbol, ltp, prev_close=None):
+        self.engine.on_tick({'symbol': symbol, 'ltp': ltp, 'prev_close_price': prev_close})
+
+    def push(self):
+        self.layer.sent = []
+        run(self.engine.push(self.layer))
+        return {channel_name: message for channel_name, message in self.layer.sent}
+
+    def totals(self, message):
+        return {key: message[key] for key in ('value', 'cost', 'pnl', 'day_pnl', 'priced')}
+
+    def test_totals_follow_ticks_across_shared_symbols(self):
+        async def watch():
+            first = self.engine.watch(1, 'c1', [('PF:A', 10, 100.0), ('PF:B', 5, 200.0)])
+            second = self.engine.watch(2, 'c2', [('PF:A', 4, 90.0)])
+            return first, second
+
+        first, second = run(watch())
+        self.assertEqual((first['priced'], first['value'], second['priced']), (0, 0.0, 0))
+
+        self.tick('PF:A', 110.0, prev_close=105.0)
+        self.tick('PF:B', 190.0, prev_close=195.0)
+        sent = self.push()
+        self.assertEqual(self.totals(sent['c1']), {'value': 2050.0, 'cost': 2000.0, 'pnl': 50.0,
+                                                   'day_pnl': 25.0, 'priced': 2})
+        self.assertEqual(self.totals(sent['c2']), {'value': 440.0, 'cost': 360.0, 'pnl': 80.0,
+                                                   'day_pnl': 20.0, 'priced': 1})
+        self.assertEqual(sorted(row[0] for row in sent['c1']['holdings']), ['PF:A', 'PF:B'])
+
+        # Only the portfolios holding a moved symbol are pushed
+        self.tick('PF:B', 200.0)
+        self.assertEqual(list(self.push()), ['c1'])
+        self.tick('PF:A', 120.0)
+        sent = self.push()
+        self.assertEqual(self.totals(sent['c1']), {'value': 2200.0, 'cost': 2000.0, 'pnl': 200.0,
+                                                   'day_pnl': 175.0, 'priced': 2})
+        self.assertEqual(sent['c2']['holdings'], [('PF:A', 120.0, 120.0, 60.0)])
+        self.assertEqual(self.push(), {})
+
+    def test_unwatch_and_rewatch(self):
+        async def watch(portfolio_id, channel_name, positions):
+            return self.engine.watch(portfolio_id, channel_name, positions)
+
+        run(watch(1, 'c1', [('PF:A', 10, 100.0), ('PF:B', 5, 200.0)]))
+        run(watch(2, 'c2', [('PF:A', 4, 90.0)]))
+        self.tick('PF:A', 110.0, prev_close=105.0)
+        self.tick('PF:B', 190.0, prev_close=195.0)
+        self.push()
+
+        self.engine.unwatch(1, 'c1')
+        self.assertEqual(self.engine.stats()['symbols'], 1)
+        self.tick('PF:A', 100.0)
+        sent = self.push()
+        self.assertEqual(list(sent), ['c2'])
+        self.assertEqual(self.totals(sent['c2']), {'value': 400.0, 'cost': 360.0, 'pnl': 40.0,
+                                                   'day_pnl': -20.0, 'priced': 1})
+
+        # Back again: PF:A keeps its price and previous close, PF:B has none yet
+        snapshot = run(watch(1, 'c1', [('PF:A', 10, 100.0), ('PF:B', 5, 200.0)]))
+        self.assertEqual(self.totals(snapshot), {'value': 1000.0, 'cost': 1000.0, 'pnl': 0.0,
+                                                 'day_pnl': -50.0, 'priced': 1})
+        self.tick('PF:B', 210.0, prev_close=205.0)
+        self.assertEqual(self.totals(self.push()['c1']), {'value': 2050.0, 'cost': 2000.0, 'pnl': 50.0,
+                                                          'day_pnl': -25.0, 'priced': 2})
+
+
+class PaperExchangeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.updates = []
+        self.exchange = PaperExchange()
+        self.exchange.notify = lambda user_id, update: self.updates.append((update['order'], update['status']))
+
+    def tick(self, ltp, bid=None, ask=None, symbol='PX:SBIN'):
+        self.exchange.on_tick({'symbol': symbol, 'ltp': ltp, 'bid_price': bid, 'ask_price': ask})
+
+    def test_limit_orders_fill_when_crossed(self):
+        self.assertEqual(self.exchange.place(1, 7, 'PX:SBIN', BUY, LIMIT, 10, limit_price=99.0), OPEN)
+        self.exchange.place(2, 7, 'PX:SBIN', SELL, LIMIT, 10, limit_price=101.0)
+        self.tick(100, bid=99.9, ask=100.1)
+        self.assertEqual(self.updates, [])
+        self.tick(99, bid=98.9, ask=98.95)
+        self.assertEqual(self.updates, [(1, FILLED)])
+        self.tick(101.5, bid=101.2, ask=101.6)
+        self.assertEqual(self.updates, [(1, FILLED), (2, FILLED)])
+        self.assertEqual(len(self.exchange), 0)
+
+    def test_limit_fills_at_the_better_quote(self):
+        fills = []
+        exchange = PaperExchange(fills=mock.Mock(add=lambda order, price: fills.append(price)))
+        exchange.notify = mock.Mock()
+        exchange.place(1, 7, 'PX:SBIN', BUY, LIMIT, 10, limit_price=101.0)
+        exchange.place(2, 7, 'PX:SBIN', SELL, LIMIT, 10, limit_price=99.0)
+        exchange.on_tick({'symbol': 'PX:SBIN', 'ltp': 100, 'bid_price': 99.9, 'ask_price': 100.1})
+        self.assertEqual(fills, [100.1, 99.9])
+
+    def test_stop_becomes_market(self):
+        self.exchange.place(1, 7, 'PX:SBIN', SELL, STOP, 5, stop_price=95.0)
+        self.exchange.place(2, 7, 'PX:SBIN', BUY, STOP, 5, stop_price=105.0)
+        self.tick(100)
+        self.tick(96)
+        self.assertEqual(self.updates, [])
+        self.tick(95, bid=94.9, ask=95.1)
+        self.assertEqual(self.updates, [(1, FILLED)])
+        self.tick(106, bid=105.9, ask=106.1)
+        self.assertEqual(self.updates, [(1, FILLED), (2, FILLED)])
+
+    def test_stop_limit_rests_after_trigger(self):
+        self.exchange.place(1, 7, 'PX:SBIN', BUY, STOP_LIMIT, 5, limit_price=104.0, stop_price=103.0)
+        self.tick(103, bid=104.5, ask=104.6)
+        self.assertEqual(self.updates, [(1, TRIGGERED)])
+        self.tick(103.5, bid=103.9, ask=104.0)
+        self.assertEqual(self.updates, [(1, TRIGGERED), (1, FILLED)])
+
+    def test_market_order_fills_at_the_quote(self):
+        fills = []
+        exchange = PaperExchange(fills=mock.Mock(add=lambda order, price: fills.append(price)))
+        exchange.notify = mock.Mock()
+        exchange.place(1, 7, 'PX:SBIN', BUY, MARKET, 5)
+        self.assertEqual(fills, [])
+        exchange.on_tick({'symbol': 'PX:SBIN', 'ltp': 100, 'bid_price': 99.9, 'ask_price': 100.1})
+        self.assertEqual(fills, [100.1])
+
+    def test_cancelled_order_never_fills(self):
+        self.exchange.place(1, 7, 'PX:SBIN', BUY, LIMIT, 10, limit_price=99.0)
+        self.exchange.place(2, 7, 'PX:SBIN', BUY, LIMIT, 10, limit_price=98.0)
+        self.assertFalse(self.exchange.cancel(1, user_id=8))
+        self.assertTrue(self.exchange.cancel(1, user_id=7))
+        self.assertFalse(self.exchange.cancel(1))
+        self.tick(97, bid=96.9, ask=97.0)
+        self.assertEqual(self.updates, [(1, CANCELLED), (2, FILLED)])
+        self.assertEqual(self.exchange.stats()['cancelled'], 1)
+        self.assertEqual(self.exchange.symbols(), [])
+
+
+class DepthBooksTests(SimpleTestCase):
+
+    def setUp(self):
+        self.books = DepthBooks()
+        self.books.track(['NSE:SBIN-EQ'])
+
+    def test_mask_has_only_changed_slots(self):
+        changed = self.books.update({'symbol': 'NSE:SBIN-EQ', 'bid_price1': 100.0, 'bid_size1': 10,
+                                     'ask_price2': 101.0})
+        self.assertEqual(changed, 1 << 0 | 1 << (LEVELS + 1))
+        self.assertEqual(self.books.update({'symbol': 'NSE:SBIN-EQ', 'bid_price1': 100.0}), 0)
+        self.assertEqual(self.books.update({'symbol': 'NSE:SBIN-EQ', 'ask_order5': 3}), 1 << (2 * LEVELS - 1))
+        self.assertEqual(self.books.stats(), {'symbols': 1, 'updates': 3, 'unchanged': 1})
+
+    def test_levels_of_a_mask(self):
+        changed = self.books.update({'symbol': 'NSE:SBIN-EQ', 'bid_price3': 99.5, 'bid_size3': 7,
+                                     'bid_order3': 2, 'ask_price1': 100.5})
+        book = self.books.get('NSE:SBIN-EQ')
+        self.assertEqual(levels(book, changed), {'bids': [[3, 99.5, 7, 2]], 'asks': [[1, 100.5, 0, 0]]})
+        self.assertEqual(len(levels(book, ALL_SLOTS)['asks']), LEVELS)
+
+    def test_untracked_symbols_are_ignored(self):
+        self.assertEqual(self.books.update({'symbol': 'NSE:INFY-EQ', 'bid_price1': 1.0}), 0)
+        self.books.remove(['NSE:SBIN-EQ'])
+        self.assertEqual(self.books.update({'symbol': 'NSE:SBIN-EQ', 'bid_price1': 1.0}), 0)
+        self.assertEqual(len(self.books), 0)
+
+
+class DepthConflatorTests(SimpleTestCase):
+
+    def test_changed_levels_are_merged(self):
+        conflator = DepthConflator(interval_ms=100, max_pending=10)
+        conflator.add('NSE:SBIN-EQ', ('book-1', 0b0001))
+        conflator.add('NSE:INFY-EQ', ('book-1', 0b0100))
+        conflator.add('NSE:SBIN-EQ', ('book-2', 0b0010))
+        self.assertEqual(conflator.drain(), {'NSE:INFY-EQ': ('book-1', 0b0100), 'NSE:SBIN-EQ': ('book-2', 0b0011)})
+        self.assertEqual(conflator.drain(), {})
+        self.assertEqual(conflator.stats()['frames'], 1)
+
+    def test_discard(self):
+        conflator = DepthConflator(interval_ms=100, max_pending=10)
+        conflator.add('NSE:SBIN-EQ', ('book-1', 0b0001))
+        conflator.discard(['NSE:SBIN-EQ', 'NSE:INFY-EQ'])
+        self.assertEqual(conflator.drain(), {})
+
+
+class RecentCandlesViewTests(TestCase):
+
+    def get(self):
+        with mock.patch.object(market_data_hub, 'clustered', True), \
+                mock.patch.object(market_data_hub, 'owner', False):
+            return self.client.get('/api/candles/NSE:SBIN-EQ/recent/')
+
+    @override_settings(CANDLE_STORE_ENABLED=False)
+    def test_unstreamed_symbol_without_a_store(self):
+        self.assertEqual(self.get().status_code, 409)
+
+    @override_settings(CANDLE_STORE_ENABLED=True)
+    def test_unstreamed_symbol_is_read_from_the_store(self):
+        Candle.objects.create(
+            symbol='NSE:SBIN-EQ', timeframe='1m',
+            start=datetime.datetime(2024, 1, 1, 9, tzinfo=datetime.timezone.utc),
+            open=100.0, high=101.0, low=99.0, close=100.5, volume=10,
+        )
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['candles'], [
+            {'t': 1704099600, 'o': 100.0, 'h': 101.0, 'l': 99.0, 'c': 100.5, 'v': 10},
+        ])
+        self.assertIsNone(response.json()['current'])
+
+
+class PaperOrderApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='trader', password='x')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_cancel_updates_the_row_once(self):
+        order = PaperOrder.objects.create(
+            user=self.user, symbol='NSE:SBIN-EQ', side=BUY, order_type=LIMIT, quantity=1, limit_price=90.0,
+        )
+        with mock.patch('app.views.order_cancelled') as order_cancelled:
+            first = self.api.delete(f'/api/paper/orders/{order.pk}/')
+            second = self.api.delete(f'/api/paper/orders/{order.pk}/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data['status'], CANCELLED)
+        self.assertEqual(second.status_code, 409)
+        order_cancelled.assert_called_once()
+        order.refresh_from_db()
+        self.assertEqual(order.status, CANCELLED)
+
+
+class HubStopTests(SimpleTestCase):
+
+    def test_everything_is_written_before_the_lease_is_released(self):
+        calls = []
+        stores = ['order_store', 'fill_store', 'tick_ingestor', 'candle_ingestor', 'archive_writer']
+        hub = MarketDataHub()
+        hub.owner = hub.clustered = True
+        hub.resign = mock.AsyncMock(side_effect=lambda: calls.append('resign'))
+        hub.bridge = mock.Mock(stop=lambda: calls.append('bridge'))
+
+        async def scenario():
+            hub._lock = asyncio.Lock()
+            await hub.stop()
+
+        with contextlib.ExitStack() as stack:
+            for name in stores:
+                stop = mock.AsyncMock(side_effect=lambda name=name: calls.append(name))
+                stack.enter_context(mock.patch(f'app.feed.{name}', mock.Mock(stop=stop)))
+            stack.enter_context(mock.patch.object(FeedLease, 'release',
+                                                  side_effect=lambda *args: calls.append('release')))
+            run(scenario())
+        self.assertEqual(calls, ['bridge', 'resign'] + stores + ['release'])
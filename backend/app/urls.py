@@ -3,7 +3,26 @@ from .views import (
     home,
     FyersAuthView,
     FyersCallbackView,
-    StockPriceAPIView
+    StockPriceAPIView,
+    QuoteCacheStatsView,
+    StreamStatsView,
+    MetricsView,
+    ProfilerView,
+    RecentCandlesView,
+    CandleHistoryView,
+    IndicatorView,
+    SymbolSearchView,
+    WatchlistListView,
+    WatchlistDetailView,
+    AlertRuleListView,
+    AlertRuleDetailView,
+    PortfolioListView,
+    PortfolioDetailView,
+    PositionListView,
+    PositionDetailView,
+    PaperOrderListView,
+    PaperOrderDetailView,
+    PaperFillListView
 )
 from dj_rest_auth.registration.views import SocialLoginView
 from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
@@ -23,5 +42,24 @@ urlpatterns = [
     
     # API routes (for users)
     path('api/stocks/', StockPriceAPIView.as_view(), name='stock_prices'),
+    path('api/symbols/search/', SymbolSearchView.as_view(), name='symbol_search'),
+    path('api/watchlists/', WatchlistListView.as_view(), name='watchlists'),
+    path('api/watchlists/<int:pk>/', WatchlistDetailView.as_view(), name='watchlist_detail'),
+    path('api/alerts/', AlertRuleListView.as_view(), name='alerts'),
+    path('api/alerts/<int:pk>/', AlertRuleDetailView.as_view(), name='alert_detail'),
+    path('api/portfolios/', PortfolioListView.as_view(), name='portfolios'),
+    path('api/portfolios/<int:pk>/', PortfolioDetailView.as_view(), name='portfolio_detail'),
+    path('api/portfolios/<int:pk>/positions/', PositionListView.as_view(), name='positions'),
+    path('api/portfolios/<int:pk>/positions/<int:position_pk>/', PositionDetailView.as_view(), name='position_detail'),
+    path('api/paper/orders/', PaperOrderListView.as_view(), name='paper_orders'),
+    path('api/paper/orders/<int:pk>/', PaperOrderDetailView.as_view(), name='paper_order_detail'),
+    path('api/paper/fills/', PaperFillListView.as_view(), name='paper_fills'),
+    path('api/stocks/cache/stats/', QuoteCacheStatsView.as_view(), name='quote_cache_stats'),
+    path('api/stream/stats/', StreamStatsView.as_view(), name='stream_stats'),
+    path('api/profiler/', ProfilerView.as_view(), name='profiler'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('api/stocks/<str:symbol>/', StockPriceAPIView.as_view(), name='stock_price_detail'),
+    path('api/candles/<str:symbol>/', CandleHistoryView.as_view(), name='candle_history'),
+    path('api/candles/<str:symbol>/recent/', RecentCandlesView.as_view(), name='recent_candles'),
+    path('api/indicators/<str:symbol>/', IndicatorView.as_view(), name='indicators'),
 ]
\ No newline at end of file
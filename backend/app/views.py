@@ -1,13 +1,45 @@
 # views.py
-from django.shortcuts import render, redirect
+import logging
+from django.shortcuts import render, redirect, get_object_or_404
 from django.conf import settings
-from django.http import JsonResponse,HttpResponse
+from django.utils import timezone
+from django.http import JsonResponse,HttpResponse,StreamingHttpResponse
 from django.views import View
-from rest_framework.views import APIView
+from rest_framework import status, generics
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework.views import APIView
 from fyers_apiv3 import fyersModel
+from asgiref.sync import async_to_sync
 from .services import FyersTokenService
+from .quotes import QuoteService, quote_cache
+from .lastvalue import last_values
+from .conflation import DepthConflator, TickConflator
+from .depth import depth_books
+from .feed import market_data_hub
+from .ingest import tick_ingestor
+from .candles import candle_aggregator, candle_to_dict, stored_candles, TIMEFRAME_SECONDS
+from .archive import candle_archive, CANDLE_DTYPE
+from .indicators import indicator_engine, parse_params
+from .symbols import symbol_master
+from .serializers import (
+    WatchlistSerializer, AlertRuleSerializer, PortfolioSerializer, PositionSerializer,
+    PaperOrderSerializer, PaperFillSerializer,
+)
+from .alerts import rule_changed
+from .portfolio import portfolio_engine, positions_changed
+from .paper import paper_exchange, order_placed, order_cancelled
+from .models import PaperOrder
+from .metrics import registry
+from .profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+def unknown_symbols(invalid):
+    return JsonResponse({
+        "error": f"Unknown symbols: {', '.join(invalid)}",
+        "invalid": invalid
+    }, status=status.HTTP_400_BAD_REQUEST)
 
 class FyersAuthView(View):
     """
@@ -30,7 +62,7 @@ class FyersAuthView(View):
 
         response = session.generate_authcode()
 
-        print("respinse",response)
+        logger.debug("Fyers auth URL: %s", response)
 
         context = {
             'auth_url': response
@@ -47,7 +79,7 @@ class FyersCallbackView(View):
         """Process auth code from Fyers callback"""
         auth_code = request.GET.get('auth_code')
 
-        print("i am called in this function",auth_code)
+        logger.info("Fyers callback received, auth code present: %s", bool(auth_code))
         # client_id = settings.FYERS_CLIENT_ID
         # redirect_uri = settings.FYERS_REDIRECT_URI
         # secret_key = settings.FYERS_SECRET_KEY
@@ -71,7 +103,7 @@ class FyersCallbackView(View):
         if not auth_code:
             return render(request, 'fyers_callback.html', {'success': False, 'message': 'No auth code provided'})
         
-        access_token = FyersTokenService.initialize_token(auth_code)
+        access_token = async_to_sync(FyersTokenService.initialize_token)(auth_code)
         
         if access_token:
             return render(request, 'fyers_callback.html', {'success': True, 'message': 'Authentication successful'})
@@ -79,77 +111,450 @@ class FyersCallbackView(View):
             return render(request, 'fyers_callback.html', {'success': False, 'message': 'Authentication failed'})
 
 
-class StockPriceAPIView(APIView):
+class StockPriceAPIView(View):
     """
     API view to get stock prices
+
+    Async so the Fyers round trip does not hold a worker thread; quotes come
+    from the shared QuoteService, which reuses one client per token and
+    merges identical in-flight requests.
     """
     
-    def get(self, request, symbol=None):
+    async def get(self, request, symbol=None):
         """Get stock price data"""
         # Get symbols from query params
-        symbols = request.query_params.getlist('symbol')
+        symbols = request.GET.getlist('symbol')
         
         # If no symbols provided in query params but symbol in URL, use that
         if not symbols and symbol:
             symbols = [symbol]
         
         if not symbols:
-            return Response({"error": "No symbols provided"}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({"error": "No symbols provided"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Format symbols for Fyers API
-        formatted_symbols = []
-        for sym in symbols:
-            if ':' not in sym:
-                # Default format if exchange not specified
-                sym = f"NSE:{sym}-EQ"
-            formatted_symbols.append(sym)
+        # Validate against the symbol master before anything goes upstream
+        formatted_symbols, invalid = symbol_master.resolve_all(symbols)
+        if invalid:
+            return unknown_symbols(invalid)
         
-        # Get a valid access token
-        access_token = FyersTokenService.get_access_token()
+        try:
+            response = await QuoteService.get_quotes(formatted_symbols)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        print("at",access_token)
-        
-        if not access_token:
-            return Response({
+        if response is None:
+            return JsonResponse({
                 "error": "API token is invalid or expired. Please reauthorize.",
                 "auth_required": True
             }, status=status.HTTP_401_UNAUTHORIZED)
         
-        # Use Fyers API to get data
+        if response.get('s') == 'ok':
+            # Live quotes reuse the JSON cached on their last-value record
+            return HttpResponse(last_values.dumps_quotes(response.get('d', [])), content_type='application/json')
+
+        # If the error is related to invalid token, notify caller
+        error_msg = response.get('message', '')
+        if 'Invalid token' in error_msg or 'Unauthorized' in error_msg:
+            return JsonResponse({
+                "error": "API token is invalid. Please reauthorize.",
+                "auth_required": True
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        
+        return JsonResponse({"error": error_msg}, status=status.HTTP_400_BAD_REQUEST)
+
+class QuoteCacheStatsView(View):
+    """
+    Hit, miss and eviction counters of the quote cache, for tuning its TTL,
+    and the lookups the live feed answered without touching it
+    """
+
+    def get(self, request):
+        return JsonResponse({**quote_cache.stats(), 'live_hits': QuoteService.live_hits})
+
+class StreamStatsView(View):
+    """
+    Process-wide conflation and feed queue counters for the ws/stocks/ stream
+    """
+
+    def get(self, request):
+        bridge = market_data_hub.bridge
+        return JsonResponse({
+            'conflation': TickConflator.totals,
+            'feed_queue': bridge.stats() if bridge is not None else None,
+            'tick_store': tick_ingestor.stats(),
+            'last_values': last_values.stats(),
+            'portfolios': portfolio_engine.stats(),
+            'paper': paper_exchange.stats(),
+            'depth': dict(depth_books.stats(), conflation=DepthConflator.totals),
+        })
+
+class MetricsView(View):
+    """
+    This process's metrics in the Prometheus text format
+    """
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class ProfilerView(APIView):
+    """
+    Runtime switch for the sampling profiler of this process (staff only)
+
+    GET returns its state, or with ?format=collapsed the samples as collapsed
+    stacks for flame graph tools. POST {"action": "start", "interval_ms": 10}
+    or {"action": "stop"}.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        if request.GET.get('format') == 'collapsed':
+            return HttpResponse(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+        return Response(profiler.stats())
+
+    def post(self, request):
+        action = request.data.get('action')
+        if action == 'start':
+            try:
+                interval_ms = float(request.data.get('interval_ms') or settings.PROFILER_INTERVAL_MS)
+            except (TypeError, ValueError):
+                return Response({"error": "interval_ms must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+            if interval_ms <= 0:
+                return Response({"error": "interval_ms must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+            profiler.start(interval_ms, reset=request.data.get('reset', True))
+        elif action == 'stop':
+            profiler.stop()
+        else:
+            return Response({"error": "action must be start or stop"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(profiler.stats())
+
+class RecentCandlesView(View):
+    """
+    Recent candles for a symbol, served from the live candle aggregator
+
+    A process that shares the feed without owning it (FEED_MODE=remote, or
+    another worker holds the lease) only builds candles for the symbols its
+    own connections follow. For other symbols it answers from the candle
+    store when CANDLE_STORE_ENABLED, and with 409 otherwise.
+    """
+
+    def get(self, request, symbol):
+        timeframe = request.GET.get('timeframe', '1m')
+        if timeframe not in TIMEFRAME_SECONDS:
+            return JsonResponse({"error": f"Unknown timeframe {timeframe}"}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            fyers = fyersModel.FyersModel(
-                client_id=settings.FYERS_CLIENT_ID,
-                is_async=False,
-                token=access_token
-            )
-            
-            # Example of a quotes request
-            data = {
-                "symbol": formatted_symbols,
-                "ohlcv_flag": 1
-            }
-            
-            print("data",data)
-            response = fyers.quotes(data)
-
-            print("res",response)
-            
-            if response.get('s') == 'ok':
-                return Response(response.get('d', {}))
-            else:
-                # If the error is related to invalid token, notify caller
-                error_msg = response.get('message', '')
-                if 'Invalid token' in error_msg or 'Unauthorized' in error_msg:
-                    return Response({
-                        "error": "API token is invalid. Please reauthorize.",
-                        "auth_required": True
-                    }, status=status.HTTP_401_UNAUTHORIZED)
-                
-                return Response({"error": error_msg}, status=status.HTTP_400_BAD_REQUEST)
-                
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            limit = int(request.GET.get('limit', 100))
+        except ValueError:
+            return JsonResponse({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        symbol = symbol_master.resolve(symbol)
+        if symbol is None:
+            return unknown_symbols([self.kwargs['symbol']])
+
+        hub = market_data_hub
+        if hub.clustered and not hub.owner and not hub.subscriber_count(symbol):
+            if not settings.CANDLE_STORE_ENABLED:
+                return JsonResponse({
+                    "error": f"{symbol} is not streamed by this process; follow it on ws/candles/ "
+                             f"or read /api/candles/{symbol}/",
+                }, status=status.HTTP_409_CONFLICT)
+            return JsonResponse({
+                'symbol': symbol,
+                'timeframe': timeframe,
+                'candles': [candle_to_dict(candle) for candle in stored_candles(symbol, timeframe, limit)],
+                'current': None,
+            })
+
+        current = candle_aggregator.current(symbol, timeframe)
+        return JsonResponse({
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'candles': [candle_to_dict(candle) for candle in candle_aggregator.recent(symbol, timeframe, limit)],
+            'current': candle_to_dict(current) if current else None,
+        })
+
+class CandleHistoryView(View):
+    """
+    Range query over the on-disk candle archive
+
+    ?timeframe=1m&start=<epoch>&end=<epoch>&format=json|binary
+    The binary format streams the raw CANDLE_DTYPE records.
+    """
+
+    # Records per streamed chunk
+    chunk_size = 10000
+
+    def get(self, request, symbol):
+        timeframe = request.GET.get('timeframe', '1m')
+        if timeframe not in TIMEFRAME_SECONDS:
+            return JsonResponse({"error": f"Unknown timeframe {timeframe}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            start = request.GET.get('start')
+            end = request.GET.get('end')
+            start = int(start) if start else None
+            end = int(end) if end else None
+        except ValueError:
+            return JsonResponse({"error": "start and end must be epoch seconds"}, status=status.HTTP_400_BAD_REQUEST)
+
+        resolved = symbol_master.resolve(symbol)
+        if resolved is None:
+            return unknown_symbols([symbol])
+        candles = candle_archive.range(resolved, timeframe, start, end)
+
+        if request.GET.get('format') == 'binary':
+            response = StreamingHttpResponse(self.binary_chunks(candles), content_type='application/octet-stream')
+            response['X-Candle-Fields'] = ','.join(CANDLE_DTYPE.names)
+            response['X-Candle-Count'] = str(len(candles))
+            return response
+
+        return StreamingHttpResponse(self.json_chunks(candles), content_type='application/json')
+
+    def binary_chunks(self, candles):
+        for i in range(0, len(candles), self.chunk_size):
+            yield candles[i:i + self.chunk_size].tobytes()
+
+    def json_chunks(self, candles):
+        # A JSON array of [t, o, h, l, c, v] rows
+        yield '['
+        for i in range(0, len(candles), self.chunk_size):
+            rows = candles[i:i + self.chunk_size].tolist()
+            body = ','.join('[%d,%r,%r,%r,%r,%r]' % row for row in rows)
+            yield body if i == 0 else ',' + body
+        yield ']'
+
+class IndicatorView(View):
+    """
+    Technical indicator over a symbol's archived and live candles
+
+    ?name=sma|ema|rsi|macd|bollinger|vwap&timeframe=1m&limit=200 plus the
+    indicator's own parameters, e.g. &period=14. Values that do not have
+    enough candles behind them yet are null.
+
+    Live candles only cover symbols this process streams, see
+    RecentCandlesView; in FEED_MODE=remote other symbols are computed from
+    the archive alone, which run_feed writes to CANDLE_ARCHIVE_DIR.
+    """
+
+    def get(self, request, symbol):
+        timeframe = request.GET.get('timeframe', '1m')
+        if timeframe not in TIMEFRAME_SECONDS:
+            return JsonResponse({"error": f"Unknown timeframe {timeframe}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        name = request.GET.get('name', 'sma')
+        try:
+            params = parse_params(name, request.GET)
+            limit = int(request.GET.get('limit', 200))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        symbol = symbol_master.resolve(symbol)
+        if symbol is None:
+            return unknown_symbols([self.kwargs['symbol']])
+        times, values = indicator_engine.compute(symbol, timeframe, name, params)
+        return JsonResponse({
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'indicator': name,
+            'params': dict(params),
+            't': times[-limit:].tolist(),
+            'values': {
+                output: [None if v != v else v for v in series[-limit:].tolist()]
+                for output, series in values.items()
+            },
+        })
+
+class SymbolSearchView(View):
+    """
+    Symbol autocomplete from the in-memory symbol master
+
+    ?q=<prefix of a ticker or of a word in the name>&limit=10
+    """
+
+    def get(self, request):
+        if not symbol_master.ensure_loaded():
+            return JsonResponse({"error": "Symbol master is not loaded"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        try:
+            limit = min(int(request.GET.get('limit', 10)), 100)
+        except ValueError:
+            return JsonResponse({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({'results': symbol_master.search(request.GET.get('q', ''), limit)})
+
+class WatchlistListView(generics.ListCreateAPIView):
+    """
+    The authenticated user's watchlists
+    """
+    serializer_class = WatchlistSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.request.user.watchlists.all()
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+class WatchlistDetailView(generics.RetrieveUpdateDestroyAPIView):
+    """
+    One of the authenticated user's watchlists
+    """
+    serializer_class = WatchlistSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.request.user.watchlists.all()
+
+class AlertRuleListView(generics.ListCreateAPIView):
+    """
+    The authenticated user's alert rules; fired alerts arrive on ws/stocks/
+    """
+    serializer_class = AlertRuleSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.request.user.alert_rules.order_by('-created_at')
+
+    def perform_create(self, serializer):
+        rule_changed(serializer.save(user=self.request.user))
+
+class AlertRuleDetailView(generics.RetrieveUpdateDestroyAPIView):
+    """
+    One of the authenticated user's alert rules
+    """
+    serializer_class = AlertRuleSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.request.user.alert_rules.all()
+
+    def perform_update(self, serializer):
+        rule_changed(serializer.save())
+
+    def perform_destroy(self, instance):
+        rule_id = instance.pk
+        instance.delete()
+        # delete() clears the pk, which the alert engine knows the rule by
+        instance.pk = rule_id
+        instance.active = False
+        rule_changed(instance)
+
+class PortfolioListView(generics.ListCreateAPIView):
+    """
+    The authenticated user's portfolios; live P&L streams on ws/portfolio/
+    """
+    serializer_class = PortfolioSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.request.user.portfolios.prefetch_related('positions')
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+class PortfolioDetailView(generics.RetrieveUpdateDestroyAPIView):
+    """
+    One of the authenticated user's portfolios
+    """
+    serializer_class = PortfolioSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.request.user.portfolios.prefetch_related('positions')
+
+    def perform_destroy(self, instance):
+        portfolio_id = instance.pk
+        instance.delete()
+        positions_changed(portfolio_id, deleted=True)
+
+class PortfolioPositionsMixin:
+    """
+    Positions of one of the authenticated user's portfolios; every change
+    is pushed to the portfolio's live streams
+    """
+    serializer_class = PositionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_portfolio(self):
+        if not hasattr(self, '_portfolio'):
+            self._portfolio = get_object_or_404(self.request.user.portfolios, pk=self.kwargs['pk'])
+        return self._portfolio
+
+    def get_queryset(self):
+        return self.get_portfolio().positions.all()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['portfolio'] = self.get_portfolio()
+        return context
+
+class PositionListView(PortfolioPositionsMixin, generics.ListCreateAPIView):
+
+    def perform_create(self, serializer):
+        serializer.save(portfolio=self.get_portfolio())
+        positions_changed(self.get_portfolio().pk)
+
+class PositionDetailView(PortfolioPositionsMixin, generics.RetrieveUpdateDestroyAPIView):
+    lookup_url_kwarg = 'position_pk'
+
+    def perform_update(self, serializer):
+        serializer.save()
+        positions_changed(self.get_portfolio().pk)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        positions_changed(self.get_portfolio().pk)
+
+class PaperOrderListView(generics.ListCreateAPIView):
+    """
+    The authenticated user's paper orders, newest first. New orders are
+    matched against the live feed; their fills arrive on ws/stocks/.
+    """
+    serializer_class = PaperOrderSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        orders = self.request.user.paper_orders.order_by('-created_at')
+        status_filter = self.request.query_params.get('status')
+        if status_filter:
+            orders = orders.filter(status=status_filter)
+        return orders
+
+    def perform_create(self, serializer):
+        order_placed(serializer.save(user=self.request.user))
+
+class PaperOrderDetailView(generics.RetrieveDestroyAPIView):
+    """
+    One of the authenticated user's paper orders; DELETE cancels it
+
+    The row is marked cancelled before the exchange is told, so the cancel
+    holds even when no feed owner is running. An order that is no longer
+    working gets 409.
+    """
+    serializer_class = PaperOrderSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.request.user.paper_orders.all()
+
+    def destroy(self, request, *args, **kwargs):
+        order = self.get_object()
+        cancelled = PaperOrder.objects.filter(pk=order.pk, status__in=PaperOrder.WORKING).update(
+            status=PaperOrder.CANCELLED, updated_at=timezone.now()
+        )
+        order.refresh_from_db()
+        if not cancelled:
+            return Response({"error": f"The order is already {order.status}"}, status=status.HTTP_409_CONFLICT)
+        order_cancelled(order)
+        return Response(self.get_serializer(order).data)
+
+class PaperFillListView(generics.ListAPIView):
+    """
+    The authenticated user's paper fills, newest first
+    """
+    serializer_class = PaperFillSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.request.user.paper_fills.all()
 
 def home(request):
-    print("hgello")
     return HttpResponse("Hello, World!")
\ No newline at end of file
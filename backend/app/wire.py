@@ -0,0 +1,145 @@
+"""
+Compact wire format for the ws/stocks/ stream.
+
+Clients opt in with ?format=compact (JSON text frames) or ?format=msgpack
+(binary MessagePack frames). Ticks are then sent as positional arrays:
+
+    ['h', version, {field: id}]             field dictionary, sent on connect
+    ['f', {field: id}]                      fields added after the header
+    ['s', sid, symbol, ts, [id, value...]]  first tick of a symbol: every field
+    ['d', sid, ts, [id, value...]]          later ticks: changed fields only
+    ['b', ts, [frame, ...]]                 conflated batch of 's'/'d' frames
+
+sid is a per-connection integer assigned in the symbol's snapshot and ts is
+the send time in epoch milliseconds. Control messages (subscribed, error,
+...) keep their usual dict shape and are encoded with the same codec.
+"""
+import json
+import time
+
+try:
+    import msgpack
+except ImportError:  # binary format is unavailable without msgpack
+    msgpack = None
+
+WIRE_VERSION = 1
+
+# Fields of a Fyers SymbolUpdate message, in the order of its map.json
+FIELDS = [
+    'ltp', 'vol_traded_today', 'last_traded_time', 'exch_feed_time',
+    'bid_size', 'ask_size', 'bid_price', 'ask_price', 'last_traded_qty',
+    'tot_buy_qty', 'tot_sell_qty', 'avg_trade_price', 'low_price',
+    'high_price', 'lower_ckt', 'upper_ckt', 'open_price', 'prev_close_price',
+    'ch', 'chp', 'type',
+]
+
+_MISSING = object()
+
+
+def epoch_ms():
+    return int(time.time() * 1000)
+
+
+class CompactJsonCodec:
+    binary = False
+
+    @staticmethod
+    def dumps(payload):
+        return json.dumps(payload, separators=(',', ':'))
+
+
+class MsgpackCodec:
+    binary = True
+
+    @staticmethod
+    def dumps(payload):
+        return msgpack.packb(payload, use_bin_type=True)
+
+
+CODECS = {
+    'compact': CompactJsonCodec,
+    'msgpack': MsgpackCodec,
+}
+
+
+def get_codec(name):
+    """Return the codec for a ?format= value, or raise ValueError"""
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown stream format '{name}'")
+    if codec is MsgpackCodec and msgpack is None:
+        raise ValueError("msgpack format is not available on this server")
+    return codec
+
+
+class DeltaEncoder:
+    """
+    Per-connection encoder that turns full ticks into snapshot/delta frames
+    """
+
+    def __init__(self):
+        self.field_ids = {name: i for i, name in enumerate(FIELDS)}
+        self._new_fields = {}
+        self._symbol_ids = {}
+        self._last = {}  # symbol -> last values sent, keyed by field id
+        self._next_sid = 0
+
+    def header(self):
+        return ['h', WIRE_VERSION, self.field_ids]
+
+    def _field_id(self, name):
+        fid = self.field_ids.get(name)
+        if fid is None:
+            fid = self.field_ids[name] = len(self.field_ids)
+            self._new_fields[name] = fid
+        return fid
+
+    def take_new_fields(self):
+        """Return an 'f' frame for fields first seen since the last call, or None"""
+        if not self._new_fields:
+            return None
+        frame = ['f', self._new_fields]
+        self._new_fields = {}
+        return frame
+
+    def encode(self, message, ts=None):
+        """
+        Encode one tick. Returns None when nothing changed since the last frame.
+        """
+        ts = epoch_ms() if ts is None else ts
+        symbol = message['symbol']
+        last = self._last.get(symbol)
+
+        if last is None:
+            values = {}
+            flat = []
+            for name, value in message.items():
+                if name == 'symbol':
+                    continue
+                fid = self._field_id(name)
+                values[fid] = value
+                flat.append(fid)
+                flat.append(value)
+            sid = self._symbol_ids[symbol] = self._next_sid
+            self._next_sid += 1
+            self._last[symbol] = values
+            return ['s', sid, symbol, ts, flat]
+
+        flat = []
+        for name, value in message.items():
+            if name == 'symbol':
+                continue
+            fid = self._field_id(name)
+            if last.get(fid, _MISSING) != value:
+                last[fid] = value
+                flat.append(fid)
+                flat.append(value)
+        if not flat:
+            return None
+        return ['d', self._symbol_ids[symbol], ts, flat]
+
+    def forget(self, symbols):
+        """Drop state so the next tick of these symbols is sent as a snapshot"""
+        for symbol in symbols:
+            self._last.pop(symbol, None)
+            self._symbol_ids.pop(symbol, None)
@@ -88,6 +88,67 @@ TEMPLATES = [
 WSGI_APPLICATION = 'vtrade.wsgi.application'
 ASGI_APPLICATION = 'vtrade.asgi.application'
 
+# The market data hub fans ticks out to consumers through per-symbol groups.
+# With REDIS_URL set the groups span processes, so several daphne workers
+# can share one upstream feed; otherwise each process is on its own.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                'capacity': int(os.getenv('CHANNEL_LAYER_CAPACITY', '1000')),
+                'expiry': 10,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Only the holder of the feed lease opens the Fyers socket; the others ask
+# it for symbols over the feed.control group. On by default with Redis.
+FEED_LEASE_ENABLED = os.getenv('FEED_LEASE_ENABLED', str(bool(REDIS_URL))) == 'True'
+FEED_LEASE_SECONDS = float(os.getenv('FEED_LEASE_SECONDS', '15'))
+FEED_HEARTBEAT_SECONDS = float(os.getenv('FEED_HEARTBEAT_SECONDS', '5'))
+
+# Where ticks come from: 'fyers' (live socket), 'replay' (a recorded
+# file, for development and load tests; FEED_REPLAY_SPEED=0 is flat out) or
+# 'synthetic' (random-walk ticks at FEED_SYNTHETIC_RATE per second, bench_ws).
+# FEED_RECORD_FILE records live ticks; strftime codes are expanded.
+FEED_SOURCE = os.getenv('FEED_SOURCE', 'fyers')
+FEED_REPLAY_FILE = os.getenv('FEED_REPLAY_FILE', str(BASE_DIR / 'data' / 'ticks' / 'replay.ndjson.gz'))
+FEED_REPLAY_SPEED = float(os.getenv('FEED_REPLAY_SPEED', '1.0'))
+FEED_REPLAY_LOOP = os.getenv('FEED_REPLAY_LOOP', 'True') == 'True'
+FEED_RECORD_FILE = os.getenv('FEED_RECORD_FILE')
+FEED_SYNTHETIC_RATE = int(os.getenv('FEED_SYNTHETIC_RATE', '1000'))
+
+# The feed owner reconnects a dropped upstream socket after
+# BASE * 2**attempt seconds (capped at MAX, upper half jittered). Attempts
+# count from zero again once a connection has lasted STABLE seconds.
+FEED_RECONNECT_BASE_SECONDS = float(os.getenv('FEED_RECONNECT_BASE_SECONDS', '1'))
+FEED_RECONNECT_MAX_SECONDS = float(os.getenv('FEED_RECONNECT_MAX_SECONDS', '60'))
+FEED_RECONNECT_STABLE_SECONDS = float(os.getenv('FEED_RECONNECT_STABLE_SECONDS', '60'))
+FEED_CONNECT_TIMEOUT_SECONDS = float(os.getenv('FEED_CONNECT_TIMEOUT_SECONDS', '15'))
+# Symbols per upstream subscribe / unsubscribe call
+FEED_SUBSCRIBE_BATCH_SIZE = int(os.getenv('FEED_SUBSCRIBE_BATCH_SIZE', '100'))
+# After an outage the 1m candles of the gap are fetched from the history
+# API, one request per subscribed symbol
+FEED_BACKFILL_ENABLED = os.getenv('FEED_BACKFILL_ENABLED', 'True') == 'True'
+FEED_BACKFILL_CONCURRENCY = int(os.getenv('FEED_BACKFILL_CONCURRENCY', '4'))
+FEED_BACKFILL_RATE_LIMIT = float(os.getenv('FEED_BACKFILL_RATE_LIMIT', '8'))
+
+# 'embedded': a web process may own the feed itself. 'remote': the feed is
+# owned by a separate `manage.py run_feed` process and web processes only
+# serve client sockets. Remote mode needs REDIS_URL. Web processes then
+# build candles and live indicators only for the symbols they stream; enable
+# CANDLE_STORE_ENABLED (and share CANDLE_ARCHIVE_DIR) for the rest.
+FEED_MODE = os.getenv('FEED_MODE', 'embedded')
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -135,6 +196,91 @@ FYERS_CLIENT_ID = os.getenv('FYERS_CLIENT_ID')
 FYERS_SECRET_KEY = os.getenv('FYERS_SECRET_KEY')
 FYERS_REDIRECT_URI = "http://127.0.0.1:8000/callback/"
 
+# Per-symbol quote cache behind /api/stocks/
+QUOTE_CACHE_TTL_MS = int(os.getenv('QUOTE_CACHE_TTL_MS', '1000'))
+QUOTE_CACHE_MAX_SYMBOLS = int(os.getenv('QUOTE_CACHE_MAX_SYMBOLS', '5000'))
+
+# Upstream quote batching; Fyers accepts at most 50 symbols per quotes call
+FYERS_QUOTES_BATCH_SIZE = int(os.getenv('FYERS_QUOTES_BATCH_SIZE', '50'))
+FYERS_QUOTES_MAX_CONCURRENCY = int(os.getenv('FYERS_QUOTES_MAX_CONCURRENCY', '4'))
+FYERS_QUOTES_RATE_LIMIT = float(os.getenv('FYERS_QUOTES_RATE_LIMIT', '10'))
+
+# ws/stocks/ tick conflation; 0 sends every tick as it arrives. Clients can
+# override the interval per connection with ?conflate_ms=
+STREAM_CONFLATE_MS = int(os.getenv('STREAM_CONFLATE_MS', '0'))
+STREAM_MAX_PENDING_SYMBOLS = int(os.getenv('STREAM_MAX_PENDING_SYMBOLS', '500'))
+
+# Market depth is conflated on its own interval, ?depth_conflate_ms= per
+# connection; 0 sends every changed level as it arrives
+DEPTH_CONFLATE_MS = int(os.getenv('DEPTH_CONFLATE_MS', '200'))
+
+# Queue between the Fyers callback thread and the event loop. The overflow
+# policy is one of drop-oldest, drop-newest or block
+FEED_QUEUE_SIZE = int(os.getenv('FEED_QUEUE_SIZE', '10000'))
+FEED_OVERFLOW_POLICY = os.getenv('FEED_OVERFLOW_POLICY', 'drop-oldest')
+FEED_DRAIN_BATCH_SIZE = int(os.getenv('FEED_DRAIN_BATCH_SIZE', '500'))
+
+# Persist ticks from the feed to the market_tick table, written in bulk
+TICK_STORE_ENABLED = os.getenv('TICK_STORE_ENABLED', 'False') == 'True'
+TICK_STORE_BATCH_SIZE = int(os.getenv('TICK_STORE_BATCH_SIZE', '5000'))
+TICK_STORE_FLUSH_INTERVAL = float(os.getenv('TICK_STORE_FLUSH_INTERVAL', '1.0'))
+TICK_STORE_MAX_BUFFER = int(os.getenv('TICK_STORE_MAX_BUFFER', '200000'))
+
+# Live OHLCV candles built from the feed; closed candles kept in memory per
+# symbol and timeframe, and optionally written to the market_candle table
+CANDLE_HISTORY_SIZE = int(os.getenv('CANDLE_HISTORY_SIZE', '500'))
+CANDLE_STORE_ENABLED = os.getenv('CANDLE_STORE_ENABLED', 'False') == 'True'
+CANDLE_STORE_BATCH_SIZE = int(os.getenv('CANDLE_STORE_BATCH_SIZE', '2000'))
+CANDLE_STORE_FLUSH_INTERVAL = float(os.getenv('CANDLE_STORE_FLUSH_INTERVAL', '5.0'))
+
+# Append-only memory-mapped candle archive for long history range queries
+CANDLE_ARCHIVE_ENABLED = os.getenv('CANDLE_ARCHIVE_ENABLED', 'False') == 'True'
+CANDLE_ARCHIVE_DIR = os.getenv('CANDLE_ARCHIVE_DIR', str(BASE_DIR / 'data' / 'candles'))
+CANDLE_ARCHIVE_TIMEFRAMES = os.getenv('CANDLE_ARCHIVE_TIMEFRAMES', '1m,5m,15m,1h').split(',')
+CANDLE_ARCHIVE_FLUSH_INTERVAL = float(os.getenv('CANDLE_ARCHIVE_FLUSH_INTERVAL', '5.0'))
+
+# Fyers symbol-master CSVs used to validate and search symbols
+SYMBOL_MASTER_FILES = os.getenv(
+    'SYMBOL_MASTER_FILES', str(BASE_DIR / 'data' / 'symbols' / 'NSE_CM.csv')
+).split(',')
+
+WATCHLIST_MAX_SYMBOLS = int(os.getenv('WATCHLIST_MAX_SYMBOLS', '200'))
+
+# Volume alerts compare a closed 1m candle with the average of this many
+ALERT_VOLUME_WINDOW = int(os.getenv('ALERT_VOLUME_WINDOW', '20'))
+ALERT_MAX_RULES_PER_USER = int(os.getenv('ALERT_MAX_RULES_PER_USER', '500'))
+
+# Live portfolio P&L is pushed to each ws/portfolio/ stream at most this often
+PORTFOLIO_PUSH_INTERVAL_MS = int(os.getenv('PORTFOLIO_PUSH_INTERVAL_MS', '500'))
+PORTFOLIO_MAX_POSITIONS = int(os.getenv('PORTFOLIO_MAX_POSITIONS', '500'))
+
+# Paper trading: working orders per user, and how paper order state changes
+# and fills are batched into the database
+PAPER_MAX_WORKING_ORDERS = int(os.getenv('PAPER_MAX_WORKING_ORDERS', '200'))
+PAPER_STORE_BATCH_SIZE = int(os.getenv('PAPER_STORE_BATCH_SIZE', '1000'))
+PAPER_STORE_FLUSH_INTERVAL = float(os.getenv('PAPER_STORE_FLUSH_INTERVAL', '0.5'))
+
+# Default sampling interval of the runtime profiler (api/profiler/)
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', '10'))
+
+# Level of the app's own loggers. Per-tick and per-message logging is at
+# DEBUG with lazy %-formatting, so it costs a level check otherwise.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'app': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',